@@ -37,6 +37,8 @@ It also provides some nifty file-handling functions:
               URLs are automatically fetched, .bz2 files are transparently
               decompressed, and so-on.
 
+    :open_many:  opens many files at once using a pool of threads.
+
     :join:    concatenate multiple file-like objects together so that they
               act like a single file.
 
@@ -96,10 +98,11 @@ __ver_tuple__ = (__ver_major__,__ver_minor__,__ver_patch__,__ver_sub__)
 __version__ = "%d.%d.%d%s" % __ver_tuple__
 
 
-from StringIO import StringIO
-import urllib2
-import urlparse
-import tempfile
+import sys
+import types
+
+#  Other imports (urllib2, StringIO, the wrapper classes, ...) are deferred
+#  until they are actually needed, so that "import filelike" stays cheap.
 
 
 class NotReadableError(IOError):
@@ -449,6 +452,45 @@ class FileLikeBase(object):
         while data != "":
             data = self._do_read(self._bufsize)
         
+    def read_ranges(self,ranges,gap=None):
+        """Read several (offset,length) ranges from the file in one batch.
+
+        'ranges' must be a sequence of (offset,length) pairs giving absolute
+        positions within the file.  The ranges are sorted and any that are
+        adjacent, or separated by no more than 'gap' bytes, are merged so
+        that the minimum number of reads is performed.  The data for each
+        range is returned as a list of strings in the order requested; a
+        string will be short if its range extends past the end of the file.
+
+        If 'gap' is not given it defaults to the size of the read buffer.
+        The apparent position of the file pointer is not changed.
+        """
+        if self.closed:
+            raise IOError("File has been closed")
+        self._assert_mode("r")
+        if gap is None:
+            gap = self._bufsize
+        pos = self.tell()
+        try:
+            return _read_range_runs(self,ranges,gap)
+        finally:
+            self.seek(pos)
+
+    def peek(self,size):
+        """Look at up to 'size' bytes of the file without consuming them.
+
+        The data is read as usual, but is then pushed back onto the front
+        of the read buffer so that the file position is not advanced.  This
+        works even for files opened in streamed mode.
+        """
+        data = self.read(size)
+        if data:
+            if self._rbuffer:
+                self._rbuffer = data + self._rbuffer
+            else:
+                self._rbuffer = data
+        return data
+
     def readline(self,size=-1):
         """Read a line from the file, or at most <size> bytes."""
         bits = []
@@ -602,6 +644,57 @@ class FileLikeBase(object):
         raise NotTruncatableError("Object not truncatable")
 
 
+def _coalesce_ranges(ranges,gap=0):
+    """Merge (offset,length) ranges into runs that can be read at once.
+
+    Returns a list of (start,stop,members) tuples sorted by start offset,
+    where 'members' lists the (index,offset,length) of each requested
+    range contained in the run.
+    """
+    items = []
+    for (i,(offset,length)) in enumerate(ranges):
+        if offset < 0 or length < 0:
+            raise ValueError("Invalid range: %r" % ((offset,length),))
+        items.append((offset,length,i))
+    items.sort()
+    runs = []
+    for (offset,length,i) in items:
+        if runs and offset <= runs[-1][1] + gap:
+            run = runs[-1]
+            run[1] = max(run[1],offset + length)
+            run[2].append((i,offset,length))
+        else:
+            runs.append([offset,offset + length,[(i,offset,length)]])
+    return [tuple(run) for run in runs]
+
+
+def _read_range_runs(fileobj,ranges,gap=0):
+    """Read the given ranges from 'fileobj' using one seek/read per run."""
+    output = [None] * len(ranges)
+    for (start,stop,members) in _coalesce_ranges(ranges,gap):
+        fileobj.seek(start)
+        data = fileobj.read(stop - start)
+        for (i,offset,length) in members:
+            output[i] = data[offset-start:offset-start+length]
+    return output
+
+
+def _read_ranges(fileobj,ranges,gap=0):
+    """Read (offset,length) ranges from an arbitrary seekable file.
+
+    Objects providing their own read_ranges() method are delegated to,
+    otherwise the ranges are read with seek() and read() and the file's
+    original position is restored afterwards.
+    """
+    if hasattr(fileobj,"read_ranges"):
+        return fileobj.read_ranges(ranges,gap)
+    pos = fileobj.tell()
+    try:
+        return _read_range_runs(fileobj,ranges,gap)
+    finally:
+        fileobj.seek(pos)
+
+
 class Opener(object):
     """Class allowing clever opening of files.
     
@@ -611,31 +704,112 @@ class Opener(object):
     a file-like object representing that file, according to rules such
     as:
         
-        * URLs are opened using urllib2
+        * HTTP URLs are fetched over a pool of keep-alive connections
+        * "mem://" URLs name files in an in-memory filesystem
+        * other URLs are opened using urllib2
         * files with names ending in ".gz" are gunzipped on the fly
         * etc...
         
     The precise rules that are implemented are determined by two lists
-    of functions - openers and decoders.  First, each successive opener
-    function is called with the filename and mode until one returns non-None.
-    Theese functions must attempt to open the given filename and return it as
-    a filelike object.
-
-    Once the file has been opened, it is passed to each successive decoder
-    function.  These should return non-None if they perform some decoding
-    step on the file.  In this case, they must wrap and return the file-like
-    object, modifying its name if appropriate.
+    of functions - openers and decoders.  Opener functions must attempt to
+    open the given filename and return it as a filelike object, or return
+    None if they don't handle that filename.  Any additional keyword
+    arguments are passed through to those opener functions that accept
+    them, either by name or via **kwds (for example, 'parallel' requests
+    a segmented download of remote files).
+
+    Openers for specific URL schemes can be registered in a table using
+    register_opener(), with the empty scheme "" used for local paths.  The
+    opener registered for the filename's scheme is tried first; if there
+    is none, or it fails, each successive function in the list of openers
+    is called until one returns non-None.
+
+    Once the file has been opened, it is decoded by looking up wrapper
+    factories in two tables, both populated by register_decoder().  The
+    first maps filename suffixes (e.g. ".bz2") to a factory, and the second
+    maps "magic" byte strings found at the start of the file's contents.
+    Sniffing the contents uses a non-consuming peek, so it works even for
+    non-seekable streams.  Only the opened file itself is sniffed, and only
+    if no suffix matched; the output of a decoder is never sniffed, since
+    it may legitimately contain compressed data.
+
+    If no factory matches, the file is passed to each successive decoder
+    function in the list of decoders.  These should return non-None if they
+    perform some decoding step on the file.  In this case, they must wrap
+    and return the file-like object, modifying its name if appropriate.
+
+    Decoding is repeated until no further decoding step applies.
+
+    If the 'cache' attribute is set, it is called like an opener before
+    any of the opener functions, and may return a locally-cached copy of
+    the file.  Similarly, if the 'decoded_cache' attribute is set it may
+    return a previously-decoded copy of the file, and is given the result
+    of decoding it for later use.  Finally, if the 'handle_pool' attribute
+    is set, opened files are kept open in the pool and repeated opens of
+    the same file return a new view of the pooled file.  See the
+    filelike.cache module for suitable cache and pool objects.
     """
     
-    def __init__(self,openers=(),decoders=()):
+    def __init__(self,openers=(),decoders=(),cache=None,decoded_cache=None,
+                      handle_pool=None):
         self.openers = [o for o in openers]
         self.decoders = [d for d in decoders]
+        self.scheme_openers = {}
+        self.suffix_decoders = {}
+        self.magic_decoders = {}
+        self.cache = cache
+        self.decoded_cache = decoded_cache
+        self.handle_pool = handle_pool
+
+    def register_opener(self,opener,schemes=()):
+        """Register an opener function for the given URL schemes.
+
+        'opener' is called in preference to the generic opener functions
+        for filenames with one of the given 'schemes', e.g. "http".  The
+        empty scheme "" is used for plain local paths.
+        """
+        for scheme in schemes:
+            self.scheme_openers[scheme] = opener
+
+    def register_decoder(self,factory,suffixes=(),magic=()):
+        """Register a decoding wrapper for files matching the given rules.
+
+        'factory' must be a callable taking a file-like object and returning
+        the decoded version of it, e.g. a wrapper class such as UnBZip2.  It
+        is used for files whose name ends with one of 'suffixes', or whose
+        contents begin with one of the byte strings in 'magic'.  When matched
+        by suffix, the suffix is stripped from the name of the decoded file.
+        """
+        for suffix in suffixes:
+            self.suffix_decoders[suffix] = factory
+        for prefix in magic:
+            self.magic_decoders[prefix] = factory
     
-    def __call__(self,filename,mode="r"):
-        # Open the file
-        for o in self.openers:
+    def __call__(self,filename,mode="r",**kwds):
+        # Use an already-open copy of the file if there is one
+        hpool = self.handle_pool
+        if hpool is not None:
+            f = hpool.lookup(filename,mode)
+            if f is not None:
+                return f
+        # Use a previously-decoded copy of the file if there is one
+        dcache = self.decoded_cache
+        if dcache is not None:
+            f = dcache.lookup(filename,mode)
+            if f is not None:
+                if hpool is not None:
+                    f = hpool.store(filename,mode,f)
+                return f
+        # Open the file, trying the cache and the scheme's opener first
+        openers = self.openers
+        sopener = self.scheme_openers.get(_scheme(filename))
+        if sopener is not None:
+            openers = [sopener] + [o for o in openers if o is not sopener]
+        if self.cache is not None:
+            openers = [self.cache] + openers
+        for o in openers:
             try:
-                f = o(filename,mode)
+                f = o(filename,mode,**_opener_kwds(o,kwds))
             except IOError,e:
                 f = None
             if f is not None:
@@ -644,38 +818,256 @@ class Opener(object):
             raise IOError("Could not open file %s in mode '%s'" \
                                                         %(filename,mode))
         # Decode the file as many times as required
-        goAgain = True
-        while goAgain:
-            for d in self.decoders:
-                res = d(f)
-                if res is not None:
-                    f = res
-                    break
-            else:
-                goAgain = False
+        (f,decoded) = self._decode(f,mode,sniff=True)
+        if decoded:
+            while decoded:
+                (f,decoded) = self._decode(f,mode)
+            if dcache is not None:
+                f = dcache.store(filename,mode,f)
+        if hpool is not None:
+            f = hpool.store(filename,mode,f)
         # Return the final file object
         return f
 
-##  Create default Opener that uses urllib2.urlopen() and file() as openers
-def _urllib_opener(filename,mode):
+    def _decode(self,f,mode,sniff=False):
+        """Apply a single decoding step to the file 'f'.
+
+        Returns a tuple (f,decoded) giving the new file object and whether
+        a decoding step was applied.  The contents are sniffed for magic
+        bytes only if 'sniff' is true and no suffix matched.  The file object
+        may be replaced even when no decoding is done, if it had to be
+        wrapped for sniffing.
+        """
+        name = getattr(f,"name","")
+        # Look for a decoder matching the filename suffix
+        idx = name.rfind(".")
+        if idx >= 0 and self.suffix_decoders:
+            suffix = name[idx:]
+            factory = self.suffix_decoders.get(suffix)
+            if factory is not None:
+                res = factory(f)
+                res.name = name[:-len(suffix)]
+                return (res,True)
+        # Look for a decoder matching the file contents
+        if sniff and self.magic_decoders and "r" in mode:
+            sizes = sorted(set([len(m) for m in self.magic_decoders]))
+            (f,head) = _peek(f,sizes[-1],mode)
+            for size in reversed(sizes):
+                factory = self.magic_decoders.get(head[:size])
+                if factory is not None:
+                    res = factory(f)
+                    res.name = name
+                    return (res,True)
+        # Fall back to any generic decoder functions
+        for d in self.decoders:
+            res = d(f)
+            if res is not None:
+                return (res,True)
+        return (f,False)
+
+    def open_many(self,names,mode="r",workers=8,warm=0,ordered=True,**kwds):
+        """Open many files concurrently, using a pool of threads.
+
+        Each filename in 'names' is opened and decoded in one of 'workers'
+        threads, so that network round-trips and the initial reads done by
+        decoders overlap.  If 'warm' is given, the first 'warm' bytes of each
+        file are also peeked at in the worker thread.  File-like objects such
+        as decoders and remote files keep those bytes in their read buffer;
+        native files that can seek are simply read and rewound, which warms
+        only the operating system's cache.
+
+        This is a generator yielding a tuple (name,fileobj,error) for each
+        file.  If the file could not be opened then 'fileobj' is None and
+        'error' is the exception raised, so that one failure doesn't abort
+        the others.  Results are yielded in the order of 'names' if 'ordered'
+        is true, or as each file is opened otherwise.
+
+        If the generator is closed early, no more files are opened, and
+        any that were opened but not yet yielded are closed.
+        """
+        import threading
+        import Queue
+        names = list(names)
+        tasks = Queue.Queue()
+        results = Queue.Queue()
+        for item in enumerate(names):
+            tasks.put(item)
+        #  Set under 'lock' once the caller stops, after which no more
+        #  results are queued.
+        stopped = threading.Event()
+        lock = threading.Lock()
+        def worker():
+            while not stopped.isSet():
+                try:
+                    (i,name) = tasks.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    f = self(name,mode,**kwds)
+                    if warm:
+                        (f,_) = _peek(f,warm,mode)
+                    res = (name,f,None)
+                except Exception,e:
+                    res = (name,None,e)
+                lock.acquire()
+                try:
+                    if not stopped.isSet():
+                        results.put((i,res))
+                        continue
+                finally:
+                    lock.release()
+                if res[1] is not None:
+                    res[1].close()
+        for _ in xrange(min(workers,len(names))):
+            t = threading.Thread(target=worker)
+            t.setDaemon(True)
+            t.start()
+        pending = {}
+        nexti = 0
+        try:
+            for _ in xrange(len(names)):
+                (i,res) = results.get()
+                if not ordered:
+                    yield res
+                    continue
+                pending[i] = res
+                while nexti in pending:
+                    yield pending.pop(nexti)
+                    nexti += 1
+        finally:
+            lock.acquire()
+            try:
+                stopped.set()
+            finally:
+                lock.release()
+            unused = pending.values()
+            while True:
+                try:
+                    unused.append(results.get_nowait()[1])
+                except Queue.Empty:
+                    break
+            for (name,f,err) in unused:
+                if f is not None:
+                    f.close()
+
+
+def _opener_kwds(opener,kwds):
+    """Get those of the keyword arguments 'kwds' accepted by 'opener'."""
+    if not kwds:
+        return kwds
+    import inspect
+    func = opener
+    if not inspect.isfunction(func) and not inspect.ismethod(func):
+        func = getattr(opener,"__call__",None)
+    try:
+        (args,varargs,varkw,defaults) = inspect.getargspec(func)
+    except TypeError:
+        return {}
+    if varkw is not None:
+        return kwds
+    return dict([(k,v) for (k,v) in kwds.iteritems() if k in args])
+
+
+def _scheme(filename):
+    """Get the URL scheme of the given filename, or "" for a local path.
+
+    This is much cheaper than urlparse, since it's called for every file
+    that is opened.  Single-letter schemes are taken to be drive letters.
+    """
+    idx = filename.find(":")
+    if idx < 2:
+        return ""
+    scheme = filename[:idx]
+    for c in scheme:
+        if not c.isalnum() and c not in "+-.":
+            return ""
+    return scheme.lower()
+
+
+def _peek(f,size,mode):
+    """Look at the first 'size' bytes of 'f' without consuming them.
+
+    Returns a tuple (f,data) where 'data' is the peeked-at bytes.  Files
+    that are seekable are simply read and then rewound.  Other objects
+    may need to be wrapped in a FileWrapper to make this possible, so
+    the returned file object should be used in place of the original.
+    """
+    if not isinstance(f,FileLikeBase) and "-" not in mode:
+        try:
+            pos = f.tell()
+            data = f.read(size)
+            f.seek(pos)
+            return (f,data)
+        except (AttributeError,IOError):
+            pass
+    if not isinstance(f,FileLikeBase):
+        f = filelike.wrappers.FileWrapper(f,mode)
+    return (f,f.peek(size))
+
+##  Create default Opener that uses pooled HTTP connections, the in-memory
+##  filesystem, urllib2.urlopen() and file() as openers
+def _http_opener(filename,mode,**kwds):
+    if not filename.startswith("http://") and \
+       not filename.startswith("https://"):
+        return None
+    from filelike import remote
+    return remote.default_opener(filename,mode,**kwds)
+def _urllib_opener(filename,mode,**kwds):
     if mode not in ("r","r-"):
         return None
+    # plain local paths can't be URLs; don't bother importing urllib2
+    if ":" not in filename:
+        return None
+    import urlparse
     comps = urlparse.urlparse(filename)
     # ensure it's a URL
     if comps[0] == "":
         return None
+    import urllib2
     f = urllib2.urlopen(filename)
     f.name = f.geturl()
     f.mode = mode
     return f
-def _file_opener(filename,mode):
+def _file_opener(filename,mode,**kwds):
     # Dont open URLS as local files
-    comps = urlparse.urlparse(filename)
-    if comps[0] and comps[1]:
-        return None
+    if ":" in filename:
+        import urlparse
+        comps = urlparse.urlparse(filename)
+        if comps[0] and comps[1]:
+            return None
     return file(filename,mode)
+def _mem_opener(filename,mode,**kwds):
+    from filelike import memfs
+    return memfs.default_fs(filename,mode,**kwds)
+
+def _lazy_wrapper(name):
+    """Create a factory for the named wrapper class, imported on demand.
+
+    This allows decoders to be registered without importing the codecs
+    they depend on until a matching file is actually opened.
+    """
+    def factory(fileobj):
+        return getattr(filelike.wrappers,name)(fileobj)
+    return factory
 
 open = Opener(openers=(_urllib_opener,_file_opener))
+open.register_opener(_file_opener,schemes=("",))
+open.register_opener(_http_opener,schemes=("http","https"))
+open.register_opener(_mem_opener,schemes=("mem",))
+#  A bzip2 stream is "BZh" and a block size digit, followed by the magic
+#  number of either the first block or the end-of-stream marker.
+open.register_decoder(_lazy_wrapper("UnBZip2"),suffixes=(".bz2",),
+                      magic=["BZh%d%s" % (i,m) for i in xrange(1,10)
+                                           for m in ("1AY&SY","\x17rE8P\x90")])
+open.register_decoder(_lazy_wrapper("UnGZip"),suffixes=(".gz",),
+                      magic=("\x1f\x8b\x08",))
+
+def open_many(names,mode="r",workers=8,warm=0,ordered=True,**kwds):
+    """Open many files concurrently using the default Opener.
+
+    See Opener.open_many for details.
+    """
+    return open.open_many(names,mode,workers,warm,ordered,**kwds)
 
 
 def is_filelike(obj,mode="rw"):
@@ -792,6 +1184,61 @@ class join(FileLikeBase):
         else:
             return data
 
+    def read_ranges(self,ranges,gap=None):
+        """Read several (offset,length) ranges from the joined files.
+
+        Each range is split across the underlying files as necessary,
+        and the resulting pieces are read in one batch per file.
+        """
+        if self.closed:
+            raise IOError("File has been closed")
+        self._assert_mode("r")
+        if gap is None:
+            gap = self._bufsize
+        if self._wbuffer:
+            self.flush()
+        # Map each requested range onto (file,offset,length) pieces
+        for (offset,length) in ranges:
+            if offset < 0 or length < 0:
+                raise ValueError("Invalid range: %r" % ((offset,length),))
+        pieces = [[] for _ in self._files]
+        order = [[] for _ in ranges]
+        fstart = 0
+        for (fidx,f) in enumerate(self._files):
+            fstop = fstart + self._file_size(f)
+            last = (fidx == len(self._files) - 1)
+            for (i,(offset,length)) in enumerate(ranges):
+                lo = max(offset,fstart)
+                hi = offset + length
+                if not last:
+                    hi = min(hi,fstop)
+                if lo < hi:
+                    order[i].append((fidx,len(pieces[fidx])))
+                    pieces[fidx].append((lo - fstart,hi - lo))
+            fstart = fstop
+        # Read the pieces from each file and reassemble them in order
+        results = []
+        for (f,fpieces) in zip(self._files,pieces):
+            if fpieces:
+                results.append(_read_ranges(f,fpieces,gap))
+            else:
+                results.append([])
+        output = []
+        for parts in order:
+            output.append("".join([results[fidx][j] for (fidx,j) in parts]))
+        return output
+
+    def _file_size(self,f):
+        """Determine the size of one of the underlying files."""
+        try:
+            return f.size
+        except AttributeError:
+            pos = f.tell()
+            f.seek(0,2)
+            size = f.tell()
+            f.seek(pos,0)
+            return size
+
     def _write(self,data,flushing=False):
         cf = self._files[self._curFile]
         # If we're at the last file, just write it all out
@@ -800,12 +1247,7 @@ class join(FileLikeBase):
             return None
         # Otherwise, we may need to write into multiple files
         pos = cf.tell()
-        try:
-            size = cf.size
-        except AttributeError:
-            cf.seek(0,2)
-            size = cf.tell()
-            cf.seek(pos,0)
+        size = self._file_size(cf)
         # If the data will all fit in the current file, just write it
         gap = size - pos
         if gap >= len(data):
@@ -886,6 +1328,7 @@ def to_filelike(obj,mode="r+"):
         return obj
     # Strings can be wrapped using StringIO
     if isinstance(obj,basestring):
+        from StringIO import StringIO
         return StringIO(obj)
     # Anything with read() and/or write() can be trivially wrapped
     hasRead = hasattr(obj,"read")
@@ -910,5 +1353,37 @@ def to_filelike(obj,mode="r+"):
     # TODO: lots more could be done here...
     raise ValueError("Could not make object file-like: %s", (obj,))
 
+class _LazyModule(types.ModuleType):
+    """Module object whose missing attributes are computed on first access.
+
+    This is used by the wrappers and pipeline subpackages to defer importing
+    their classes until they are actually used.  The function 'resolve' is
+    called with the name of any attribute not found on the module, and must
+    either return its value or raise AttributeError.
+    """
+
+    def __init__(self,module,resolve):
+        super(_LazyModule,self).__init__(module.__name__,module.__doc__)
+        self.__dict__.update(module.__dict__)
+        #  Python clears the globals of a module when it is garbage
+        #  collected, so the original module must be kept alive.
+        self._eager_module = module
+        self._resolve = resolve
+
+    def __getattr__(self,name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        value = self._resolve(name)
+        setattr(self,name,value)
+        return value
+
+
+def _make_lazy_module(name,resolve):
+    """Replace the named module with a _LazyModule using 'resolve'."""
+    module = _LazyModule(sys.modules[name],resolve)
+    sys.modules[name] = module
+    return module
+
+
 # Imported here to aoid circular imports
 import filelike.wrappers
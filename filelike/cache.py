@@ -0,0 +1,562 @@
+# filelike/cache.py
+#
+# Copyright (C) 2006-2009, Ryan Kelly
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+#
+"""
+
+    filelike.cache:  local disk caches for use with filelike.open
+
+This module provides caches that can be attached to a filelike.Opener to
+avoid repeatedly fetching or decoding the same data.  They are opt-in;
+for example, to cache remote files fetched by filelike.open:
+
+    filelike.open.cache = URLCache("/var/cache/myapp",max_size=2**30)
+
+Cached files are stored in a local directory and served as plain local
+files, so they support seek() and can be mmapped.  The cache directory can
+safely be shared between processes: entries are written to a temporary file
+and renamed into place, so readers never see partial data.
+
+The classes provided are:
+
+    * DiskCache:  a size-bounded directory of files with LRU eviction,
+                  the base class for the caches below
+
+    * URLCache:   cache of remote files, keyed by URL and revalidated
+                  using conditional requests
+
+    * DecodedCache:  cache of the decoded contents of local compressed
+                     files, keyed by path, modification time and size
+
+    * HandlePool:  pool of open read-only file objects, shared by repeated
+                   opens of the same file through independent views
+
+"""
+
+import os
+import errno
+import fnmatch
+import tempfile
+import threading
+import json
+from hashlib import sha1
+from collections import OrderedDict
+
+from filelike import FileLikeBase
+
+
+def _is_local(filename):
+    """Check whether the given filename names a local file, not a URL."""
+    if ":" in filename:
+        import urlparse
+        comps = urlparse.urlparse(filename)
+        if comps[0] and comps[1]:
+            return False
+    return True
+
+
+class DiskCache(object):
+    """Size-bounded directory of cached files, evicted in LRU order.
+
+    Each entry consists of a data file and a small metadata file, both
+    named from a hash of the entry's key.  Whenever an entry is used its
+    modification time is updated, and when the total size of the data
+    files exceeds 'max_size' bytes the least-recently-used entries are
+    removed.
+
+    All updates are performed by writing to a temporary file in the cache
+    directory and then renaming it into place, so that several processes
+    can share the same cache directory.
+    """
+
+    def __init__(self,directory,max_size=1024*1024*1024):
+        self.directory = directory
+        self.max_size = max_size
+        try:
+            os.makedirs(directory)
+        except OSError,e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _hash(self,key):
+        """Get the hex digest used to name files for the given key."""
+        if isinstance(key,unicode):
+            key = key.encode("utf8")
+        return sha1(key).hexdigest()
+
+    def _meta_path(self,key):
+        return os.path.join(self.directory,self._hash(key) + ".meta")
+
+    def data_path(self,name):
+        """Get the full path of the named data file."""
+        return os.path.join(self.directory,name)
+
+    def get_meta(self,key):
+        """Get the metadata dict stored for the given key, or None."""
+        return self._read_meta(self._meta_path(key))
+
+    def _read_meta(self,path):
+        try:
+            f = open(path,"rb")
+        except IOError:
+            return None
+        try:
+            try:
+                return json.loads(f.read())
+            except ValueError:
+                return None
+        finally:
+            f.close()
+
+    def set_meta(self,key,meta):
+        """Atomically store the metadata dict for the given key."""
+        (fd,tmpnm) = tempfile.mkstemp(dir=self.directory,prefix=".tmp-")
+        try:
+            os.write(fd,json.dumps(meta))
+        finally:
+            os.close(fd)
+        os.rename(tmpnm,self._meta_path(key))
+
+    def open_data(self,name):
+        """Open the named data file for reading, marking it as used.
+
+        Returns None if the file has been removed from the cache.
+        """
+        path = self.data_path(name)
+        try:
+            f = open(path,"rb")
+        except IOError:
+            return None
+        try:
+            os.utime(path,None)
+        except OSError:
+            pass
+        return f
+
+    def write_data(self,name,fileobj,chunksize=1024*64):
+        """Atomically store the contents of 'fileobj' as the named file.
+
+        The data is copied from 'fileobj' in chunks, then renamed into
+        place.  The new file is opened for reading and returned, and the
+        cache is then pruned back to its maximum size.  The returned file
+        remains readable even if it is itself evicted.
+        """
+        (fd,tmpnm) = tempfile.mkstemp(dir=self.directory,prefix=".tmp-")
+        try:
+            f = os.fdopen(fd,"wb")
+            try:
+                data = fileobj.read(chunksize)
+                while data != "":
+                    f.write(data)
+                    data = fileobj.read(chunksize)
+            finally:
+                f.close()
+            os.rename(tmpnm,self.data_path(name))
+        except Exception:
+            try:
+                os.unlink(tmpnm)
+            except OSError:
+                pass
+            raise
+        f = open(self.data_path(name),"rb")
+        self.evict()
+        return f
+
+    def size(self):
+        """Get the total size of the data files in the cache."""
+        return sum([sz for (_,sz,_) in self._entries()])
+
+    def _entries(self):
+        """List (mtime,size,name) for each data file in the cache."""
+        entries = []
+        for nm in os.listdir(self.directory):
+            if nm.startswith(".") or nm.endswith(".meta"):
+                continue
+            try:
+                st = os.stat(self.data_path(nm))
+            except OSError:
+                # Removed by a concurrent process
+                continue
+            entries.append((st.st_mtime,st.st_size,nm))
+        return entries
+
+    def evict(self,max_size=None):
+        """Remove least-recently-used files until under the size limit."""
+        if max_size is None:
+            max_size = self.max_size
+        entries = self._entries()
+        entries.sort()
+        total = sum([sz for (_,sz,_) in entries])
+        for (_,sz,nm) in entries:
+            if total <= max_size:
+                break
+            try:
+                os.unlink(self.data_path(nm))
+            except OSError:
+                pass
+            else:
+                self._evicted(nm)
+            total -= sz
+
+    def _evicted(self,name):
+        """Clean up after the named data file has been evicted."""
+        pass
+
+
+class URLCache(DiskCache):
+    """Cache of remote files fetched by filelike.open.
+
+    Instances of this class can be assigned to the 'cache' attribute of
+    a filelike.Opener.  Read-only opens of http:// and https:// URLs are
+    then served from the cache directory.  Each file is stored under a
+    name derived from its URL and its ETag/Last-Modified headers, and is
+    revalidated on each open using a conditional request.  Only if the
+    remote file has changed is it downloaded again.
+
+    Files served from the cache are plain local files.  Responses without
+    an ETag or Last-Modified header can't be revalidated, so they are not
+    cached.
+    """
+
+    def __init__(self,directory,max_size=1024*1024*1024,pool=None):
+        super(URLCache,self).__init__(directory,max_size)
+        self.pool = pool
+
+    def __call__(self,filename,mode="r",**kwds):
+        """Open the given URL via the cache, or return None."""
+        if mode not in ("r","r-"):
+            return None
+        if not filename.startswith("http://") and \
+           not filename.startswith("https://"):
+            return None
+        from filelike import remote
+        pool = self.pool
+        if pool is None:
+            pool = remote.default_pool
+        meta = self.get_meta(filename)
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        (url,key,conn,resp) = pool.request("GET",filename,headers)
+        if resp.status == 304 and meta is not None:
+            resp.read()
+            pool.release(key,conn,resp)
+            f = self.open_data(meta["name"])
+            if f is not None:
+                return f
+            #  Evicted since we last looked, so fetch it again.
+            self.set_meta(filename,{})
+            return self(filename,mode,**kwds)
+        if resp.status != 200:
+            resp.read()
+            pool.release(key,conn,resp)
+            raise IOError("HTTP error %d: %s" % (resp.status,url))
+        body = remote.HTTPResponseFile(pool,url,key,conn,resp,mode)
+        etag = resp.getheader("etag")
+        last_modified = resp.getheader("last-modified")
+        if not etag and not last_modified:
+            return body
+        name = self._data_name(filename,etag,last_modified)
+        try:
+            f = self.write_data(name,body)
+        finally:
+            body.close()
+        self.set_meta(filename,{"name": name,"etag": etag,
+                                "last_modified": last_modified})
+        #  Remove the data for any previous version of the file.
+        if meta and meta.get("name") and meta["name"] != name:
+            try:
+                os.unlink(self.data_path(meta["name"]))
+            except OSError:
+                pass
+        return f
+
+    def _data_name(self,url,etag,last_modified):
+        """Get the name of the data file for a particular version of a URL.
+
+        The name is the hash of the URL that also names its metadata file,
+        a hash of its validators, and the URL's basename so that suffix-based
+        decoders still apply.
+        """
+        key = "\0".join([etag or "",last_modified or ""])
+        basename = url.split("?")[0].rstrip("/").split("/")[-1]
+        basename = "".join([c for c in basename if c.isalnum() or c in "._-"])
+        return "-".join([self._hash(url),self._hash(key)[:16],basename])
+
+    def _evicted(self,name):
+        #  Remove the metadata too, unless it now refers to a newer version
+        path = os.path.join(self.directory,name.split("-")[0] + ".meta")
+        meta = self._read_meta(path)
+        if meta is not None and meta.get("name") == name:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+class DecodedCache(DiskCache):
+    """Cache of the decoded contents of local files.
+
+    Instances of this class can be assigned to the 'decoded_cache'
+    attribute of a filelike.Opener.  When a local file is opened for
+    reading and one or more decoding steps are applied (for example,
+    bunzipping a ".bz2" file) the decoded data is written out to the cache
+    directory.  Later opens of the same file then return the decoded copy
+    as a plain, seekable local file without decoding it again.
+
+    Entries are keyed by the absolute path, modification time and size of
+    the original file, so they are not used once the file changes.  Which
+    files are cached can be limited using 'max_file_size', the largest
+    original file size to cache, and 'patterns', a list of glob patterns
+    at least one of which the filename must match.
+    """
+
+    def __init__(self,directory,max_size=1024*1024*1024,max_file_size=None,
+                      patterns=None):
+        super(DecodedCache,self).__init__(directory,max_size)
+        self.max_file_size = max_file_size
+        self.patterns = patterns
+
+    def _data_name(self,filename,mode):
+        """Get the name of the data file for the given file, or None.
+
+        None is returned if the file is not eligible for caching.
+        """
+        if mode not in ("r","r-") or not _is_local(filename):
+            return None
+        if self.patterns is not None:
+            for pattern in self.patterns:
+                if fnmatch.fnmatch(filename,pattern):
+                    break
+            else:
+                return None
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        if self.max_file_size is not None:
+            if st.st_size > self.max_file_size:
+                return None
+        path = os.path.abspath(filename)
+        return self._hash("\0".join([path,repr(st.st_mtime),str(st.st_size)]))
+
+    def lookup(self,filename,mode="r"):
+        """Get the decoded copy of the given file, or None if not cached."""
+        name = self._data_name(filename,mode)
+        if name is None:
+            return None
+        return self.open_data(name)
+
+    def store(self,filename,mode,fileobj):
+        """Store the decoded contents of the given file.
+
+        'fileobj' must be the decoded file as opened from 'filename'.  Its
+        contents are copied into the cache and it is closed, and the cached
+        copy is returned.  If the file is not eligible for caching then
+        'fileobj' is returned unchanged.
+        """
+        name = self._data_name(filename,mode)
+        if name is None:
+            return fileobj
+        try:
+            return self.write_data(name,fileobj)
+        finally:
+            fileobj.close()
+
+
+class HandlePool(object):
+    """Pool of open read-only file objects, for reuse by later opens.
+
+    Instances of this class can be assigned to the 'handle_pool' attribute
+    of a filelike.Opener.  Each local file opened for reading in mode "r"
+    is then kept open in the pool, and later opens of the same file return
+    a new view of the pooled file object rather than opening and decoding
+    the file again.  Each view has its own file position, and reads from
+    the shared object under a lock.
+
+    Pooled files are keyed by path and mode, and are discarded once the
+    file's inode, modification time or size changes.  At most 'max_handles'
+    files are kept in the pool, with the least recently used being closed
+    once all views of them have been closed.
+    """
+
+    def __init__(self,max_handles=64):
+        self.max_handles = max_handles
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self,filename,mode):
+        """Get the (key,ident) pair for the given file, or (None,None).
+
+        The key identifies the pooled file, while the ident changes
+        whenever the file itself is modified or replaced.
+        """
+        if mode != "r" or not _is_local(filename):
+            return (None,None)
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return (None,None)
+        key = (os.path.abspath(filename),mode)
+        return (key,(st.st_dev,st.st_ino,st.st_mtime,st.st_size))
+
+    def __len__(self):
+        return len(self._handles)
+
+    def lookup(self,filename,mode="r"):
+        """Get a new view of the pooled file, or None if not pooled."""
+        (key,ident) = self._key(filename,mode)
+        if key is None:
+            return None
+        self._lock.acquire()
+        try:
+            handle = self._handles.pop(key,None)
+            if handle is None:
+                return None
+            if handle.ident != ident:
+                handle.retire()
+                return None
+            self._handles[key] = handle
+            return _PooledView(handle)
+        finally:
+            self._lock.release()
+
+    def store(self,filename,mode,fileobj):
+        """Add an opened file to the pool.
+
+        'fileobj' must be the result of opening 'filename'.  If it can be
+        pooled, a view of it is returned; otherwise 'fileobj' is returned
+        unchanged.
+        """
+        (key,ident) = self._key(filename,mode)
+        if key is None:
+            return fileobj
+        handle = _PooledHandle(fileobj,ident)
+        self._lock.acquire()
+        try:
+            old = self._handles.pop(key,None)
+            if old is not None:
+                old.retire()
+            self._handles[key] = handle
+            while len(self._handles) > self.max_handles:
+                self._handles.popitem(last=False)[1].retire()
+            return _PooledView(handle)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Remove all files from the pool."""
+        self._lock.acquire()
+        try:
+            handles = self._handles.values()
+            self._handles.clear()
+        finally:
+            self._lock.release()
+        for handle in handles:
+            handle.retire()
+
+
+class _PooledHandle(object):
+    """A file object held in a HandlePool, with a count of its views."""
+
+    def __init__(self,fileobj,ident):
+        self.fileobj = fileobj
+        self.ident = ident
+        self.lock = threading.Lock()
+        self.views = 0
+        self.retired = False
+
+    def acquire(self):
+        self.lock.acquire()
+        try:
+            self.views += 1
+        finally:
+            self.lock.release()
+
+    def release(self):
+        self.lock.acquire()
+        try:
+            self.views -= 1
+            if self.retired and self.views == 0:
+                self.fileobj.close()
+        finally:
+            self.lock.release()
+
+    def retire(self):
+        """Remove from the pool, closing the file once it has no views."""
+        self.lock.acquire()
+        try:
+            self.retired = True
+            if self.views == 0:
+                self.fileobj.close()
+        finally:
+            self.lock.release()
+
+
+class _PooledView(FileLikeBase):
+    """Read-only view of a pooled file object, with its own position."""
+
+    def __init__(self,handle):
+        super(_PooledView,self).__init__()
+        self._handle = handle
+        self._pos = 0
+        self.name = getattr(handle.fileobj,"name","<pooled>")
+        self.mode = "r"
+        handle.acquire()
+
+    def close(self):
+        super(_PooledView,self).close()
+        if getattr(self,"_handle",None) is not None:
+            self._handle.release()
+            self._handle = None
+
+    def _read(self,sizehint=-1):
+        if sizehint <= 0:
+            sizehint = self._bufsize
+        handle = self._handle
+        handle.lock.acquire()
+        try:
+            if handle.fileobj.tell() != self._pos:
+                handle.fileobj.seek(self._pos)
+            data = handle.fileobj.read(sizehint)
+        finally:
+            handle.lock.release()
+        if data == "":
+            return None
+        self._pos += len(data)
+        return data
+
+    def _seek(self,offset,whence):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        else:
+            handle = self._handle
+            handle.lock.acquire()
+            try:
+                handle.fileobj.seek(offset,whence)
+                self._pos = handle.fileobj.tell()
+            finally:
+                handle.lock.release()
+
+    def _tell(self):
+        return self._pos
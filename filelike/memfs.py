@@ -0,0 +1,211 @@
+# filelike/memfs.py
+#
+# Copyright (C) 2006-2009, Ryan Kelly
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+#
+"""
+
+    filelike.memfs:  an in-memory filesystem for use with filelike.open
+
+This module provides a simple filesystem whose files are held entirely in
+memory, so that intermediate results can be written and read back by name
+without touching the disk.  The default instance is available to
+filelike.open() using "mem://" URLs:
+
+    f = filelike.open("mem://results/part1.txt","w")
+    f.write("some data")
+    f.close()
+    print filelike.open("mem://results/part1.txt").read()
+
+Each file may be opened several times at once, and each open file object
+has its own file position.  Data written through one file object is
+visible to the others once it has been flushed.
+
+The classes provided are:
+
+    * MemoryFS:    a named collection of in-memory files, which may also
+                   be used as an opener function for filelike.Opener
+
+    * MemoryFile:  a file-like object reading and writing one of the files
+                   in a MemoryFS
+
+"""
+
+import errno
+import threading
+
+from filelike import FileLikeBase
+
+
+class _MemoryData(object):
+    """The contents of a single in-memory file."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.lock = threading.Lock()
+
+
+class MemoryFS(object):
+    """A named collection of in-memory files.
+
+    Files are created by opening them in a writable mode, exactly as with
+    the builtin open() function.  Instances are also callable as opener
+    functions, handling filenames of the form "mem://<name>".
+    """
+
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def __call__(self,filename,mode="r",**kwds):
+        if not filename.startswith("mem://"):
+            return None
+        return self.open(filename[len("mem://"):],mode)
+
+    def open(self,name,mode="r"):
+        """Open the named file, returning a MemoryFile object."""
+        self._lock.acquire()
+        try:
+            data = self._files.get(name)
+            if data is None:
+                if "w" not in mode and "a" not in mode:
+                    raise IOError(errno.ENOENT,"No such file",name)
+                data = self._files[name] = _MemoryData()
+        finally:
+            self._lock.release()
+        return MemoryFile(data,"mem://" + name,mode)
+
+    def exists(self,name):
+        """Check whether the named file exists."""
+        return name in self._files
+
+    def remove(self,name):
+        """Remove the named file.
+
+        Any file objects that already have the file open can continue to
+        use it, as with files on disk.
+        """
+        self._lock.acquire()
+        try:
+            try:
+                del self._files[name]
+            except KeyError:
+                raise IOError(errno.ENOENT,"No such file",name)
+        finally:
+            self._lock.release()
+
+    def rename(self,src,dst):
+        """Rename a file, replacing any existing file of the new name."""
+        self._lock.acquire()
+        try:
+            try:
+                self._files[dst] = self._files.pop(src)
+            except KeyError:
+                raise IOError(errno.ENOENT,"No such file",src)
+        finally:
+            self._lock.release()
+
+    def listdir(self,prefix=""):
+        """List the names of all files beginning with the given prefix."""
+        return sorted([nm for nm in self._files if nm.startswith(prefix)])
+
+    def getsize(self,name):
+        """Get the size of the named file."""
+        try:
+            return len(self._files[name].data)
+        except KeyError:
+            raise IOError(errno.ENOENT,"No such file",name)
+
+    def clear(self):
+        """Remove all files."""
+        self._lock.acquire()
+        try:
+            self._files.clear()
+        finally:
+            self._lock.release()
+
+
+class MemoryFile(FileLikeBase):
+    """File-like object reading and writing an in-memory file.
+
+    Instances are created by MemoryFS.open(), and support all the usual
+    modes including seeking and truncation.
+    """
+
+    def __init__(self,data,name,mode="r"):
+        super(MemoryFile,self).__init__()
+        self._data = data
+        self.name = name
+        self.mode = mode
+        if "w" in mode:
+            self._truncate(0)
+        if "a" in mode:
+            self._pos = len(data.data)
+        else:
+            self._pos = 0
+
+    def _read(self,sizehint=-1):
+        if sizehint <= 0:
+            sizehint = self._bufsize
+        self._data.lock.acquire()
+        try:
+            chunk = str(self._data.data[self._pos:self._pos+sizehint])
+        finally:
+            self._data.lock.release()
+        if chunk == "":
+            return None
+        self._pos += len(chunk)
+        return chunk
+
+    def _write(self,string,flushing=False):
+        self._data.lock.acquire()
+        try:
+            buf = self._data.data
+            if "a" in self.mode:
+                self._pos = len(buf)
+            elif self._pos > len(buf):
+                buf.extend("\x00" * (self._pos - len(buf)))
+            buf[self._pos:self._pos+len(string)] = string
+        finally:
+            self._data.lock.release()
+        self._pos += len(string)
+
+    def _seek(self,offset,whence):
+        if whence == 1:
+            offset = self._pos + offset
+        elif whence == 2:
+            offset = len(self._data.data) + offset
+        if offset < 0:
+            raise IOError(errno.EINVAL,"Invalid seek offset")
+        self._pos = offset
+
+    def _tell(self):
+        return self._pos
+
+    def _truncate(self,size):
+        self._data.lock.acquire()
+        try:
+            buf = self._data.data
+            if size < len(buf):
+                del buf[size:]
+            else:
+                buf.extend("\x00" * (size - len(buf)))
+        finally:
+            self._data.lock.release()
+
+
+default_fs = MemoryFS()
@@ -224,15 +224,21 @@ def pipeline(cls):
     return create_entry
 
 
-##  Create a PipelineEntry factory for each wrapper
-##  defined in filelike.wrappers
+##  Create a PipelineEntry factory for each wrapper defined in
+##  filelike.wrappers.  These are created on first access, so that
+##  the wrapper classes themselves needn't be imported up-front.
 from filelike import wrappers
-for nm in dir(wrappers):
-    cls = getattr(wrappers,nm)
-    try:
-        if issubclass(cls,wrappers.FileWrapper):
-            if cls is not wrappers.FileWrapper:
-                globals()[nm] = pipeline(cls)
-    except TypeError:
-        pass
 
+__all__ = ["PipelineEntry","PipelineStack","pipeline"]
+__all__.extend([nm for nm in wrappers.__all__ if nm != "FileWrapper"])
+
+def _resolve(name):
+    """Create the PipelineEntry factory for the named wrapper class."""
+    if name not in wrappers.__all__ or name == "FileWrapper":
+        raise AttributeError(name)
+    cls = getattr(wrappers,name)
+    if not issubclass(cls,wrappers.FileWrapper):
+        raise AttributeError(name)
+    return pipeline(cls)
+
+filelike._make_lazy_module(__name__,_resolve)
@@ -0,0 +1,583 @@
+# filelike/remote.py
+#
+# Copyright (C) 2006-2009, Ryan Kelly
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+#
+"""
+
+    filelike.remote:  file-like access to remote files over HTTP
+
+This module provides the HTTP backend used by filelike.open().  Rather than
+calling urllib2.urlopen() for each file, it keeps a pool of persistent
+connections to each host, so that opening many small files from the same
+server doesn't pay for a fresh TCP connection (and TLS handshake) each time.
+
+The main classes are:
+
+    * ConnectionPool:    a per-host pool of keep-alive HTTP connections
+
+    * HTTPOpener:        an opener function for use with filelike.Opener
+
+    * HTTPResponseFile:  a file-like view of an HTTP response, which gives
+                         its connection back to the pool once it has been
+                         read to EOF or closed
+
+    * HTTPRangeFile:     a seekable file-like view of a remote file, which
+                         reads fixed-size blocks using Range requests and
+                         keeps recently-used blocks in an LRU cache
+
+    * SegmentedHTTPFile: a file-like view of a remote file that is being
+                         downloaded as several concurrent Range requests,
+                         readable from the front while the download is
+                         still in progress
+
+"""
+
+import socket
+import threading
+import tempfile
+import httplib
+import urlparse
+from collections import OrderedDict
+
+import filelike
+from filelike import FileLikeBase
+
+
+class ConnectionPool(object):
+    """Pool of persistent HTTP connections, keyed by host.
+
+    Connections are checked out of the pool with get() and returned to it
+    with put().  At most 'maxsize' idle connections are kept for each host;
+    any extra connections are closed when they are returned.
+    """
+
+    def __init__(self,maxsize=4,timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def _key(self,url):
+        """Get the (scheme,netloc) pool key for the given URL."""
+        comps = urlparse.urlsplit(url)
+        if comps[0] not in ("http","https"):
+            raise ValueError("Not an HTTP URL: %s" % (url,))
+        return (comps[0],comps[1])
+
+    def get(self,key):
+        """Get a connection for the given (scheme,netloc) key.
+
+        Returns a tuple (conn,reused) indicating whether the connection
+        was taken from the pool or newly created.
+        """
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle:
+                return (idle.pop(),True)
+        finally:
+            self._lock.release()
+        (scheme,netloc) = key
+        if scheme == "https":
+            conn = httplib.HTTPSConnection(netloc,timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(netloc,timeout=self.timeout)
+        return (conn,False)
+
+    def put(self,key,conn):
+        """Return a connection to the pool, once its response is read."""
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key,[])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def idle_count(self,key=None):
+        """Get the number of idle connections, optionally for one key."""
+        self._lock.acquire()
+        try:
+            if key is not None:
+                return len(self._idle.get(key,()))
+            return sum([len(idle) for idle in self._idle.itervalues()])
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Close all idle connections in the pool."""
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._lock.release()
+        for conns in idle.itervalues():
+            for conn in conns:
+                conn.close()
+
+    def request(self,method,url,headers=None,max_redirects=5):
+        """Perform an HTTP request using a pooled connection.
+
+        Redirects are followed automatically.  Returns a tuple
+        (url,key,conn,response) giving the final URL, the pool key and
+        connection used, and the response object.  The connection must be
+        returned to the pool with put() once the response has been read.
+        """
+        if headers is None:
+            headers = {}
+        for _ in xrange(max_redirects + 1):
+            key = self._key(url)
+            comps = urlparse.urlsplit(url)
+            path = urlparse.urlunsplit(("","",comps[2] or "/",comps[3],""))
+            (conn,reused) = self.get(key)
+            try:
+                conn.request(method,path,headers=headers)
+                resp = conn.getresponse()
+            except (httplib.HTTPException,socket.error):
+                #  A pooled connection may have been closed by the server
+                #  while idle.  Retry once with a fresh connection.
+                conn.close()
+                if not reused:
+                    raise
+                (conn,reused) = self.get_new(key)
+                conn.request(method,path,headers=headers)
+                resp = conn.getresponse()
+            if resp.status in (301,302,303,307) and \
+               resp.getheader("location"):
+                resp.read()
+                self.release(key,conn,resp)
+                url = urlparse.urljoin(url,resp.getheader("location"))
+                if resp.status == 303:
+                    method = "GET"
+                continue
+            return (url,key,conn,resp)
+        raise IOError("Too many redirects: %s" % (url,))
+
+    def get_new(self,key):
+        """Get a newly-created connection for the given key."""
+        self._lock.acquire()
+        try:
+            idle = self._idle.pop(key,[])
+        finally:
+            self._lock.release()
+        for conn in idle:
+            conn.close()
+        return self.get(key)
+
+    def release(self,key,conn,resp):
+        """Release a connection whose response has been fully read."""
+        if resp.will_close:
+            conn.close()
+        else:
+            self.put(key,conn)
+
+
+class HTTPResponseFile(FileLikeBase):
+    """File-like object reading the body of an HTTP response.
+
+    The connection used for the response is given back to its pool when
+    the body has been read through to EOF.  If the file is closed before
+    then, the connection is discarded since its remaining data is unread.
+    """
+
+    def __init__(self,pool,url,key,conn,resp,mode="r-"):
+        super(HTTPResponseFile,self).__init__()
+        self.name = url
+        self.mode = mode
+        self.headers = resp.msg
+        self.status = resp.status
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+
+    def geturl(self):
+        return self.name
+
+    def info(self):
+        return self.headers
+
+    def close(self):
+        super(HTTPResponseFile,self).close()
+        if getattr(self,"_conn",None) is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _release(self):
+        """Give our connection back to the pool."""
+        if self._conn is not None:
+            self._pool.release(self._key,self._conn,self._resp)
+            self._conn = None
+
+    def _read(self,sizehint=-1):
+        if self._conn is None:
+            return None
+        if sizehint <= 0:
+            sizehint = self._bufsize
+        data = self._resp.read(sizehint)
+        if data == "":
+            self._release()
+            return None
+        if self._resp.isclosed():
+            self._release()
+        return data
+
+
+class HTTPRangeFile(FileLikeBase):
+    """Seekable, read-only file-like object for a remote file.
+
+    Rather than streaming the remote file from start to finish, this class
+    fetches fixed-size blocks of it on demand using HTTP Range requests,
+    so reading a small part of a large file costs little more than the
+    part being read.  Up to 'cache_blocks' recently-used blocks are kept
+    in an LRU cache.
+
+    Sequential reads are detected, and the number of blocks fetched by
+    each request is doubled (up to 'max_readahead' blocks) for as long as
+    access remains sequential.
+
+    The server must support Range requests.  If 'size' is not given, it is
+    determined from the Content-Length of a HEAD request.
+    """
+
+    def __init__(self,url,size=None,pool=None,blocksize=1024*64,
+                      cache_blocks=64,max_readahead=16,mode="r"):
+        super(HTTPRangeFile,self).__init__(bufsize=blocksize)
+        if "w" in mode or "a" in mode or "+" in mode:
+            raise ValueError("HTTPRangeFile is read-only")
+        if pool is None:
+            pool = default_pool
+        self.name = url
+        self.mode = mode
+        self.blocksize = blocksize
+        self.cache_blocks = cache_blocks
+        self.max_readahead = min(max_readahead,max(cache_blocks//2,1))
+        self._pool = pool
+        self._blocks = OrderedDict()
+        self._pos = 0
+        self._last_block = None
+        self._readahead = 1
+        if size is None:
+            size = self._head()
+        self.size = size
+
+    def _head(self):
+        """Determine the size of the remote file using a HEAD request."""
+        (url,key,conn,resp) = self._pool.request("HEAD",self.name)
+        resp.read()
+        self._pool.release(key,conn,resp)
+        if resp.status != 200:
+            raise IOError("HTTP error %d: %s" % (resp.status,url))
+        length = resp.getheader("content-length")
+        if length is None:
+            raise IOError("Could not determine size of %s" % (url,))
+        return int(length)
+
+    def _fetch(self,first,count):
+        """Fetch 'count' blocks starting at block 'first' into the cache."""
+        start = first * self.blocksize
+        stop = min((first + count) * self.blocksize,self.size)
+        headers = {"Range": "bytes=%d-%d" % (start,stop - 1)}
+        (url,key,conn,resp) = self._pool.request("GET",self.name,headers)
+        data = resp.read()
+        self._pool.release(key,conn,resp)
+        if resp.status == 200:
+            #  Server ignored the range, so we got the whole file
+            data = data[start:stop]
+        elif resp.status != 206:
+            raise IOError("HTTP error %d: %s" % (resp.status,url))
+        for i in xrange(count):
+            block = data[i*self.blocksize:(i+1)*self.blocksize]
+            if block == "":
+                break
+            self._blocks[first + i] = block
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+
+    def _get_block(self,idx):
+        """Get the block of the given index, fetching it if necessary."""
+        #  Grow the readahead while access is sequential, reset it if not
+        if self._last_block is not None and idx == self._last_block + 1:
+            self._readahead = min(self._readahead * 2,self.max_readahead)
+        elif idx != self._last_block:
+            self._readahead = 1
+        self._last_block = idx
+        try:
+            block = self._blocks.pop(idx)
+        except KeyError:
+            nblocks = (self.size + self.blocksize - 1) // self.blocksize
+            count = 1
+            while count < self._readahead and idx + count < nblocks:
+                if idx + count in self._blocks:
+                    break
+                count += 1
+            self._fetch(idx,count)
+            block = self._blocks.pop(idx)
+        self._blocks[idx] = block
+        return block
+
+    def _read(self,sizehint=-1):
+        if self._pos >= self.size:
+            return None
+        (idx,offset) = divmod(self._pos,self.blocksize)
+        data = self._get_block(idx)[offset:]
+        if sizehint > 0:
+            data = data[:sizehint]
+        self._pos += len(data)
+        return data
+
+    def _seek(self,offset,whence):
+        if whence == 1:
+            offset = self._pos + offset
+        elif whence == 2:
+            offset = self.size + offset
+        self._pos = max(offset,0)
+
+    def _tell(self):
+        return self._pos
+
+
+class _Segment(object):
+    """Record of the download progress of one segment of a file."""
+
+    def __init__(self,start,stop):
+        self.start = start
+        self.stop = stop
+        self.done = 0
+        self.error = None
+
+
+class SegmentedHTTPFile(FileLikeBase):
+    """Read-only file-like object for a remote file, downloaded in parallel.
+
+    The remote file is split into 'segments' equal parts, each of which is
+    fetched by a separate thread using a Range request.  The data is
+    written into the 'spill' file (by default an anonymous temporary file;
+    pass e.g. a StringIO to keep it in memory) as it arrives, and reads
+    block only until the data they need has been downloaded.  This means
+    that the file can be read from the front as soon as the first segment
+    starts arriving.
+
+    If a segment's request fails, it is resumed from where it left off,
+    up to 'retries' times.  If it still fails, reading from that segment
+    raises IOError.
+    """
+
+    def __init__(self,url,size,pool=None,segments=4,spill=None,
+                      retries=3,chunksize=1024*16,mode="r"):
+        super(SegmentedHTTPFile,self).__init__()
+        if "w" in mode or "a" in mode or "+" in mode:
+            raise ValueError("SegmentedHTTPFile is read-only")
+        if pool is None:
+            pool = default_pool
+        if spill is None:
+            spill = tempfile.TemporaryFile()
+        self.name = url
+        self.mode = mode
+        self.size = size
+        self.retries = retries
+        self._pool = pool
+        self._spill = spill
+        self._chunksize = chunksize
+        self._pos = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        segsize = max((size + segments - 1) // max(segments,1),1)
+        self._segsize = segsize
+        self._segments = []
+        for start in xrange(0,size,segsize):
+            self._segments.append(_Segment(start,min(start + segsize,size)))
+        self._threads = []
+        for seg in self._segments:
+            t = threading.Thread(target=self._download,args=(seg,))
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+
+    def close(self):
+        if not getattr(self,"closed",True):
+            self._stopping = True
+            for t in getattr(self,"_threads",()):
+                #  We may be garbage-collected by one of our own threads
+                if t is not threading.currentThread():
+                    t.join()
+            self._spill.close()
+        super(SegmentedHTTPFile,self).close()
+
+    def complete(self):
+        """Check whether the entire file has been downloaded."""
+        self._cond.acquire()
+        try:
+            for seg in self._segments:
+                if seg.start + seg.done < seg.stop:
+                    return False
+            return True
+        finally:
+            self._cond.release()
+
+    def _download(self,seg):
+        """Download the given segment, retrying on failure."""
+        failures = 0
+        while seg.start + seg.done < seg.stop and not self._stopping:
+            try:
+                self._fetch(seg)
+            except (EnvironmentError,httplib.HTTPException),e:
+                failures += 1
+                if failures > self.retries:
+                    self._cond.acquire()
+                    try:
+                        seg.error = e
+                        self._cond.notifyAll()
+                    finally:
+                        self._cond.release()
+                    return
+
+    def _fetch(self,seg):
+        """Fetch the remainder of the given segment."""
+        offset = seg.start + seg.done
+        headers = {"Range": "bytes=%d-%d" % (offset,seg.stop - 1)}
+        (url,key,conn,resp) = self._pool.request("GET",self.name,headers)
+        try:
+            if resp.status != 206:
+                raise IOError("HTTP error %d: %s" % (resp.status,url))
+            while offset < seg.stop and not self._stopping:
+                data = resp.read(min(self._chunksize,seg.stop - offset))
+                if data == "":
+                    raise IOError("Segment truncated: %s" % (url,))
+                self._cond.acquire()
+                try:
+                    self._spill.seek(offset)
+                    self._spill.write(data)
+                    offset += len(data)
+                    seg.done = offset - seg.start
+                    self._cond.notifyAll()
+                finally:
+                    self._cond.release()
+        except Exception:
+            conn.close()
+            raise
+        if self._stopping:
+            conn.close()
+        else:
+            self._pool.release(key,conn,resp)
+
+    def _read(self,sizehint=-1):
+        if self._pos >= self.size:
+            return None
+        seg = self._segments[self._pos // self._segsize]
+        self._cond.acquire()
+        try:
+            while seg.start + seg.done <= self._pos:
+                if seg.error is not None:
+                    raise IOError("Download failed: %s" % (seg.error,))
+                self._cond.wait()
+            size = seg.start + seg.done - self._pos
+            if sizehint > 0:
+                size = min(size,sizehint)
+            self._spill.seek(self._pos)
+            data = self._spill.read(size)
+        finally:
+            self._cond.release()
+        self._pos += len(data)
+        return data
+
+    def _seek(self,offset,whence):
+        if whence == 1:
+            offset = self._pos + offset
+        elif whence == 2:
+            offset = self.size + offset
+        self._pos = max(offset,0)
+
+    def _tell(self):
+        return self._pos
+
+
+class HTTPOpener(object):
+    """Opener function for HTTP URLs, using a pool of connections.
+
+    Instances of this class can be used as an opener function with the
+    filelike.Opener class.  They handle read-only access to http:// and
+    https:// URLs.  URLs that should be fetched through a proxy are left
+    for urllib2 to handle.
+
+    If seekable access is requested (mode "r") and the server advertises
+    support for Range requests, an HTTPRangeFile is returned.  Otherwise
+    the URL is streamed using an HTTPResponseFile.
+
+    If the keyword argument 'parallel' is given and greater than one, and
+    the server supports Range requests, the file is instead downloaded as
+    that many concurrent segments using a SegmentedHTTPFile.
+    """
+
+    def __init__(self,pool=None):
+        if pool is None:
+            pool = ConnectionPool()
+        self.pool = pool
+
+    def __call__(self,filename,mode="r",parallel=None,**kwds):
+        if mode not in ("r","r-"):
+            return None
+        if not filename.startswith("http://") and \
+           not filename.startswith("https://"):
+            return None
+        #  Requests that must go through a proxy are left to urllib2
+        if self._uses_proxy(filename):
+            return None
+        if (parallel and parallel > 1) or "-" not in mode:
+            f = self._open_ranges(filename,mode,parallel)
+            if f is not None:
+                return f
+        (url,key,conn,resp) = self.pool.request("GET",filename)
+        if resp.status != 200:
+            resp.read()
+            self.pool.release(key,conn,resp)
+            raise IOError("HTTP error %d: %s" % (resp.status,url))
+        return HTTPResponseFile(self.pool,url,key,conn,resp,mode)
+
+    def _open_ranges(self,url,mode,parallel=None):
+        """Open the URL using Range requests, if the server allows it."""
+        (url,key,conn,resp) = self.pool.request("HEAD",url)
+        resp.read()
+        self.pool.release(key,conn,resp)
+        if resp.status != 200:
+            return None
+        if resp.getheader("accept-ranges","").lower() != "bytes":
+            return None
+        length = resp.getheader("content-length")
+        if length is None:
+            return None
+        if parallel and parallel > 1:
+            return SegmentedHTTPFile(url,int(length),self.pool,
+                                     segments=parallel,mode=mode)
+        return HTTPRangeFile(url,int(length),self.pool)
+
+    def _uses_proxy(self,url):
+        """Check whether the environment configures a proxy for 'url'."""
+        import urllib
+        comps = urlparse.urlsplit(url)
+        if comps[0] not in urllib.getproxies():
+            return False
+        return not urllib.proxy_bypass(comps.hostname)
+
+
+##  Default pool of connections used by filelike.open()
+default_pool = ConnectionPool()
+default_opener = HTTPOpener(default_pool)
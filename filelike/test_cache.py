@@ -0,0 +1,266 @@
+
+import unittest
+import os
+import time
+import bz2
+import shutil
+import tempfile
+from StringIO import StringIO
+
+import filelike
+from filelike import cache, remote
+from filelike.test_remote import TestServer
+
+
+class Test_DiskCache(unittest.TestCase):
+    """Testcases for the basic size-bounded disk cache."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = cache.DiskCache(self.dir,max_size=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_meta(self):
+        self.assertEquals(self.cache.get_meta("key"),None)
+        self.cache.set_meta("key",{"name": "value"})
+        self.assertEquals(self.cache.get_meta("key"),{"name": "value"})
+        self.assertEquals(os.listdir(self.dir),[self.cache._hash("key")+".meta"])
+
+    def test_write_data(self):
+        f = self.cache.write_data("data",StringIO("x"*50))
+        self.assertEquals(f.read(),"x"*50)
+        self.assertEquals(self.cache.open_data("data").read(),"x"*50)
+        self.assertEquals(self.cache.open_data("missing"),None)
+        self.assertEquals(self.cache.size(),50)
+
+    def test_evict_lru(self):
+        now = time.time()
+        for (i,nm) in enumerate(("one","two","three")):
+            self.cache.write_data(nm,StringIO("x"*40)).close()
+            os.utime(self.cache.data_path(nm),(now-100+i,now-100+i))
+        #  The oldest file was evicted when the third was written
+        self.assertEquals(self.cache.open_data("one"),None)
+        #  Using "two" makes "three" the least recently used
+        self.cache.open_data("two").close()
+        self.cache.write_data("four",StringIO("x"*40)).close()
+        self.assertEquals(self.cache.open_data("three"),None)
+        self.assertEquals(sorted(os.listdir(self.dir)),["four","two"])
+
+
+class Test_URLCache(unittest.TestCase):
+    """Testcases for caching of remote files."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = {"/file.txt": "some remote data\n" * 10,
+                      "/file.txt.bz2": bz2.compress("hello world\n")}
+        self.server = TestServer(self.files)
+        self.server.validators = True
+        self.pool = remote.ConnectionPool()
+        self.open = filelike.Opener(openers=(remote.HTTPOpener(self.pool),))
+        self.open.register_decoder(filelike.wrappers.UnBZip2,(".bz2",))
+        self.open.cache = cache.URLCache(self.dir,pool=self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def test_hit(self):
+        url = self.server.url("/file.txt")
+        for i in xrange(3):
+            f = self.open(url)
+            self.assertEquals(f.read(),self.files["/file.txt"])
+            self.assertTrue(isinstance(f,file))
+            f.close()
+        self.assertEquals(self.server.counts["requests"],3)
+        self.assertEquals(self.server.counts["not_modified"],2)
+        self.assertEquals(self.server.counts["bytes"],170)
+
+    def test_changed(self):
+        url = self.server.url("/file.txt")
+        self.assertEquals(self.open(url).read(),self.files["/file.txt"])
+        self.files["/file.txt"] = "changed\n"
+        self.assertEquals(self.open(url).read(),"changed\n")
+        self.assertEquals(self.server.counts.get("not_modified",0),0)
+        #  The old version was removed from the cache
+        self.assertEquals(len(os.listdir(self.dir)),2)
+
+    def test_suffix_decoding(self):
+        url = self.server.url("/file.txt.bz2")
+        self.assertEquals(self.open(url).read(),"hello world\n")
+        self.assertEquals(self.open(url).read(),"hello world\n")
+        self.assertEquals(self.server.counts["not_modified"],1)
+
+    def test_no_validators(self):
+        """Files that can't be revalidated are not cached."""
+        self.server.validators = False
+        url = self.server.url("/file.txt")
+        self.assertEquals(self.open(url).read(),self.files["/file.txt"])
+        self.assertEquals(os.listdir(self.dir),[])
+
+    def test_evicted(self):
+        """Entries removed by another process are fetched again."""
+        url = self.server.url("/file.txt")
+        self.open(url).read()
+        for nm in os.listdir(self.dir):
+            if not nm.endswith(".meta"):
+                os.unlink(os.path.join(self.dir,nm))
+        self.assertEquals(self.open(url).read(),self.files["/file.txt"])
+        self.assertEquals(self.server.counts["bytes"],340)
+
+    def test_evict_meta(self):
+        url = self.server.url("/file.txt")
+        self.open(url).read()
+        self.assertEquals(len(os.listdir(self.dir)),2)
+        self.open.cache.evict(0)
+        #  The metadata goes along with the data
+        self.assertEquals(os.listdir(self.dir),[])
+
+    def test_not_cached(self):
+        """Local files and writable modes bypass the cache."""
+        self.assertEquals(self.open.cache(__file__),None)
+        self.assertEquals(self.open.cache(self.server.url("/x"),"w"),None)
+
+
+class Test_DecodedCache(unittest.TestCase):
+    """Testcases for caching decoded copies of local files."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = cache.DecodedCache(os.path.join(self.dir,"cache"))
+        self.open = filelike.Opener(openers=(filelike._file_opener,))
+        self.open.register_decoder(filelike.wrappers.UnBZip2,(".bz2",))
+        self.open.decoded_cache = self.cache
+        self.fname = os.path.join(self.dir,"data.txt.bz2")
+        self._write(self.fname,"hello world\n" * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self,fname,data):
+        f = open(fname,"wb")
+        f.write(bz2.compress(data))
+        f.close()
+
+    def test_hit(self):
+        f = self.open(self.fname)
+        self.assertTrue(isinstance(f,file))
+        self.assertEquals(f.read(),"hello world\n" * 100)
+        #  Later opens don't decode the file again
+        self.open.suffix_decoders = {}
+        f = self.open(self.fname)
+        f.seek(-12,2)
+        self.assertEquals(f.read(),"hello world\n")
+        self.assertEquals(self.cache.size(),1200)
+
+    def test_changed(self):
+        self.open(self.fname).read()
+        self._write(self.fname,"changed data\n")
+        st = os.stat(self.fname)
+        os.utime(self.fname,(st.st_atime,st.st_mtime+10))
+        self.assertEquals(self.open(self.fname).read(),"changed data\n")
+
+    def test_not_decoded(self):
+        """Files that need no decoding are not cached."""
+        fname = os.path.join(self.dir,"plain.txt")
+        open(fname,"wb").write("plain\n")
+        f = self.open(fname)
+        self.assertEquals(f.read(),"plain\n")
+        self.assertEquals(self.cache.size(),0)
+
+    def test_limits(self):
+        self.cache.patterns = ["*.gz"]
+        self.assertFalse(isinstance(self.open(self.fname),file))
+        self.cache.patterns = ["*.bz2"]
+        self.cache.max_file_size = 10
+        self.assertFalse(isinstance(self.open(self.fname),file))
+        self.assertEquals(self.cache.lookup(self.fname,"rw"),None)
+        self.assertEquals(self.cache.size(),0)
+        self.cache.max_file_size = None
+        self.assertTrue(isinstance(self.open(self.fname),file))
+
+
+class Test_HandlePool(unittest.TestCase):
+    """Testcases for reusing open files via a HandlePool."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.opened = []
+        def opener(filename,mode,**kwds):
+            self.opened.append(filename)
+            return filelike._file_opener(filename,mode,**kwds)
+        self.open = filelike.Opener(openers=(opener,))
+        self.open.register_decoder(filelike.wrappers.UnBZip2,(".bz2",))
+        self.pool = cache.HandlePool(max_handles=2)
+        self.open.handle_pool = self.pool
+        self.fnames = []
+        for i in xrange(3):
+            fname = os.path.join(self.dir,"file%d.txt" % (i,))
+            f = open(fname,"wb")
+            f.write("contents of file %d\n" % (i,) * 10)
+            f.close()
+            self.fnames.append(fname)
+
+    def tearDown(self):
+        self.pool.clear()
+        shutil.rmtree(self.dir)
+
+    def test_reuse(self):
+        for i in xrange(5):
+            f = self.open(self.fnames[0])
+            self.assertEquals(f.read(),"contents of file 0\n" * 10)
+            f.close()
+        self.assertEquals(self.opened,[self.fnames[0]])
+
+    def test_independent_views(self):
+        f1 = self.open(self.fnames[1])
+        f2 = self.open(self.fnames[1])
+        self.assertEquals(f1.readline(),"contents of file 1\n")
+        f2.seek(-5,2)
+        self.assertEquals(f2.read(),"le 1\n")
+        self.assertEquals(f1.read(5),"conte")
+        self.assertEquals(f1.tell(),24)
+        self.assertEquals(f2.tell(),190)
+
+    def test_decoded(self):
+        fname = os.path.join(self.dir,"data.txt.bz2")
+        f = open(fname,"wb")
+        f.write(bz2.compress("hello world\n" * 10))
+        f.close()
+        f1 = self.open(fname)
+        self.assertEquals(f1.read(12),"hello world\n")
+        f2 = self.open(fname)
+        self.assertEquals(f2.read(),"hello world\n" * 10)
+        self.assertEquals(f1.read(),"hello world\n" * 9)
+        self.assertEquals(self.opened,[fname])
+
+    def test_invalidate(self):
+        f1 = self.open(self.fnames[0])
+        f = open(self.fnames[0],"ab")
+        f.write("more\n")
+        f.close()
+        f2 = self.open(self.fnames[0])
+        self.assertEquals(f2.read()[-5:],"more\n")
+        self.assertEquals(len(self.opened),2)
+        #  The old view still works until it is closed
+        self.assertEquals(f1.readline(),"contents of file 0\n")
+        f1.close()
+
+    def test_max_handles(self):
+        views = [self.open(fname) for fname in self.fnames]
+        self.assertEquals(len(self.pool),2)
+        handle = views[0]._handle
+        self.assertTrue(handle.retired)
+        self.assertFalse(handle.fileobj.closed)
+        views[0].close()
+        self.assertTrue(handle.fileobj.closed)
+        self.open(self.fnames[0])
+        self.assertEquals(len(self.opened),4)
+
+    def test_not_pooled(self):
+        f = self.open(self.fnames[0],"r-")
+        self.assertEquals(len(self.pool),0)
+        f.close()
@@ -0,0 +1,136 @@
+
+import unittest
+import bz2
+
+import filelike
+from filelike import memfs, tests
+
+
+class Test_MemoryFile(tests.Test_ReadWriteSeek):
+    """Run the generic file testcases against MemoryFile."""
+
+    def setUp(self):
+        self.fs = memfs.MemoryFS()
+        super(Test_MemoryFile,self).setUp()
+
+    def makeFile(self,contents,mode):
+        name = "file%d" % (len(self.fs.listdir()),)
+        f = self.fs.open(name,"w")
+        f.write(contents)
+        f.close()
+        f = self.fs.open(name,mode)
+        f.getvalue = lambda: str(self.fs._files[name].data)
+        return f
+
+
+class Test_MemoryFS(unittest.TestCase):
+    """Testcases for the in-memory filesystem."""
+
+    def setUp(self):
+        self.fs = memfs.MemoryFS()
+
+    def test_missing(self):
+        self.assertRaises(IOError,self.fs.open,"missing")
+        self.assertRaises(IOError,self.fs.remove,"missing")
+        self.assertFalse(self.fs.exists("missing"))
+
+    def test_concurrent_readers(self):
+        f = self.fs.open("data","w")
+        f.write("hello world\n" * 3)
+        f.flush()
+        r1 = self.fs.open("data")
+        r2 = self.fs.open("data")
+        self.assertEquals(r1.readline(),"hello world\n")
+        self.assertEquals(r2.read(5),"hello")
+        self.assertEquals(r1.read(5),"hello")
+        #  Flushed writes are visible to open readers
+        f.write("more\n")
+        f.close()
+        self.assertEquals(r2.read()[-5:],"more\n")
+
+    def test_append_truncate(self):
+        f = self.fs.open("data","w")
+        f.write("hello")
+        f.close()
+        f = self.fs.open("data","a")
+        f.write(" world")
+        f.close()
+        self.assertEquals(self.fs.open("data").read(),"hello world")
+        f = self.fs.open("data","r+")
+        f.truncate(4)
+        f.seek(6)
+        f.write("!")
+        f.close()
+        self.assertEquals(self.fs.open("data").read(),"hell\x00\x00!")
+        self.assertEquals(self.fs.getsize("data"),7)
+
+    def test_rename_remove(self):
+        self.fs.open("a/one","w").close()
+        self.fs.open("a/two","w").close()
+        self.fs.open("b/three","w").close()
+        self.assertEquals(self.fs.listdir("a/"),["a/one","a/two"])
+        r = self.fs.open("a/one")
+        self.fs.rename("a/one","b/one")
+        self.fs.remove("a/two")
+        self.assertEquals(self.fs.listdir(),["b/one","b/three"])
+        self.assertEquals(r.read(),"")
+
+    def test_opener(self):
+        f = memfs.default_fs.open("test_memfs/data.bz2","w")
+        f.write(bz2.compress("compressed data"))
+        f.close()
+        try:
+            f = filelike.open("mem://test_memfs/data.bz2")
+            self.assertEquals(f.read(),"compressed data")
+            self.assertEquals(f.name,"mem://test_memfs/data")
+            self.assertRaises(IOError,filelike.open,"mem://test_memfs/x")
+        finally:
+            memfs.default_fs.remove("test_memfs/data.bz2")
+
+
+class Test_Scheme(unittest.TestCase):
+    """Testcases for dispatching opens on the URL scheme."""
+
+    def test_scheme(self):
+        self.assertEquals(filelike._scheme("/tmp/file.txt"),"")
+        self.assertEquals(filelike._scheme("C:\\file.txt"),"")
+        self.assertEquals(filelike._scheme("file:name.txt"),"file")
+        self.assertEquals(filelike._scheme("HTTP://host/"),"http")
+        self.assertEquals(filelike._scheme("svn+ssh://host/"),"svn+ssh")
+        self.assertEquals(filelike._scheme("dir/a:b"),"")
+
+    def test_dispatch(self):
+        calls = []
+        def generic(filename,mode,**kwds):
+            calls.append("generic")
+            return memfs.MemoryFS().open("x","w")
+        def scheme(filename,mode,**kwds):
+            calls.append("scheme")
+            if filename.endswith("fail"):
+                raise IOError("failed")
+            return memfs.MemoryFS().open("x","w")
+        opener = filelike.Opener(openers=(generic,))
+        opener.register_opener(scheme,("test",))
+        opener("test://file","r")
+        self.assertEquals(calls,["scheme"])
+        opener("other://file","r")
+        self.assertEquals(calls,["scheme","generic"])
+        opener("test://fail","r")
+        self.assertEquals(calls,["scheme","generic","scheme","generic"])
+
+    def test_keyword_arguments(self):
+        calls = []
+        def plain(filename,mode):
+            calls.append("plain")
+            return None
+        def named(filename,mode,parallel=None):
+            calls.append(("named",parallel))
+            return None
+        class Generic(object):
+            def __call__(self,filename,mode,**kwds):
+                calls.append(("generic",kwds))
+                return memfs.MemoryFS().open("x","w")
+        opener = filelike.Opener(openers=(plain,named,Generic()))
+        opener("file","r",parallel=4,other=1)
+        self.assertEquals(calls,["plain",("named",4),
+                                 ("generic",{"parallel":4,"other":1})])
@@ -0,0 +1,362 @@
+
+import unittest
+import time
+import zlib
+import socket
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import filelike
+from filelike import remote, tests
+
+
+class TestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Request handler serving the files of a TestServer."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.count("connections")
+        self.server.sockets.append(self.connection)
+
+    def log_message(self,*args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self,body=True):
+        self.server.count("requests")
+        if self.path.startswith("/redirect"):
+            self.send_response(302)
+            self.send_header("Location",self.path[len("/redirect"):])
+            self.send_header("Content-Length","0")
+            self.end_headers()
+            return
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        etag = '"%08x"' % (zlib.crc32(data) & 0xffffffff,)
+        if self.server.validators and \
+           self.headers.getheader("If-None-Match") == etag:
+            self.server.count("not_modified")
+            self.send_response(304)
+            self.send_header("ETag",etag)
+            self.end_headers()
+            return
+        rng = self.headers.getheader("Range")
+        if rng and self.server.ranges:
+            (start,stop) = rng.split("=")[1].split("-")
+            (start,stop) = (int(start),min(int(stop)+1,len(data)))
+            self.send_response(206)
+            self.send_header("Content-Range","bytes %d-%d/%d" \
+                                             % (start,stop-1,len(data)))
+            data = data[start:stop]
+        else:
+            self.send_response(200)
+        if self.server.ranges:
+            self.send_header("Accept-Ranges","bytes")
+        if self.server.validators:
+            self.send_header("ETag",etag)
+        self.send_header("Content-Length",str(len(data)))
+        self.end_headers()
+        if not body:
+            return
+        self.server.count("bytes",len(data))
+        if self.server.fail_requests and rng:
+            #  Simulate a dropped connection partway through the body
+            self.server.fail_requests -= 1
+            self.wfile.write(data[:len(data)//2])
+            self.close_connection = 1
+            return
+        if not self.server.rate:
+            self.wfile.write(data)
+            return
+        self.server.count("active")
+        try:
+            for i in xrange(0,len(data),1024):
+                self.wfile.write(data[i:i+1024])
+                self.wfile.flush()
+                self.server.max_active = max(self.server.max_active,
+                                             self.server.counts["active"])
+                time.sleep(1024.0 / self.server.rate)
+        finally:
+            self.server.count("active",-1)
+
+
+class TestServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+    """Local threaded HTTP server, standing in for a remote host."""
+
+    daemon_threads = True
+    handler = TestHandler
+
+    def __init__(self,files,ranges=False):
+        BaseHTTPServer.HTTPServer.__init__(self,("127.0.0.1",0),self.handler)
+        self.files = files
+        self.ranges = ranges
+        self.validators = False
+        self.rate = None
+        self.max_active = 0
+        self.fail_requests = 0
+        self.sockets = []
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        args=(0.01,))
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def count(self,name,n=1):
+        self._lock.acquire()
+        try:
+            self.counts[name] = self.counts.get(name,0) + n
+        finally:
+            self._lock.release()
+
+    def handle_error(self,request,client_address):
+        #  Dropped connections are expected; the client sees any errors
+        pass
+
+    def url(self,path):
+        return "http://127.0.0.1:%d%s" % (self.server_address[1],path)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        #  Close any keep-alive connections, so their handlers exit
+        for sock in self.sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class Test_HTTPOpener(unittest.TestCase):
+    """Testcases for opening URLs over pooled connections."""
+
+    def setUp(self):
+        files = {}
+        for i in xrange(10):
+            files["/file%d.txt" % (i,)] = "contents of file %d\n" % (i,) * i
+        self.files = files
+        self.server = TestServer(files)
+        self.pool = remote.ConnectionPool(maxsize=2)
+        self.open = remote.HTTPOpener(self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_read(self):
+        f = self.open(self.server.url("/file3.txt"),"r-")
+        self.assertEquals(f.name,self.server.url("/file3.txt"))
+        self.assertEquals(f.read(),self.files["/file3.txt"])
+        f.close()
+
+    def test_keepalive(self):
+        """Sequential opens from one host should reuse a connection."""
+        for i in xrange(10):
+            f = self.open(self.server.url("/file%d.txt" % (i,)),"r-")
+            self.assertEquals(f.read(),self.files["/file%d.txt" % (i,)])
+            f.close()
+        self.assertEquals(self.server.counts["requests"],10)
+        self.assertEquals(self.server.counts["connections"],1)
+        self.assertEquals(self.pool.idle_count(),1)
+
+    def test_release_at_eof(self):
+        """Connections go back to the pool at EOF, even without close()."""
+        f = self.open(self.server.url("/file5.txt"),"r-")
+        self.assertEquals(self.pool.idle_count(),0)
+        for ln in f:
+            pass
+        self.assertEquals(self.pool.idle_count(),1)
+        f.close()
+        self.assertEquals(self.pool.idle_count(),1)
+
+    def test_pool_size(self):
+        """At most 'maxsize' idle connections are kept per host."""
+        files = [self.open(self.server.url("/file%d.txt" % (i,)),"r-")
+                 for i in xrange(1,5)]
+        self.assertEquals(self.server.counts["connections"],4)
+        for f in files:
+            f.read()
+        self.assertEquals(self.pool.idle_count(),2)
+
+    def test_close_early(self):
+        """Closing before EOF discards the connection."""
+        f = self.open(self.server.url("/file9.txt"),"r-")
+        f.read(5)
+        f.close()
+        self.assertEquals(self.pool.idle_count(),0)
+
+    def test_stale_connection(self):
+        """Idle connections closed by the server are replaced."""
+        f = self.open(self.server.url("/file2.txt"),"r-")
+        f.read()
+        conn = self.pool._idle.values()[0][0]
+        conn.sock.shutdown(2)
+        f = self.open(self.server.url("/file4.txt"),"r-")
+        self.assertEquals(f.read(),self.files["/file4.txt"])
+        self.assertEquals(self.server.counts["connections"],2)
+
+    def test_redirect(self):
+        f = self.open(self.server.url("/redirect/file6.txt"),"r-")
+        self.assertEquals(f.name,self.server.url("/file6.txt"))
+        self.assertEquals(f.read(),self.files["/file6.txt"])
+        self.assertEquals(self.server.counts["connections"],1)
+
+    def test_not_found(self):
+        self.assertRaises(IOError,self.open,self.server.url("/nothere"),"r")
+
+    def test_filelike_open(self):
+        f = filelike.open(self.server.url("/file1.txt"),"r-")
+        self.assert_(isinstance(f,remote.HTTPResponseFile))
+        self.assertEquals(f.read(),self.files["/file1.txt"])
+
+
+class Test_HTTPRangeFile(tests.Test_Read):
+    """Testcases for seekable access to remote files over Range requests."""
+
+    def setUp(self):
+        self.server = TestServer({},ranges=True)
+        self.pool = remote.ConnectionPool()
+        super(Test_HTTPRangeFile,self).setUp()
+
+    def tearDown(self):
+        super(Test_HTTPRangeFile,self).tearDown()
+        self.pool.close()
+        self.server.stop()
+
+    def makeFile(self,contents,mode,**kwds):
+        path = "/file%d" % (len(self.server.files),)
+        self.server.files[path] = contents
+        kwds.setdefault("blocksize",16)
+        return remote.HTTPRangeFile(self.server.url(path),pool=self.pool,
+                                    mode=mode,**kwds)
+
+    def test_seek_tell(self):
+        self.file.seek(7)
+        self.assertEquals(self.file.tell(),7)
+        self.assertEquals(self.file.read(20),self.contents[7:27])
+        self.file.seek(-5,1)
+        self.assertEquals(self.file.read(),self.contents[22:])
+        self.file.seek(-10,2)
+        self.assertEquals(self.file.read(),self.contents[-10:])
+        self.file.seek(0)
+        self.assertEquals(self.file.read(5),self.contents[:5])
+
+    def test_read_tail(self):
+        """Reading the end of a large file fetches only the last block."""
+        contents = "".join([chr(i % 256) for i in xrange(1024*1024)])
+        f = self.makeFile(contents,"r",blocksize=4096)
+        self.assertEquals(f.size,len(contents))
+        f.seek(-100,2)
+        self.assertEquals(f.read(),contents[-100:])
+        self.assertEquals(self.server.counts["bytes"],4096)
+
+    def test_readahead(self):
+        """Sequential reads fetch increasingly many blocks per request."""
+        contents = "".join([chr(i % 256) for i in xrange(64*1024)])
+        f = self.makeFile(contents,"r",blocksize=1024,max_readahead=8)
+        self.server.counts.clear()
+        for i in xrange(64):
+            self.assertEquals(f.read(1024),contents[i*1024:(i+1)*1024])
+        self.assertEquals(self.server.counts["bytes"],len(contents))
+        self.assert_(self.server.counts["requests"] < 12)
+        #  Re-reading cached blocks costs nothing
+        self.server.counts.clear()
+        f.seek(-1024*8,2)
+        f.read()
+        self.assertEquals(self.server.counts,{})
+
+    def test_cache_eviction(self):
+        contents = "".join([chr(i % 256) for i in xrange(8*1024)])
+        f = self.makeFile(contents,"r",blocksize=1024,cache_blocks=2)
+        for i in (0,3,5,7):
+            f.seek(i*1024)
+            f.read(1)
+        self.assertEquals(sorted(f._blocks.keys()),[5,7])
+
+    def test_filelike_open(self):
+        self.server.files["/data"] = self.contents
+        f = filelike.open(self.server.url("/data"),"r")
+        self.assert_(isinstance(f,remote.HTTPRangeFile))
+        f.seek(-5,2)
+        self.assertEquals(f.read(),self.contents[-5:])
+        f = filelike.open(self.server.url("/data"),"r-")
+        self.assert_(isinstance(f,remote.HTTPResponseFile))
+        self.server.ranges = False
+        f = filelike.open(self.server.url("/data"),"r")
+        self.assert_(isinstance(f,remote.HTTPResponseFile))
+        self.assertEquals(f.read(),self.contents)
+
+
+class Test_SegmentedHTTPFile(unittest.TestCase):
+    """Testcases for segmented parallel downloads of remote files."""
+
+    contents = "".join([chr(i % 251) for i in xrange(128*1024)])
+
+    def setUp(self):
+        self.server = TestServer({"/data": self.contents},ranges=True)
+        self.pool = remote.ConnectionPool()
+        self.open = remote.HTTPOpener(self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_download(self):
+        f = self.open(self.server.url("/data"),"r",parallel=3)
+        self.assert_(isinstance(f,remote.SegmentedHTTPFile))
+        self.assertEquals(len(f._segments),3)
+        self.assertEquals(f.read(),self.contents)
+        self.assert_(f.complete())
+        f.seek(-10,2)
+        self.assertEquals(f.read(),self.contents[-10:])
+        f.close()
+
+    def test_concurrent(self):
+        """Segments are fetched concurrently over separate connections."""
+        self.server.rate = 512 * 1024
+        f = self.open(self.server.url("/data"),"r-",parallel=4)
+        #  The front of the file is readable before the download finishes
+        self.assertEquals(f.read(10),self.contents[:10])
+        self.failIf(f.complete())
+        self.assertEquals(f.read(),self.contents[10:])
+        self.assertEquals(self.server.max_active,4)
+        f.close()
+
+    def test_retry(self):
+        """Failed segments are resumed from where they stopped."""
+        self.server.fail_requests = 3
+        f = self.open(self.server.url("/data"),"r",parallel=4)
+        self.assertEquals(f.read(),self.contents)
+        self.assertEquals(self.server.counts["requests"],1 + 4 + 3)
+        f.close()
+
+    def test_failure(self):
+        self.server.fail_requests = 100
+        f = remote.SegmentedHTTPFile(self.server.url("/data"),
+                                     len(self.contents),self.pool,
+                                     segments=2,retries=1)
+        self.assertRaises(IOError,f.read)
+        f.close()
+
+    def test_memory_spill(self):
+        from StringIO import StringIO
+        f = remote.SegmentedHTTPFile(self.server.url("/data"),
+                                     len(self.contents),self.pool,
+                                     segments=5,spill=StringIO())
+        self.assertEquals(len(f._segments),5)
+        self.assertEquals(f.read(),self.contents)
+
+    def test_filelike_open(self):
+        f = filelike.open(self.server.url("/data"),"r",parallel=2)
+        self.assert_(isinstance(f,remote.SegmentedHTTPFile))
+        self.assertEquals(f.read(),self.contents)
+        f.close()
@@ -196,6 +196,14 @@ class Test_ReadWriteSeek(Test_ReadWrite):
         f.flush()
         self.assertEquals(f.getvalue(),self.contents)
 
+    def test_read_ranges(self):
+        c = self.contents
+        ranges = [(10,5),(0,3),(4,2),(len(c)-2,10),(7,0)]
+        self.file.seek(3)
+        data = filelike._read_ranges(self.file,ranges)
+        self.assertEquals(data,[c[10:15],c[0:3],c[4:6],c[-2:],""])
+        self.assertEquals(self.file.tell(),3)
+
 
 class Test_StringIO(Test_ReadWriteSeek):
     """Run our testcases against StringIO, basically to test the tests."""
@@ -225,6 +233,183 @@ class Test_Join(Test_ReadWriteSeek):
         return f
 
 
+class CountingStringIO(StringIO):
+    """StringIO that records the number of read() calls made on it."""
+    def __init__(self,*args):
+        StringIO.__init__(self,*args)
+        self.nreads = 0
+    def read(self,size=-1):
+        self.nreads += 1
+        return StringIO.read(self,size)
+
+
+class Test_ReadRanges(unittest.TestCase):
+    """Testcases for batched reading of ranges with read_ranges()."""
+
+    contents = "".join([chr(ord("a") + i % 26) for i in xrange(1000)])
+
+    def test_coalesce(self):
+        runs = filelike._coalesce_ranges([(50,10),(0,10),(10,5),(55,2)])
+        self.assertEquals(runs,[(0,15,[(1,0,10),(2,10,5)]),
+                                (50,60,[(0,50,10),(3,55,2)])])
+        runs = filelike._coalesce_ranges([(50,10),(0,10)],gap=40)
+        self.assertEquals(runs,[(0,60,[(1,0,10),(0,50,10)])])
+        self.assertRaises(ValueError,filelike._coalesce_ranges,[(-1,2)])
+
+    def test_wrapper_passes_down(self):
+        s = CountingStringIO(self.contents)
+        f = wrappers.FileWrapper(s,"r")
+        ranges = [(900,20),(10,5),(0,10),(500,1)]
+        data = f.read_ranges(ranges,gap=0)
+        self.assertEquals(data,[self.contents[o:o+l] for (o,l) in ranges])
+        self.assertEquals(s.nreads,3)
+        s.nreads = 0
+        data = f.read_ranges(ranges,gap=1000)
+        self.assertEquals(data,[self.contents[o:o+l] for (o,l) in ranges])
+        self.assertEquals(s.nreads,1)
+
+    def test_slice(self):
+        s = CountingStringIO(self.contents)
+        f = wrappers.Slice(s,100,200,mode="r")
+        data = f.read_ranges([(0,10),(95,10),(150,10)])
+        self.assertEquals(data,[self.contents[100:110],
+                                self.contents[195:200],""])
+        self.assertEquals(s.nreads,1)
+
+    def test_join(self):
+        files = [CountingStringIO(self.contents[:300]),
+                 CountingStringIO(self.contents[300:310]),
+                 CountingStringIO(self.contents[310:])]
+        f = join(files)
+        f.read(3)
+        ranges = [(295,20),(0,5),(305,1),(990,20)]
+        data = f.read_ranges(ranges)
+        self.assertEquals(data,[self.contents[o:o+l] for (o,l) in ranges])
+        self.assertEquals([s.nreads for s in files],[2,1,1])
+        self.assertEquals(f.read(3),self.contents[3:6])
+
+
+class Test_Peek(unittest.TestCase):
+    """Testcases for non-consuming reads with peek()."""
+
+    contents = "Once upon a time, in a galaxy far away"
+
+    def test_peek(self):
+        f = wrappers.FileWrapper(StringIO(self.contents),"r")
+        self.assertEquals(f.peek(4),self.contents[:4])
+        self.assertEquals(f.tell(),0)
+        self.assertEquals(f.read(2),self.contents[:2])
+        self.assertEquals(f.peek(6),self.contents[2:8])
+        self.assertEquals(f.tell(),2)
+        self.assertEquals(f.read(),self.contents[2:])
+        self.assertEquals(f.peek(6),"")
+
+    def test_peek_stream(self):
+        f = wrappers.FileWrapper(StringIO(self.contents),"r-")
+        self.assertEquals(f.peek(4),self.contents[:4])
+        self.assertEquals(f.readline(),self.contents)
+
+    def test_peek_helper(self):
+        s = StringIO(self.contents)
+        s.read(3)
+        (f,data) = filelike._peek(s,5,"r")
+        self.assert_(f is s)
+        self.assertEquals(data,self.contents[3:8])
+        self.assertEquals(s.tell(),3)
+        (f,data) = filelike._peek(s,5,"r-")
+        self.assert_(isinstance(f,wrappers.FileWrapper))
+        self.assertEquals(data,self.contents[3:8])
+        self.assertEquals(f.read(),self.contents[3:])
+
+
+class Test_OpenMany(unittest.TestCase):
+    """Testcases for concurrent opening with open_many()."""
+
+    def setUp(self):
+        import threading
+        self.threads = set()
+        self.opened = []
+        self.closed = []
+        self.lock = threading.Lock()
+        #  The first file is held up until all the others have opened,
+        #  so that the files finish out of order.
+        self.others_opened = threading.Event()
+        #  If set, files other than the first are held up until released.
+        self.release = None
+        def opener(filename,mode,**kwds):
+            if filename.startswith("missing"):
+                raise IOError("no such file: " + filename)
+            self.threads.add(threading.currentThread())
+            if filename == "file0":
+                self.others_opened.wait(10)
+            elif self.release is not None:
+                self.release.wait(10)
+            f = StringIO("contents of " + filename)
+            def close():
+                self.closed.append(filename)
+            f.close = close
+            self.lock.acquire()
+            try:
+                self.opened.append(filename)
+                if len(self.opened) == len(self.names) - 1 and \
+                   "file0" not in self.opened:
+                    self.others_opened.set()
+            finally:
+                self.lock.release()
+            return f
+        self.open = filelike.Opener(openers=(opener,))
+        self.names = ["file%d" % (i,) for i in xrange(10)]
+
+    def test_ordered(self):
+        results = list(self.open.open_many(self.names,workers=4))
+        self.assertEquals([r[0] for r in results],self.names)
+        for (name,f,err) in results:
+            self.assertEquals(err,None)
+            self.assertEquals(f.read(),"contents of " + name)
+        self.assert_(1 < len(self.threads) <= 4)
+
+    def test_unordered(self):
+        results = list(self.open.open_many(self.names,workers=10,
+                                           ordered=False))
+        self.assertEquals(sorted([r[0] for r in results]),self.names)
+        self.assertEquals(results[-1][0],"file0")
+
+    def test_stop_early(self):
+        import threading
+        self.others_opened.set()
+        self.release = threading.Event()
+        results = self.open.open_many(self.names,workers=1)
+        (name,f,err) = results.next()
+        self.assertEquals(name,"file0")
+        results.close()
+        self.release.set()
+        for t in self.threads:
+            t.join(10)
+            self.assertFalse(t.isAlive())
+        #  At most the file being opened when stopped was opened after
+        #  the first, and it has been closed
+        self.assert_(self.opened in (["file0"],["file0","file1"]))
+        self.assertEquals(self.closed,self.opened[1:])
+
+    def test_errors(self):
+        names = ["file1","missing","file2"]
+        results = list(self.open.open_many(names,warm=4))
+        self.assertEquals([r[0] for r in results],names)
+        self.assertEquals(results[1][1],None)
+        self.assert_(isinstance(results[1][2],IOError))
+        self.assertEquals(results[2][1].read(),"contents of file2")
+
+    def test_default(self):
+        fname = tempfile.mktemp()
+        open(fname,"wb").write("some data")
+        try:
+            [(name,f,err)] = list(filelike.open_many([fname]))
+            self.assertEquals(f.read(),"some data")
+            f.close()
+        finally:
+            os.unlink(fname)
+
+
 class Test_IsTo(unittest.TestCase):
     """Tests for is_filelike/to_filelike."""
 
@@ -310,6 +495,45 @@ class Test_IsTo(unittest.TestCase):
         self.assertEquals(f.read(),"testing")
         
 
+class Test_Import(unittest.TestCase):
+    """Testcases ensuring that importing filelike stays cheap."""
+
+    def _new_modules(self,stmt):
+        """Get names of the modules loaded by 'stmt' in a fresh interpreter."""
+        import subprocess
+        import sys
+        code = "import sys; old = set(sys.modules); %s; " \
+               "print ' '.join(set(sys.modules) - old)" % (stmt,)
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(filelike.__file__))
+        p = subprocess.Popen([sys.executable,"-c",code],env=env,
+                             stdout=subprocess.PIPE)
+        (out,_) = p.communicate()
+        self.assertEquals(p.returncode,0)
+        return set(out.split())
+
+    def test_import_is_lazy(self):
+        """Importing the packages shouldn't load codecs, urllib2, etc."""
+        stmt = "import filelike, filelike.wrappers, filelike.pipeline"
+        loaded = self._new_modules(stmt)
+        for nm in ("urllib2","urlparse","tempfile","StringIO","bz2","zlib",
+                   "filelike.wrappers.compress","filelike.wrappers.crypto",
+                   "filelike.wrappers.buffer"):
+            self.failIf(nm in loaded,"%s was imported" % (nm,))
+
+    def test_lazy_attributes(self):
+        """Wrapper classes and pipeline factories resolve on first use."""
+        loaded = self._new_modules("from filelike.wrappers import Slice")
+        self.assert_("filelike.wrappers.slice" in loaded)
+        self.failIf("filelike.wrappers.compress" in loaded)
+        loaded = self._new_modules("from filelike.pipeline import *")
+        self.assert_("filelike.wrappers.compress" in loaded)
+        self.assertRaises(AttributeError,getattr,wrappers,"NoSuchWrapper")
+        from filelike import pipeline
+        self.assert_(isinstance(pipeline.UnBZip2(),pipeline.PipelineEntry))
+        self.assertRaises(AttributeError,getattr,pipeline,"FileWrapper")
+
+
 class Test_Docs(unittest.TestCase):
     """Unittests for our documentation."""
 
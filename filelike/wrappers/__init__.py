@@ -95,8 +95,8 @@ class FileWrapper(FileLikeBase):
         # Copy useful attributes of the fileobj
         if hasattr(fileobj,"name"):
             self.name = fileobj.name
-        # Respect append-mode setting
-        if "a" in self.mode:
+        # Respect append-mode setting, unless we can only stream to the file
+        if "a" in self.mode and "-" not in self.mode:
             if self._check_mode("r"):
                 self._fileobj.seek(0)
             self.seek(0,2)
@@ -145,6 +145,32 @@ class FileWrapper(FileLikeBase):
         if not self._closing and hasattr(self._fileobj,"flush"):
             self._fileobj.flush()
     
+    def read_ranges(self,ranges,gap=None):
+        """Read several (offset,length) ranges from the file in one batch.
+
+        If this wrapper does not alter the data in the wrapped file, the
+        request is passed straight down to the wrapped file.  Otherwise
+        it falls back to the generic implementation of FileLikeBase.
+        """
+        if not self._passes_through():
+            return super(FileWrapper,self).read_ranges(ranges,gap)
+        if self.closed:
+            raise IOError("File has been closed")
+        self._assert_mode("r")
+        if gap is None:
+            gap = self._bufsize
+        if self._wbuffer:
+            self.flush()
+        return filelike._read_ranges(self._fileobj,ranges,gap)
+
+    def _passes_through(self):
+        """Check whether reads and seeks go unmodified to the wrapped file."""
+        for nm in ("_read","_seek","_tell"):
+            if getattr(self.__class__,nm).im_func is not \
+               getattr(FileWrapper,nm).im_func:
+                return False
+        return True
+    
     def _read(self,sizehint=-1):
         data = self._fileobj.read(sizehint)
         if data == "":
@@ -163,23 +189,45 @@ class FileWrapper(FileLikeBase):
     def _truncate(self,size):
         return self._fileobj.truncate(size)
 
-##  Import the various classes from our sub-modules.
-
-from filelike.wrappers.debug import Debug
-
-from filelike.wrappers.translate import Translate, BytewiseTranslate
-
-from filelike.wrappers.fixedblocksize import FixedBlockSize
-
-from filelike.wrappers.padtoblocksize import PadToBlockSize, UnPadToBlockSize
-
-from filelike.wrappers.crypto import Encrypt, Decrypt
-
-from filelike.wrappers.buffer import Buffer, FlushableBuffer
-
-from filelike.wrappers.compress import BZip2, UnBZip2, GZip, UnGZip
-
-from filelike.wrappers.unix import Head
-
-from filelike.wrappers.slice import Slice
-
+##  The various classes live in our sub-modules, which are imported only
+##  when one of their classes is first accessed.  This keeps the cost of
+##  "import filelike" down, since e.g. the compression wrappers pull in
+##  the bz2 and zlib modules.
+
+_submodules = {
+    "Debug": "debug",
+    "Translate": "translate",
+    "BytewiseTranslate": "translate",
+    "FixedBlockSize": "fixedblocksize",
+    "PadToBlockSize": "padtoblocksize",
+    "UnPadToBlockSize": "padtoblocksize",
+    "Encrypt": "crypto",
+    "Decrypt": "crypto",
+    "Buffer": "buffer",
+    "FlushableBuffer": "buffer",
+    "BZip2": "compress",
+    "UnBZip2": "compress",
+    "GZip": "compress",
+    "UnGZip": "compress",
+    "Deflate": "compress",
+    "UnDeflate": "compress",
+    "Zlib": "compress",
+    "UnZlib": "compress",
+    "BGZF": "compress",
+    "UnBGZF": "compress",
+    "Head": "unix",
+    "Slice": "slice",
+}
+
+__all__ = ["FileWrapper"] + sorted(_submodules)
+
+def _resolve(name):
+    """Import the wrapper class of the given name from its sub-module."""
+    try:
+        modname = "filelike.wrappers." + _submodules[name]
+    except KeyError:
+        raise AttributeError(name)
+    module = __import__(modname,fromlist=[name])
+    return getattr(module,name)
+
+filelike._make_lazy_module(__name__,_resolve)
@@ -30,21 +30,20 @@ write() being called.
 The subclass 'FlushableBuffer' additionally assumes that the underlying
 stream can be reset back to position zero, allowing flushes to be performed.
 
+A 'BufferPool' can be used to share a single memory budget between many
+buffers, moving the least recently used of them to disk as it fills up.
+
 """ 
 
-import os
-import sys
+import zlib
+import mmap
+import threading
+from collections import OrderedDict
+from tempfile import TemporaryFile
 
 import filelike
 from filelike.wrappers import FileWrapper
 
-try:
-    from tempfile import SpooledTemporaryFile
-except ImportError:
-    from tempfile import TemporaryFile
-    def SpooledTemporaryFile(max_size=None,*args,**kwds):
-        return TemporaryFile(*args,**kwds)
-
 
 class Buffer(FileWrapper):
     """Class implementing buffering of input and output streams.
@@ -53,21 +52,47 @@ class Buffer(FileWrapper):
     underlying file while they are being manipulated.  As data is read
     it is duplicated into the buffer, and data is written from the buffer
     back to the file on close.
+
+    The buffer is held in memory as a list of pages until it grows beyond
+    'max_size_in_memory' bytes, then moved to a temporary file.  If
+    'compressed' is true, the pages are compressed with zlib at level 1,
+    and 'max_size_in_memory' limits the size of the compressed pages; this
+    keeps much more data in memory if it compresses well, at some cost in
+    CPU time.  The limit then defaults to 1MB rather than 8KB.
+
+    If 'pool' is given, or the class attribute 'default_pool' is set, it
+    must be a BufferPool and the memory used by the buffer is counted
+    against that of the pool.  The buffer may then be moved to disk to
+    make room for others, and 'max_size_in_memory' defaults to the size
+    of the whole pool.
     """
+
+    default_pool = None
     
-    def __init__(self,fileobj,mode=None,max_size_in_memory=1024*8):
+    def __init__(self,fileobj,mode=None,max_size_in_memory=None,
+                      compressed=False,pool=None):
         """Buffered file wrapper constructor."""
-        self._buffer = SpooledTemporaryFile(max_size=max_size_in_memory)
+        if pool is None:
+            pool = self.default_pool
+        if max_size_in_memory is None:
+            if pool is not None:
+                max_size_in_memory = pool.max_size
+            elif compressed:
+                max_size_in_memory = 1024*1024
+            else:
+                max_size_in_memory = 1024*8
+        if pool is None:
+            self._buffer = _PageSpool(max_size_in_memory,compressed)
+        else:
+            self._buffer = _PooledPageSpool(pool,max_size_in_memory,
+                                            compressed)
         self._in_eof = False
         self._in_pos = 0
         self._was_truncated = False
         super(Buffer,self).__init__(fileobj,mode)
 
     def _buffer_size(self):
-        try:
-            return len(self._buffer.file.getvalue())
-        except AttributeError:
-            return os.fstat(self._buffer.fileno()).st_size
+        return self._buffer.getsize()
 
     def _buffer_chunks(self):
         chunk = self._buffer.read(16*1024)
@@ -126,7 +151,7 @@ class Buffer(FileWrapper):
             return None
         data = self._fileobj.read(sizehint)
         self._in_pos += len(data)
-        self._buffer.write(data)
+        self._buffer.fill(data)
         if sizehint < 0 or len(data) < sizehint:
             self._in_eof = True
             self._buffer.flush()
@@ -165,24 +190,7 @@ class Buffer(FileWrapper):
             if size > self._in_pos:
                 self._read_rest()
         self._in_eof = True
-        try:
-            self._buffer.truncate(size)
-        except TypeError:
-            et,ev,tb = sys.exc_info()
-            # SpooledTemporaryFile.truncate() doesn't accept size paramter.
-            try:
-                self._buffer._file.truncate(size)
-            except Exception:
-                raise et,ev,tb
-        # StringIO objects don't truncate to larger size correctly.
-        if hasattr(self._buffer,"_file"):
-            _file = self._buffer._file
-            if hasattr(_file,"getvalue"):
-                if len(_file.getvalue()) != size:
-                    curpos = _file.tell()
-                    _file.seek(0,2)
-                    _file.write("\x00" * (size - len(_file.getvalue())))
-                    _file.seek(curpos)
+        self._buffer.truncate(size)
         self._was_truncated = True
 
     def _read_rest(self):
@@ -194,7 +202,7 @@ class Buffer(FileWrapper):
         data = self._fileobj.read(self._bufsize)
         while data:
             self._in_pos += len(data)
-            self._buffer.write(data)
+            self._buffer.fill(data)
             data = self._fileobj.read(self._bufsize)
         self._in_eof = True 
         self._buffer.flush()
@@ -207,30 +215,54 @@ class FlushableBuffer(Buffer):
     This subclass of Buffer assumes that the underlying file object can
     be reset to position 0, allowing calls to flush() to write out to
     the underlying file.
+
+    If the underlying file is a native file that supports seek() and tell(),
+    flush() writes back only the pages of the buffer that have changed
+    since the last flush, rather than the whole of its contents.
     """
 
     _append_requires_overwite = True
 
-    def __init__(self,fileobj,mode=None,max_size_in_memory=1024*8):
-        super(FlushableBuffer,self).__init__(fileobj,mode,max_size_in_memory)
+    def __init__(self,fileobj,mode=None,max_size_in_memory=None,
+                      compressed=False,pool=None):
+        #  Whether the buffer has changed since it was last written out
+        self._dirty = True
+        super(FlushableBuffer,self).__init__(fileobj,mode,max_size_in_memory,
+                                             compressed,pool)
         if "a" in self.mode and not self._check_mode("r"):
             self._start_pos = self._fileobj.tell()
+        self._sparse = "a" not in self.mode and _random_access(self._fileobj)
 
     def flush(self):
-        if self._check_mode("w-"):
+        if self._check_mode("w-") and self._dirty:
             pos = self._buffer.tell()
-            self._write_out_buffer()
+            if self._sparse:
+                self._write_out_pages()
+            else:
+                self._write_out_buffer()
+            self._buffer.clean()
             self._buffer.seek(pos)
+            self._dirty = False
         self._buffer.flush()
         # Skip Buffer.flush, as it doesn't call parent class methods
         super(Buffer,self).flush()
 
+    def _write(self,data,flushing=False):
+        if data:
+            self._dirty = True
+        return super(FlushableBuffer,self)._write(data,flushing)
+
+    def _truncate(self,size):
+        self._dirty = True
+        super(FlushableBuffer,self)._truncate(size)
+
     def close(self):
         if self.closed:
             return
         # Don't call Buffer.close, it will call _write_out_buffer, but
         # that's done by the implicit flush() in this case.
         super(Buffer,self).close()
+        self._buffer.close()
 
     def _write_out_buffer(self):
         if self._check_mode("r"):
@@ -253,4 +285,498 @@ class FlushableBuffer(Buffer):
         for chunk in self._buffer_chunks():
             self._fileobj.write(chunk)
 
+    def _write_out_pages(self):
+        """Write back only the changed ranges of the buffer."""
+        for (offset,length) in self._buffer.dirty_ranges():
+            self._buffer.seek(offset)
+            self._fileobj.seek(offset)
+            while length > 0:
+                chunk = self._buffer.read(min(length,16*1024))
+                self._fileobj.write(chunk)
+                length -= len(chunk)
+        if self._was_truncated:
+            self._fileobj.truncate(self._buffer.getsize())
+            self._was_truncated = False
+        if self._check_mode("r") and not self._in_eof:
+            self._fileobj.seek(self._in_pos)
+
+
+def _random_access(fileobj):
+    """Check whether writes can be made anywhere in the given file."""
+    if isinstance(fileobj,filelike.FileLikeBase):
+        return False
+    if not hasattr(fileobj,"seek"):
+        return False
+    try:
+        fileobj.tell()
+    except (AttributeError,IOError):
+        return False
+    return True
+
+
+class _PageSpool(object):
+    """Buffer file holding its contents in memory as a list of pages.
+
+    Data is kept in pages of 'pagesize' bytes.  If 'compressed' is true,
+    only the few most recently used pages are held as they are, and the
+    rest are compressed with zlib at level 1 (or kept as they are if that
+    doesn't make them smaller).  Once the memory used by the pages exceeds
+    'max_size', the contents are moved to a temporary file, which is used
+    from then on, as for SpooledTemporaryFile.
+
+    The size of the contents is tracked as they change, and the pages
+    written to since the last call to clean() are recorded so that only
+    those need be written back.  Data written with fill() isn't counted
+    as a change.
+    """
+
+    pagesize = 64*1024
+    hot_pages = 4
+
+    def __init__(self,max_size=1024*1024,compressed=True):
+        self.max_size = max_size
+        self.compressed = compressed
+        self.closed = False
+        #  Pages as bytearrays, or if compressed, cold pages as
+        #  (is_compressed,data) and None for those in the cache.
+        self._pages = []
+        #  Cache of pages as [index,data,cold copy], most recent last.  The
+        #  cold copy is kept until the page is changed.
+        self._hot = []
+        self._memory = 0
+        self._dirty = set()
+        self._pos = 0
+        self._size = 0
+        self._disk = None
+
+    def _store(self,data):
+        cdata = zlib.compress(data,1)
+        if len(cdata) < len(data):
+            return (True,cdata)
+        return (False,data)
+
+    def _page(self,idx):
+        """Get the data of the given page as a bytearray."""
+        if idx == len(self._pages):
+            if self.compressed:
+                self._pages.append((False,""))
+            else:
+                self._pages.append(bytearray())
+        if not self.compressed:
+            return self._pages[idx]
+        for (i,entry) in enumerate(self._hot):
+            if entry[0] == idx:
+                if i != len(self._hot) - 1:
+                    del self._hot[i]
+                    self._hot.append(entry)
+                return entry[1]
+        cold = self._pages[idx]
+        self._pages[idx] = None
+        if cold[0]:
+            data = bytearray(zlib.decompress(cold[1]))
+        else:
+            data = bytearray(cold[1])
+        self._memory += len(data)
+        self._hot.append([idx,data,cold])
+        while len(self._hot) > self.hot_pages:
+            (i,page,cold) = self._hot.pop(0)
+            self._memory -= len(page)
+            if cold is None:
+                cold = self._store(str(page))
+                self._memory += len(cold[1])
+            self._pages[i] = cold
+        return data
+
+    def _changed(self,idx):
+        """Mark the given (cached) page as changed."""
+        for entry in self._hot:
+            if entry[0] == idx and entry[2] is not None:
+                self._memory -= len(entry[2][1])
+                entry[2] = None
+
+    def memory_size(self):
+        """Get the amount of memory used to hold the contents."""
+        return self._memory
+
+    def getsize(self):
+        return self._size
+
+    def dirty_ranges(self):
+        """Get the (offset,length) ranges changed since the last clean()."""
+        ranges = []
+        for idx in sorted(self._dirty):
+            start = idx * self.pagesize
+            end = min(start + self.pagesize,self._size)
+            if ranges and ranges[-1][0] + ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0],end - ranges[-1][0])
+            elif end > start:
+                ranges.append((start,end - start))
+        return ranges
+
+    def clean(self):
+        """Forget which pages have been changed."""
+        self._dirty = set()
+
+    def _spill_file(self):
+        return TemporaryFile()
+
+    def _spill(self):
+        """Move the contents to a temporary file."""
+        disk = self._spill_file()
+        hot = dict([(e[0],e[1]) for e in self._hot])
+        for (idx,page) in enumerate(self._pages):
+            if not self.compressed:
+                disk.write(str(page))
+            elif page is None:
+                disk.write(str(hot[idx]))
+            elif page[0]:
+                disk.write(zlib.decompress(page[1]))
+            else:
+                disk.write(page[1])
+        disk.seek(self._pos)
+        self._disk = disk
+        self._pages = []
+        self._hot = []
+        self._memory = 0
 
+    def _check_size(self):
+        if self._disk is None and self._memory > self.max_size:
+            self._spill()
+
+    def read(self,size=-1):
+        if self._disk is not None:
+            #  File objects may return junk on a read straight after a
+            #  write, unless there's a seek in between.
+            self._disk.seek(self._pos)
+            data = self._disk.read(size)
+            self._pos += len(data)
+            return data
+        if size < 0 or size > self._size - self._pos:
+            size = max(0,self._size - self._pos)
+        chunks = []
+        while size > 0:
+            (idx,offset) = divmod(self._pos,self.pagesize)
+            chunk = str(self._page(idx)[offset:offset+size])
+            chunks.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        self._check_size()
+        return "".join(chunks)
+
+    def write(self,data):
+        self._write(data,True)
+
+    def fill(self,data):
+        """Write data without marking it as changed."""
+        self._write(data,False)
+
+    def _write(self,data,dirty):
+        if self._pos > self._size:
+            pos = self._pos
+            self._pos = self._size
+            self._write("\x00" * (pos - self._size),dirty)
+        if dirty and data:
+            first = self._pos // self.pagesize
+            last = (self._pos + len(data) - 1) // self.pagesize
+            self._dirty.update(xrange(first,last + 1))
+        if self._disk is not None:
+            self._disk.seek(self._pos)
+            self._disk.write(data)
+            self._pos += len(data)
+            self._size = max(self._size,self._pos)
+            return
+        while data:
+            (idx,offset) = divmod(self._pos,self.pagesize)
+            page = self._page(idx)
+            chunk = data[:self.pagesize - offset]
+            size = len(page)
+            page[offset:offset+len(chunk)] = chunk
+            self._memory += len(page) - size
+            if self.compressed:
+                self._changed(idx)
+            self._pos += len(chunk)
+            data = data[len(chunk):]
+        self._size = max(self._size,self._pos)
+        self._check_size()
+
+    def seek(self,offset,whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+        if offset < 0:
+            raise IOError("Invalid seek offset")
+        self._pos = offset
+        if self._disk is not None:
+            self._disk.seek(offset)
+
+    def tell(self):
+        return self._pos
+
+    def truncate(self,size=None):
+        if size is None:
+            size = self._pos
+        if size > self._size:
+            pos = self._pos
+            self.seek(0,2)
+            self.write("\x00" * (size - self._size))
+            self.seek(pos)
+            return
+        npages = (size + self.pagesize - 1) // self.pagesize
+        self._dirty = set([i for i in self._dirty if i < npages])
+        self._size = size
+        if self._disk is not None:
+            self._disk.truncate(size)
+            return
+        for entry in self._hot[:]:
+            if entry[0] >= npages:
+                self._hot.remove(entry)
+                self._memory -= len(entry[1])
+                if entry[2] is not None:
+                    self._memory -= len(entry[2][1])
+        for page in self._pages[npages:]:
+            if not self.compressed:
+                self._memory -= len(page)
+            elif page is not None:
+                self._memory -= len(page[1])
+        del self._pages[npages:]
+        if size % self.pagesize:
+            idx = npages - 1
+            page = self._page(idx)
+            self._memory -= len(page) - size % self.pagesize
+            del page[size % self.pagesize:]
+            if self.compressed:
+                self._changed(idx)
+
+    def flush(self):
+        if self._disk is not None:
+            self._disk.flush()
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+        self._pages = []
+        self._hot = []
+        self._memory = 0
+        self.closed = True
+
+
+class _PooledPageSpool(_PageSpool):
+    """_PageSpool whose memory is counted against that of a BufferPool.
+
+    The pool may move the contents to disk from another thread, so every
+    operation is done under a lock.
+    """
+
+    def __init__(self,pool,max_size=1024*1024,compressed=True):
+        self.pool = pool
+        self._lock = threading.RLock()
+        super(_PooledPageSpool,self).__init__(max_size,compressed)
+        pool._update(self)
+
+    def _spill_file(self):
+        return self.pool._spill_file()
+
+    def _check_size(self):
+        super(_PooledPageSpool,self)._check_size()
+        self.pool._update(self)
+
+    def read(self,size=-1):
+        self._lock.acquire()
+        try:
+            return super(_PooledPageSpool,self).read(size)
+        finally:
+            self._lock.release()
+
+    def _write(self,data,dirty):
+        self._lock.acquire()
+        try:
+            super(_PooledPageSpool,self)._write(data,dirty)
+        finally:
+            self._lock.release()
+
+    def seek(self,offset,whence=0):
+        self._lock.acquire()
+        try:
+            super(_PooledPageSpool,self).seek(offset,whence)
+        finally:
+            self._lock.release()
+
+    def truncate(self,size=None):
+        self._lock.acquire()
+        try:
+            super(_PooledPageSpool,self).truncate(size)
+            self._check_size()
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        self._lock.acquire()
+        try:
+            super(_PooledPageSpool,self).flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            super(_PooledPageSpool,self).close()
+            self.pool._update(self)
+        finally:
+            self._lock.release()
+
+
+class BufferPool(object):
+    """Memory budget shared between several Buffer instances.
+
+    Instances of this class can be passed as the 'pool' argument of Buffer,
+    or assigned to Buffer.default_pool to be used by all buffers created
+    from then on.  The contents of all buffers in the pool are kept in
+    memory until together they exceed 'max_size' bytes, at which point the
+    least recently used buffers are moved to temporary files until they fit
+    again.  Buffers moved to disk stay there until closed.
+
+    Temporary files are created in the directory 'dir' if given.  If
+    'use_mmap' is true they are memory-mapped rather than accessed with
+    read() and write() calls.
+
+    The memory currently in use is given by memory_size(), and the number
+    of buffers that have been moved to disk by the 'spills' attribute.
+    """
+
+    def __init__(self,max_size=64*1024*1024,dir=None,use_mmap=False):
+        self.max_size = max_size
+        self.dir = dir
+        self.use_mmap = use_mmap
+        self.spills = 0
+        #  Memory used by each buffer held in memory, least recent first
+        self._spools = OrderedDict()
+        self._memory = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._spools)
+
+    def memory_size(self):
+        """Get the amount of memory used by buffers in the pool."""
+        return self._memory
+
+    def _spill_file(self):
+        if self.use_mmap:
+            return _MappedFile(self.dir)
+        return TemporaryFile(dir=self.dir)
+
+    def _update(self,spool):
+        """Account for a change to the given spool, and spill if needed.
+
+        The spool is marked as the most recently used, and dropped from
+        the pool once it has been closed or moved to disk.
+        """
+        self._lock.acquire()
+        try:
+            size = self._spools.pop(spool,None)
+            if size is not None:
+                self._memory -= size
+            if spool.closed:
+                return
+            if spool._disk is not None:
+                if size is not None:
+                    self.spills += 1
+                return
+            self._spools[spool] = spool.memory_size()
+            self._memory += spool.memory_size()
+            if self._memory > self.max_size:
+                self._make_room()
+        finally:
+            self._lock.release()
+
+    def _make_room(self):
+        """Move the least recently used spools to disk until all fit."""
+        for victim in self._spools.keys():
+            if self._memory <= self.max_size:
+                break
+            #  Skip any spool in use by another thread; it's not idle
+            if not victim._lock.acquire(False):
+                continue
+            try:
+                victim._spill()
+            finally:
+                victim._lock.release()
+            self._memory -= self._spools.pop(victim)
+            self.spills += 1
+
+
+class _MappedFile(object):
+    """Temporary file accessed through a memory map.
+
+    The file is grown in steps of at least double its size, as remapping
+    it is expensive.
+    """
+
+    def __init__(self,dir=None):
+        self._file = TemporaryFile(dir=dir)
+        self._map = None
+        self._capacity = 0
+        self._size = 0
+        self._pos = 0
+
+    def _reserve(self,size):
+        if size <= self._capacity:
+            return
+        capacity = max(size,2*self._capacity,mmap.PAGESIZE)
+        if self._map is None:
+            self._file.truncate(capacity)
+            self._map = mmap.mmap(self._file.fileno(),capacity)
+        else:
+            self._map.resize(capacity)
+        self._capacity = capacity
+
+    def read(self,size=-1):
+        end = self._size
+        if size >= 0:
+            end = min(end,self._pos + size)
+        if end <= self._pos:
+            return ""
+        data = self._map[self._pos:end]
+        self._pos = end
+        return data
+
+    def write(self,data):
+        if not data and self._pos <= self._size:
+            return
+        end = self._pos + len(data)
+        self._reserve(end)
+        if self._pos > self._size:
+            self._map[self._size:self._pos] = "\x00" * (self._pos - self._size)
+        self._map[self._pos:end] = data
+        self._pos = end
+        self._size = max(self._size,end)
+
+    def seek(self,offset,whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+        self._pos = offset
+
+    def tell(self):
+        return self._pos
+
+    def truncate(self,size=None):
+        if size is None:
+            size = self._pos
+        if size > self._size:
+            pos = self._pos
+            self._pos = size
+            self.write("")
+            self._pos = pos
+        self._size = size
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
@@ -34,6 +34,9 @@ from filelike.wrappers.buffer import FlushableBuffer
 
 import bz2
 import zlib
+import struct
+from bisect import bisect_right
+from binascii import hexlify, unhexlify
 
 
 class Decompress(FileWrapper):
@@ -43,6 +46,11 @@ class Decompress(FileWrapper):
     all data read from the file is decompressed on demand, and all data
     written to the file is compressed.
 
+    In append mode ("a") the data written is compressed into a new member
+    (or stream) following the existing data, which is left untouched, so
+    appending costs no more than writing the new data.  Such files can't
+    seek, and tell() counts only the data written since opening.
+
     Subclases must provide compress() and decompress() methods.
     """
 
@@ -56,18 +64,44 @@ class Decompress(FileWrapper):
         if "r" in mode:
             if "w" not in mode and "a" not in mode and "+" not in mode:
                 # Nice and easy, just a streaming decompress on read
-                myFileObj = Translate(fileobj,mode=mode,rfunc=self.decompress)
+                myFileObj = self._make_reader(fileobj,mode)
         else:
-            if "-" in mode:
+            if "a" in mode and "+" not in mode:
+                # Appending just writes a new compressed member after the
+                # existing data, which is never read back or rewritten.
+                if "-" not in mode:
+                    mode += "-"
+                try:
+                    fileobj.seek(0,2)
+                except (AttributeError,IOError):
+                    pass
+                myFileObj = self._make_writer(fileobj,mode)
+            elif "-" in mode:
                 # Nice and easy, just a streaming compress on write
-                myFileObj = Translate(fileobj,mode=mode,wfunc=self.compress)
+                myFileObj = self._make_writer(fileobj,mode)
         if not myFileObj:
             # Rats, writing + seekabilty == inefficient.
-            # Operating in a buffer is the only sensible option
+            # Operating in a buffer is the only sensible option.  The
+            # decompressed data should compress well, so keep it that way.
             myFileObj = Translate(fileobj,mode=mode,rfunc=self.decompress,wfunc=self.compress)
-            myFileObj = FlushableBuffer(myFileObj,mode=mode)
+            myFileObj = FlushableBuffer(myFileObj,mode=mode,compressed=True)
         super(Decompress,self).__init__(myFileObj,mode=mode)
 
+    def _make_reader(self,fileobj,mode):
+        """Create the file object used to decompress a read-only file.
+
+        By default this is a simple Translate wrapper.  Subclasses may
+        override it to provide e.g. more efficient seeking.
+        """
+        return Translate(fileobj,mode=mode,rfunc=self.decompress)
+
+    def _make_writer(self,fileobj,mode):
+        """Create the file object used to compress a streamed or appended file.
+
+        By default this is a simple Translate wrapper.
+        """
+        return Translate(fileobj,mode=mode,wfunc=self.compress)
+
     def _read(self,sizehint=-1):
         data = super(Decompress,self)._read(sizehint)
         return data
@@ -126,19 +160,91 @@ class BZip2Mixin(object):
         compress.reset = c_reset
         self.compress = compress
         # Decompression funtion with reset
-        d = [bz2.BZ2Decompressor()]
-        def decompress(data):
-            if data == "":
+        d = [_BZip2StreamDecompressor()]
+        def decompress(data,max_length=0):
+            if data == "" and not d[0].has_tail():
                 return ""
-            return d[0].decompress(data)
+            return d[0].decompress(data,max_length)
+        def d_has_tail():
+            return d[0].has_tail()
         def d_reset():
-            d[0] = bz2.BZ2Decompressor()
+            d[0] = _BZip2StreamDecompressor()
+        decompress.has_tail = d_has_tail
         decompress.reset = d_reset
         self.decompress = decompress
         # These can now be used by superclass constructors
         super(BZip2Mixin,self).__init__(*args,**kwds)
 
 
+class _BZip2StreamDecompressor(object):
+    """Decompressor for bzip2 data made up of several concatenated streams.
+
+    A BZ2Decompressor refuses any data after the end of its stream, so a
+    fresh one is started for each following stream, as bunzip2 does.  Data
+    after the last stream that isn't another bzip2 header is ignored.
+
+    If 'max_length' is given, input is fed to the decompressor a slice at a
+    time until that much output has been produced, and the rest is kept
+    for the next call.  The bz2 module has no equivalent of zlib's
+    max_length, so output may still overshoot by up to a bzip2 block.
+    """
+
+    _slice_size = 8*1024
+
+    def __init__(self):
+        self._d = bz2.BZ2Decompressor()
+        #  Start of data between streams, too short to check for a header
+        self._head = ""
+        #  Input not yet passed to the decompressor
+        self._tail = ""
+        self._done = False
+
+    def has_tail(self):
+        return bool(self._tail) and not self._done
+
+    def decompress(self,data,max_length=0):
+        if max_length:
+            data = self._tail + data
+            self._tail = ""
+            out = []
+            size = 0
+            while data and size < max_length and not self._done:
+                chunk = self._decompress(data[:self._slice_size])
+                data = data[self._slice_size:]
+                out.append(chunk)
+                size += len(chunk)
+            self._tail = data
+            return "".join(out)
+        if self._tail:
+            data = self._tail + data
+            self._tail = ""
+        return self._decompress(data)
+
+    def _decompress(self,data):
+        out = []
+        while data and not self._done:
+            if self._d is None:
+                data = self._head + data
+                if len(data) < 3:
+                    self._head = data
+                    break
+                self._head = ""
+                if data[:3] != "BZh":
+                    self._done = True
+                    break
+                self._d = bz2.BZ2Decompressor()
+            try:
+                out.append(self._d.decompress(data))
+            except EOFError:
+                #  The stream ended exactly at the end of the previous data
+                self._d = None
+                continue
+            data = self._d.unused_data
+            if data:
+                self._d = None
+        return "".join(out)
+
+
 class UnBZip2(BZip2Mixin,Decompress):
     """Class for reading and writing to a un-bziped file.
         
@@ -146,12 +252,385 @@ class UnBZip2(BZip2Mixin,Decompress):
     the standard library, except that it accepts an arbitrary file-like
     object.  All reads from the file are decompressed, all writes are
     compressed.
+
+    When opened for seekable reading only, the file is decoded one bzip2
+    block at a time and an index of the blocks is kept, so that seeks go
+    straight to the block containing the requested position.  If the
+    'processes' argument is greater than one, blocks are also decoded
+    in parallel using a pool of that many processes.  Set 'block_index'
+    to False to use a simple streaming decompressor instead.
     """
     
-    def __init__(self,fileobj,mode=None,compresslevel=9):
+    def __init__(self,fileobj,mode=None,compresslevel=9,block_index=True,
+                      processes=None):
         self.compresslevel = compresslevel
+        self.block_index = block_index
+        self.processes = processes
         super(UnBZip2,self).__init__(fileobj,mode=mode)
 
+    def _make_reader(self,fileobj,mode):
+        if "-" in mode or not self.block_index:
+            return super(UnBZip2,self)._make_reader(fileobj,mode)
+        return _IndexedBZip2Reader(fileobj,mode,self.processes)
+
+
+##  Each block in a bzip2 stream starts with a 48-bit magic number, and the
+##  stream ends with another magic number followed by a combined CRC.  None
+##  of these are byte-aligned, so we search for them at each of the eight
+##  possible bit offsets.  The byte-aligned core of each shifted magic is
+##  found with str.find(), and the partial bytes at each end then checked.
+
+_BZ2_BLOCK_MAGIC = 0x314159265359
+_BZ2_EOS_MAGIC = 0x177245385090
+
+def _bz2_magic_patterns(magic):
+    """Get (shift,core,head,tail) search patterns for a 48-bit magic."""
+    patterns = [(0,unhexlify("%012x" % (magic,)),None,None)]
+    for shift in xrange(1,8):
+        shifted = unhexlify("%014x" % (magic << (8 - shift),))
+        head = (ord(shifted[0]),0xff >> shift)
+        tail = (ord(shifted[6]),(0xff << (8 - shift)) & 0xff)
+        patterns.append((shift,shifted[1:6],head,tail))
+    return patterns
+
+_BZ2_PATTERNS = [(p,"block") for p in _bz2_magic_patterns(_BZ2_BLOCK_MAGIC)]
+_BZ2_PATTERNS += [(p,"eos") for p in _bz2_magic_patterns(_BZ2_EOS_MAGIC)]
+
+def _find_bz2_magic(data,start=0,end=None):
+    """Find bzip2 block and end-of-stream magic numbers in a string.
+
+    Returns a sorted list of (bitpos,kind) tuples for each magic number
+    found starting in bytes data[start:end], where 'kind' is either
+    "block" or "eos".
+    """
+    if end is None:
+        end = len(data)
+    found = []
+    for ((shift,core,head,tail),kind) in _BZ2_PATTERNS:
+        if shift == 0:
+            i = data.find(core,start)
+            while 0 <= i < end:
+                found.append((i*8,kind))
+                i = data.find(core,i+1)
+        else:
+            i = data.find(core,start+1)
+            while 0 < i <= end and i + 5 < len(data):
+                if ord(data[i-1]) & head[1] == head[0] and \
+                   ord(data[i+5]) & tail[1] == tail[0]:
+                    found.append(((i-1)*8 + shift,kind))
+                i = data.find(core,i+1)
+    found.sort()
+    return found
+
+def _is_bz2_header(data):
+    """Check whether a string is a bzip2 stream header, e.g. "BZh9"."""
+    return len(data) == 4 and data[:3] == "BZh" and data[3] in "123456789"
+
+def _bz2_gap_kind(data,start,end):
+    """Classify the data following a bzip2 end-of-stream marker.
+
+    'start' is the bit offset of the marker in 'data', and 'end' that of the
+    next magic number or None if there is none.  The marker is followed by
+    the stream CRC and padding to a byte boundary.  Returns "eos" if this
+    is followed by the header of another stream, "tail" for trailing data
+    that is not a bzip2 stream and should be ignored, or "bad" otherwise.
+    """
+    hdr = (start + 80 + 7) // 8
+    if data[hdr:hdr+3] != "BZh":
+        return "tail"
+    if _is_bz2_header(data[hdr:hdr+4]) and end == (hdr + 4) * 8:
+        return "eos"
+    return "bad"
+
+def _decode_bz2_block(data,start,end):
+    """Decode a single bzip2 block from the given bits of a string.
+
+    'start' and 'end' are bit offsets into 'data', giving the block's
+    magic number and the magic number following the block.  The block is
+    shifted into byte alignment and given its own stream header and footer,
+    so it can be decoded as a standalone bzip2 stream.  Since each block
+    has its own CRC, this will fail if the bits do not hold a valid block.
+    """
+    first = start // 8
+    chunk = data[first:(end + 7) // 8]
+    nbits = end - start
+    value = long(hexlify(chunk),16) >> (len(chunk)*8 - (end - first*8))
+    value &= (1 << nbits) - 1
+    #  For a single block, the stream CRC is the same as the block CRC
+    crc = (value >> (nbits - 80)) & 0xffffffff
+    value = (value << 80) | (_BZ2_EOS_MAGIC << 32) | crc
+    nbits += 80
+    value <<= -nbits % 8
+    nbytes = (nbits + 7) // 8
+    return bz2.decompress("BZh9" + unhexlify("%0*x" % (nbytes*2,value)))
+
+
+class _IndexedBZip2Reader(FileWrapper):
+    """Seekable reader for bzip2 data, decoding one block at a time.
+
+    The compressed data is scanned for block magic numbers, and each block
+    is decoded as a standalone stream.  The compressed and uncompressed
+    extent of each block is recorded as it is decoded, so that seeks can
+    restart decoding at the block containing the target position.  If
+    'processes' is greater than one, upcoming blocks are decoded in a pool
+    of worker processes while data is read sequentially.
+
+    Since blocks are found by their magic numbers, this also reads files
+    made of several concatenated bzip2 streams.  The header of each stream
+    is checked, and as when streaming, data after the last stream that
+    isn't another bzip2 header is ignored.
+    """
+
+    def __init__(self,fileobj,mode="r",processes=None):
+        super(_IndexedBZip2Reader,self).__init__(fileobj,mode=mode)
+        self.processes = processes
+        self._pool = None
+        self._pending = []
+        # Decoded blocks as (compressed start bit,compressed end bit,
+        # uncompressed start,uncompressed size)
+        self._blocks = []
+        self._index = []
+        self._nblock = 0
+        self._upos = 0
+        self._ubuf = ""
+        self._reset_scanner(0)
+
+    def close(self):
+        super(_IndexedBZip2Reader,self).close()
+        if getattr(self,"_pool",None) is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def _reset_scanner(self,bitpos):
+        """Start scanning for blocks at the given bit position."""
+        self._cbuf = ""
+        self._cbuf_pos = bitpos // 8
+        self._scanned = 0
+        self._scan_min = bitpos
+        self._magics = []
+        self._ceof = False
+        self._pending = []
+        #  Whether the stream header at the start of the file is unchecked
+        self._at_start = (bitpos == 0)
+        #  Whether trailing non-bzip2 data has been reached
+        self._at_tail = False
+
+    def _next_raw(self):
+        """Find the compressed data for the next block.
+
+        Returns a tuple (start,end,first,chunk,kind) where 'start' and 'end'
+        are the bit offsets of the block in the file, and 'chunk' is the data
+        from file offset 'first' up to the end of the block.  If 'kind' is
+        not "block" this is the data between the end of a stream and the
+        next block, classified by _bz2_gap_kind().  The last magic number in
+        the file is returned with an 'end' of None, and is "bad" if it is
+        not an end-of-stream marker.  Returns None when there are no more
+        blocks.
+
+        IOError is raised if the file doesn't start with a bzip2 stream.
+        """
+        while True:
+            if len(self._magics) >= 2 or (self._ceof and self._magics):
+                if self._at_start:
+                    self._check_start()
+                (start,kind) = self._magics.pop(0)
+                first = self._cbuf_pos
+                if not self._magics:
+                    chunk = self._cbuf
+                    self._cbuf = ""
+                    if kind == "eos":
+                        kind = _bz2_gap_kind(chunk,start - first*8,None)
+                    else:
+                        kind = "bad"
+                    return (start,None,first,chunk,kind)
+                end = self._magics[0][0]
+                chunk = self._cbuf[:(end + 7) // 8 - first]
+                if kind == "eos":
+                    kind = _bz2_gap_kind(chunk,start - first*8,end - first*8)
+                #  Keep the byte containing 'end', it's part of the next block
+                drop = end // 8 - first
+                self._cbuf = self._cbuf[drop:]
+                self._cbuf_pos += drop
+                self._scanned -= drop
+                return (start,end,first,chunk,kind)
+            if self._ceof:
+                if self._at_start and self._cbuf:
+                    raise IOError("invalid data stream")
+                return None
+            data = self._fileobj.read(self._bufsize)
+            if data == "":
+                self._ceof = True
+                end = len(self._cbuf)
+            else:
+                self._cbuf += data
+                end = len(self._cbuf) - 6
+            if end > self._scanned:
+                base = self._cbuf_pos * 8
+                for (bit,kind) in _find_bz2_magic(self._cbuf,self._scanned,end):
+                    if bit + base >= self._scan_min:
+                        self._magics.append((bit + base,kind))
+                self._scanned = end
+
+    def _check_start(self):
+        """Check that the file starts with a header and then a magic number."""
+        self._at_start = False
+        if self._magics[0][0] != 32 or not _is_bz2_header(self._cbuf[:4]):
+            raise IOError("invalid data stream")
+
+    def _take_raw(self):
+        """Get the next block's compressed data, taking it from the pool's
+        queue if necessary."""
+        if self._pending:
+            return self._pending.pop(0)[0]
+        return self._next_raw()
+
+    def _decode(self,raw):
+        (start,end,first,chunk,_) = raw
+        return _decode_bz2_block(chunk,start - first*8,end - first*8)
+
+    def _decode_merged(self,raw):
+        """Decode a block that could not be decoded on its own.
+
+        The magic numbers can occur by chance within the compressed data,
+        splitting a real block in two.  In that case the following data is
+        joined on until it can be decoded.  Returns a tuple (raw,data)
+        giving the merged block and its decoded data.
+        """
+        while True:
+            nxt = self._take_raw()
+            if nxt is None or nxt[1] is None:
+                raise IOError("invalid data stream")
+            (start,_,first,chunk,kind) = raw
+            (_,end,nfirst,nchunk,_) = nxt
+            chunk = chunk + nchunk[first+len(chunk)-nfirst:]
+            raw = (start,end,first,chunk,kind)
+            try:
+                return (raw,self._decode(raw))
+            except (IOError,EOFError,ValueError):
+                pass
+
+    def _next_block(self):
+        """Decode the next block, returning its data or None at EOF."""
+        if self._at_tail:
+            return None
+        if self.processes > 1:
+            if self._pool is None:
+                import multiprocessing
+                self._pool = multiprocessing.Pool(self.processes)
+            while len(self._pending) < self.processes * 2:
+                raw = self._next_raw()
+                if raw is None:
+                    break
+                (start,end,first,chunk,kind) = raw
+                res = None
+                if kind == "block":
+                    args = (chunk,start - first*8,end - first*8)
+                    res = self._pool.apply_async(_decode_bz2_block,args)
+                self._pending.append((raw,res))
+            if not self._pending:
+                return None
+            (raw,res) = self._pending.pop(0)
+            if res is None:
+                return self._end_stream(raw)
+            try:
+                data = res.get()
+            except (IOError,EOFError,ValueError):
+                (raw,data) = self._decode_merged(raw)
+        else:
+            raw = self._next_raw()
+            if raw is None:
+                return None
+            if raw[4] != "block":
+                return self._end_stream(raw)
+            try:
+                data = self._decode(raw)
+            except (IOError,EOFError,ValueError):
+                (raw,data) = self._decode_merged(raw)
+        if self._nblock == len(self._blocks):
+            self._blocks.append((raw[0],raw[1],self._upos,len(data)))
+            self._index.append(self._upos)
+        self._nblock += 1
+        self._upos += len(data)
+        return data
+
+    def _end_stream(self,raw):
+        """Handle the data after the end of a stream.
+
+        Returns "" to continue with the next stream, or None if the rest
+        of the file is to be ignored.  Raises IOError if the data is
+        invalid.
+        """
+        if raw[4] == "eos":
+            return ""
+        if raw[4] == "tail":
+            self._at_tail = True
+            return None
+        raise IOError("invalid data stream")
+
+    def _restore(self,idx):
+        """Resume decoding just after the block with the given index.
+
+        The data of that block is placed in the read buffer.  If 'idx' is
+        the number of known blocks, decoding resumes after the last one.
+        """
+        if idx < len(self._blocks):
+            (start,end,ustart,usize) = self._blocks[idx]
+            first = start // 8
+            self._fileobj.seek(first)
+            chunk = self._fileobj.read((end + 7) // 8 - first)
+            self._ubuf = self._decode((start,end,first,chunk,"block"))
+            self._upos = ustart + usize
+            idx += 1
+        elif self._blocks:
+            (_,end,ustart,usize) = self._blocks[-1]
+            self._ubuf = ""
+            self._upos = ustart + usize
+        else:
+            end = 0
+            self._ubuf = ""
+            self._upos = 0
+        self._nblock = idx
+        self._fileobj.seek(end // 8)
+        self._reset_scanner(end)
+
+    def _read(self,sizehint=-1):
+        if self._ubuf:
+            data = self._ubuf
+            self._ubuf = ""
+            return data
+        data = self._next_block()
+        while data == "":
+            data = self._next_block()
+        return data
+
+    def _seek(self,offset,whence):
+        if whence != 0:
+            raise NotImplementedError
+        cur = self._tell()
+        if not cur <= offset <= self._upos:
+            idx = bisect_right(self._index,offset) - 1
+            if idx >= 0 and offset < self._index[idx] + self._blocks[idx][3]:
+                self._restore(idx)
+            elif offset < cur or self._nblock < len(self._blocks):
+                self._restore(len(self._blocks))
+        #  Decode forward to the requested position
+        skip = offset - self._tell()
+        if skip <= len(self._ubuf):
+            self._ubuf = self._ubuf[skip:]
+            return
+        skip -= len(self._ubuf)
+        self._ubuf = ""
+        while skip > 0:
+            data = self._next_block()
+            if data is None:
+                break
+            if len(data) > skip:
+                self._ubuf = data[skip:]
+            skip -= len(data)
+
+    def _tell(self):
+        return self._upos - len(self._ubuf)
+
 
 class BZip2(BZip2Mixin,Compress):
     """Class for reading and writing a bziped file.
@@ -166,17 +645,6 @@ class BZip2(BZip2Mixin,Compress):
         super(BZip2,self).__init__(fileobj,mode=mode)
 
 
-##  Add handling of .bz2 files to filelike.open()
-def _BZip2_decoder(fileobj):
-    """Decoder function for handling .bz2 files with filelike.open"""
-    if not fileobj.name.endswith(".bz2"):
-        return None
-    f = UnBZip2(fileobj)
-    f.name = fileobj.name[:-4]
-    return f
-filelike.open.decoders.append(_BZip2_decoder)
-
-
 class GZipMixin(object):
     """Mixin for Compress/Decompress subclasses using gzip."""
 
@@ -184,7 +652,10 @@ class GZipMixin(object):
         if not hasattr(self,"compresslevel"):
             self.compresslevel = 6
         # Compression function with flush and reset.
-        c = [zlib.compressobj(self.compresslevel)]
+        def compressobj():
+            return zlib.compressobj(self.compresslevel,zlib.DEFLATED,
+                                    16+zlib.MAX_WBITS)
+        c = [compressobj()]
         def compress(data):
             if data == "":
                 return ""
@@ -192,24 +663,301 @@ class GZipMixin(object):
         def c_flush():
             return c[0].flush()
         def c_reset():
-            c[0] = zlib.compressobj(self.compresslevel)
+            c[0] = compressobj()
         compress.flush = c_flush
         compress.reset = c_reset
+        threads = getattr(self,"threads",None)
+        if threads > 1 or getattr(self,"adaptive",False):
+            min_gain = None
+            if getattr(self,"adaptive",False):
+                min_gain = 0.05
+            compress = _ParallelGZipCompressor(self.compresslevel,threads or 1,
+                                               min_gain=min_gain)
         self.compress = compress
-        # Decompression funtion with reset
-        d = [zlib.decompressobj(16+zlib.MAX_WBITS)]
-        def decompress(data):
-            if data == "":
-                return ""
-            return d[0].decompress(data)
-        def d_reset():
-            d[0] = zlib.decompressobj(16+zlib.MAX_WBITS)
-        decompress.reset = d_reset
-        self.decompress = decompress
+        self.decompress = _gzip_decompress_function()
         # These can now be used by superclass constructors
         super(GZipMixin,self).__init__(*args,**kwds)
 
 
+def _gzip_decompress_function():
+    """Make a gzip decompression function with has_tail() and reset()."""
+    d = [_GZipMemberDecompressor()]
+    def decompress(data,max_length=0):
+        if data == "" and not d[0].has_tail():
+            return ""
+        return d[0].decompress(data,max_length)
+    def d_has_tail():
+        return d[0].has_tail()
+    def d_reset():
+        d[0] = _GZipMemberDecompressor()
+    decompress.has_tail = d_has_tail
+    decompress.reset = d_reset
+    return decompress
+
+
+class _GZipMemberDecompressor(object):
+    """Decompressor for gzip data made up of several concatenated members.
+
+    A zlib decompressor stops at the end of the first gzip member and
+    leaves anything after it in 'unused_data'.  This starts a fresh
+    decompressor for each following member, as gunzip does.  Data after
+    the last member that isn't another gzip header (typically padding with
+    zero bytes) is ignored.
+
+    If 'window' is given, decompression starts in the middle of a member,
+    at a byte-aligned deflate block boundary, with 'window' holding the
+    (up to 32K of) data that came before it.  The CRC of that member then
+    can't be checked.
+    """
+
+    def __init__(self,window=None):
+        if window is None:
+            self._d = zlib.decompressobj(16+zlib.MAX_WBITS)
+        else:
+            self._d = _inflate_decompressobj(window)
+        #  Whether _d is a raw inflater, leaving the member trailer unread
+        self._raw = window is not None
+        #  Bytes of a member trailer still to be skipped
+        self._skip = 0
+        #  Start of data between members, too short to check for a header
+        self._head = ""
+        #  Input left over when output was limited by max_length
+        self._tail = ""
+        self._done = False
+
+    def copy(self):
+        c = _GZipMemberDecompressor.__new__(_GZipMemberDecompressor)
+        if self._d is None:
+            c._d = None
+        else:
+            c._d = self._d.copy()
+        c._raw = self._raw
+        c._skip = self._skip
+        c._head = self._head
+        c._tail = self._tail
+        c._done = self._done
+        return c
+
+    def has_tail(self):
+        return bool(self._tail) and not self._done
+
+    def decompress(self,data,max_length=0):
+        """Decompress the given data.
+
+        If 'max_length' is given, at most that many bytes are returned and
+        any input not yet used is kept for the next call.
+        """
+        if self._tail:
+            data = self._tail + data
+            self._tail = ""
+        out = []
+        size = 0
+        while data and not self._done:
+            if max_length and size >= max_length:
+                self._tail = data
+                break
+            if self._d is None:
+                if self._skip:
+                    n = min(self._skip,len(data))
+                    self._skip -= n
+                    data = data[n:]
+                    if not data:
+                        break
+                data = self._head + data
+                if len(data) < 2:
+                    self._head = data
+                    break
+                self._head = ""
+                if data[:2] != "\x1f\x8b":
+                    self._done = True
+                    break
+                self._d = zlib.decompressobj(16+zlib.MAX_WBITS)
+            if max_length:
+                chunk = self._d.decompress(data,max_length - size)
+            else:
+                chunk = self._d.decompress(data)
+            out.append(chunk)
+            size += len(chunk)
+            #  At the end of a member, Python 2 may leave the rest of the
+            #  input in unconsumed_tail as well as in unused_data.
+            data = self._d.unused_data
+            if data:
+                if self._raw:
+                    self._raw = False
+                    self._skip = 8
+                self._d = None
+            elif max_length:
+                data = self._d.unconsumed_tail
+        return "".join(out)
+
+    def flush(self):
+        if self._d is None:
+            return ""
+        return self._d.flush()
+
+
+def _deflate_compressobj(level,zdict=None):
+    """Create a raw deflate compressor, primed with a preset dictionary.
+
+    Python 2's zlib module can't set a dictionary directly, so the
+    compressor is primed by compressing the dictionary and discarding the
+    output.  The sync flush leaves it at a block boundary with the
+    dictionary in its window, from where it can refer back into it just
+    as after deflateSetDictionary().
+    """
+    c = zlib.compressobj(level,zlib.DEFLATED,-zlib.MAX_WBITS)
+    if zdict:
+        c.compress(zdict[-32*1024:])
+        c.flush(zlib.Z_SYNC_FLUSH)
+    return c
+
+
+def _inflate_decompressobj(zdict=None):
+    """Create a raw deflate decompressor, primed with a preset dictionary."""
+    d = zlib.decompressobj(-zlib.MAX_WBITS)
+    if zdict:
+        #  Any encoding of the dictionary leaves it in the window
+        c = zlib.compressobj(1,zlib.DEFLATED,-zlib.MAX_WBITS)
+        d.decompress(c.compress(zdict[-32*1024:]) + c.flush(zlib.Z_SYNC_FLUSH))
+    return d
+
+
+def _deflate_block(data,level,zdict,final):
+    """Compress a block of data as part of a raw deflate stream.
+
+    Unless 'final' is true the output ends on a byte boundary without
+    ending the stream, so that it can be followed by the next block.  If
+    'zdict' is given, it primes the compressor with the data preceding
+    this block.
+    """
+    c = _deflate_compressobj(level,zdict)
+    if final:
+        return c.compress(data) + c.flush(zlib.Z_FINISH)
+    return c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _deflate_block_adaptive(data,level,zdict,final,min_gain=None):
+    """Compress a block as _deflate_block() does, unless incompressible.
+
+    A sample of the block is first compressed at level 1.  If that saves
+    less than the fraction 'min_gain' of its size, the block is instead
+    written as stored (uncompressed) deflate blocks, which takes almost
+    no time.  If 'min_gain' is None the block is always compressed.
+
+    Returns a tuple (output,stored) giving the number of bytes stored.
+    """
+    if min_gain is not None:
+        #  Four slices from across the block make up the sample
+        step = max(len(data) // 4,2048)
+        sample = "".join([data[i:i+2048] for i in xrange(0,len(data),step)])
+        c = zlib.compressobj(1,zlib.DEFLATED,-zlib.MAX_WBITS)
+        size = len(c.compress(sample) + c.flush())
+        if size > len(sample) * (1 - min_gain):
+            return (_deflate_block(data,0,None,final),len(data))
+    return (_deflate_block(data,level,zdict,final),0)
+
+
+class _ParallelGZipCompressor(object):
+    """Compression function producing gzip data using several threads.
+
+    Input is cut into blocks of 'blocksize' bytes, which are compressed
+    concurrently by a pool of 'threads' threads (zlib releases the GIL
+    while compressing) and joined into a single gzip stream.  The CRC of
+    the data is computed on the calling thread as it is passed in.  At
+    most two blocks per thread are in progress at any time, so memory use
+    is bounded no matter how much data is written.
+
+    Like the functions built by GZipMixin, instances are called with data
+    to compress and return the compressed data that is ready so far, while
+    flush() returns the remaining data and ends the stream.
+
+    If 'min_gain' is given, blocks that a quick trial shows can't be made
+    smaller by at least that fraction are stored rather than compressed,
+    as for already-compressed or encrypted data.  The number of bytes
+    stored this way is counted in the 'stored' attribute.  With 'threads'
+    of one, blocks are compressed on the calling thread.
+    """
+
+    def __init__(self,level=6,threads=2,blocksize=128*1024,min_gain=None):
+        self.level = level
+        self.threads = threads
+        self.blocksize = blocksize
+        self.min_gain = min_gain
+        self.stored = 0
+        self._pool = None
+        self.reset()
+
+    def reset(self):
+        self._buf = []
+        self._buflen = 0
+        self._crc = 0
+        self._size = 0
+        self._started = False
+        self._dict = ""
+        self._jobs = []
+
+    def __call__(self,data):
+        if data == "":
+            return ""
+        out = []
+        if not self._started:
+            self._started = True
+            #  Header with no filename, no mtime and Unix as the OS
+            out.append("\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03")
+        self._crc = zlib.crc32(data,self._crc)
+        self._size += len(data)
+        self._buf.append(data)
+        self._buflen += len(data)
+        if self._buflen >= self.blocksize:
+            data = "".join(self._buf)
+            for i in xrange(0,len(data) - self.blocksize + 1,self.blocksize):
+                self._submit(data[i:i+self.blocksize],False)
+                #  Wait for the oldest block if too many are in progress
+                while len(self._jobs) > self.threads * 2:
+                    out.append(self._take())
+            self._buf = [data[i+self.blocksize:]]
+            self._buflen = len(self._buf[0])
+        while self._jobs and (isinstance(self._jobs[0],tuple) or
+                              self._jobs[0].ready()):
+            out.append(self._take())
+        return "".join(out)
+
+    def _submit(self,block,final):
+        args = (block,self.level,self._dict,final,self.min_gain)
+        if self.threads > 1:
+            if self._pool is None:
+                from multiprocessing.pool import ThreadPool
+                self._pool = ThreadPool(self.threads)
+            job = self._pool.apply_async(_deflate_block_adaptive,args)
+        else:
+            job = _deflate_block_adaptive(*args)
+        self._jobs.append(job)
+        self._dict = block[-32*1024:]
+
+    def _take(self):
+        """Get the output of the oldest block in progress."""
+        job = self._jobs.pop(0)
+        if not isinstance(job,tuple):
+            job = job.get()
+        self.stored += job[1]
+        return job[0]
+
+    def flush(self):
+        out = []
+        if not self._started:
+            out.append("\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03")
+        self._submit("".join(self._buf),True)
+        while self._jobs:
+            out.append(self._take())
+        out.append(struct.pack("<II",self._crc & 0xffffffff,
+                                      self._size & 0xffffffff))
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        self.reset()
+        return "".join(out)
+
+
 class UnGZip(GZipMixin,Decompress):
     """Class for reading and writing to a zipped file.
         
@@ -217,12 +965,755 @@ class UnGZip(GZipMixin,Decompress):
     the standard library, except that it accepts an arbitrary file-like
     object.  All reads from the file are decompressed, all writes are
     compressed.
+
+    When opened for seekable reading only, an index of checkpoints is
+    built as the file is read, one every 'index_interval' bytes of
+    decompressed data.  Seeks then resume decompression from the nearest
+    checkpoint instead of from the start of the file.  Each checkpoint
+    holds a copy of the decompressor state (around 40K) so this trades
+    memory for seek speed; set 'index_interval' to zero to disable it.
+
+    Checkpoints that can be restored in a later process are also recorded
+    where possible, about one per 'index_interval': at the start of each
+    gzip member, and after each sync flush (as written by the threaded
+    compressor here, or by pigz).  Python's zlib module doesn't report
+    other deflate block boundaries, so a plain single-member file has none
+    beyond its start.  save_index() writes them, along with the size of
+    the data, to an index file; passing that as 'index_file' when opening
+    the file again makes seeks resume from them straight away.
+
+    For a file holding a single member small enough that the size field
+    of its trailer can be trusted, the 'size' attribute gives the size of
+    the uncompressed data without decompressing it.  This is looked up on
+    first use of 'size' or of a seek relative to the end, and costs a scan
+    of the whole compressed file (at most about 4M) for other member
+    headers.  If one is seen, which may happen by chance in the compressed
+    data, or the trailer is otherwise unusable, seeking relative to the end
+    instead decompresses the rest of the file once, adding checkpoints on
+    the way.  The trailer size is provisional: trailing garbage after the
+    member can't be told apart from it, so once the end of the data is
+    actually reached, 'size' is corrected, and an end-relative seek that
+    runs into the real end first is redone from there.
+
+    Files made of several concatenated gzip members are read as a single
+    stream, as with gunzip.  If 'threads' is greater than one, the members
+    of a read-only file are decompressed in parallel by a pool of that many
+    threads instead of building an index, and data written to the file is
+    compressed in blocks using such a pool.
+
+    If 'adaptive' is true, data written to the file is compressed in
+    blocks, and blocks that barely compress in a quick trial are stored
+    uncompressed, saving the time spent on already-compressed data.  The
+    output is still standard gzip.  The number of bytes stored is given
+    by the 'stored' attribute of the file's compress() function.
     """
     
-    def __init__(self,fileobj,mode=None,compresslevel=9):
+    def __init__(self,fileobj,mode=None,compresslevel=9,
+                      index_interval=16*1024*1024,threads=None,
+                      adaptive=False,index_file=None):
         self.compresslevel = compresslevel
+        self.index_interval = index_interval
+        self.threads = threads
+        self.adaptive = adaptive
+        self.index_file = index_file
         super(UnGZip,self).__init__(fileobj,mode=mode)
 
+    def __getattr__(self,name):
+        #  The size is only known by some readers, and may change as they
+        #  find it, so it's looked up on each access.
+        if name != "size":
+            raise AttributeError(name)
+        return self._fileobj.size
+
+    def _make_reader(self,fileobj,mode):
+        if self.threads > 1:
+            return _ParallelGZipReader(fileobj,mode,self.threads)
+        if "-" in mode or not self.index_interval:
+            return super(UnGZip,self)._make_reader(fileobj,mode)
+        return _IndexedGZipReader(fileobj,mode,self.index_interval,
+                                  self.index_file)
+
+    def save_index(self,fileobj):
+        """Write the checkpoints that can be restored later to 'fileobj'.
+
+        The rest of the file is read first, so that the index covers all
+        of it.  The file position is left unchanged.
+        """
+        if not isinstance(self._fileobj,_IndexedGZipReader):
+            raise IOError("Only seekable read-only files are indexed")
+        pos = self.tell()
+        self.seek(0,2)
+        self.seek(pos)
+        self._fileobj._save_index(fileobj)
+
+
+class _IndexedGZipReader(FileWrapper):
+    """Seekable reader for gzip data, using an index of checkpoints.
+
+    As data is decompressed, a copy of the decompressor's state is saved
+    every 'interval' bytes of output, along with the corresponding offset
+    in the compressed file.  Seeking then finds the nearest preceding
+    checkpoint and decompresses forward from there.
+
+    Copies of the decompressor can't be saved for use by a later process,
+    so about once per 'interval' this also looks for a place where a new
+    decompressor could take over: the start of a gzip member, or the end
+    of a sync flush, where a raw inflater primed with the preceding 32K
+    of output can resume.  Python's zlib module doesn't report where
+    deflate blocks end, so such places are found by their byte patterns,
+    and each is only used once a decompressor started there has been seen
+    to give the same output as the real one.  These checkpoints are
+    written by _save_index() and loaded from 'index_file'.
+    """
+
+    def __init__(self,fileobj,mode="r",interval=16*1024*1024,
+                      index_file=None):
+        super(_IndexedGZipReader,self).__init__(fileobj,mode=mode)
+        self.interval = interval
+        # Checkpoints are (uncompressed pos,compressed pos,decompressor,
+        # window).  Those without a decompressor restart at the compressed
+        # pos, at the start of a member if window is None or in the middle
+        # of one after the data in window otherwise.
+        self._checkpoints = [(0,0,None,None)]
+        self._index = [0]
+        #  Position of the last checkpoint without a decompressor
+        self._portable = 0
+        #  Candidate checkpoint being checked, and the kind of candidate
+        #  at the end of the input decompressed so far
+        self._trial = None
+        self._boundary = None
+        #  The most recent output, holding the last 32K of it
+        self._recent = []
+        self._recentlen = 0
+        #  Compressed data read but not yet decompressed
+        self._cbuf = ""
+        self._d = self._new_decompressor()
+        self._upos = 0
+        self._cpos = 0
+        self._ubuf = ""
+        self._eof = False
+        #  Whether the size in the gzip trailer has been looked for
+        self._trailer_checked = "-" in mode
+        if index_file is not None:
+            self._load_index(index_file)
+
+    def __getattr__(self,name):
+        #  Checking the trailer scans the whole file, so it's done only when
+        #  the size is wanted.  Reaching the end of the data replaces it.
+        if name != "size" or self.__dict__.get("_trailer_checked",True):
+            raise AttributeError(name)
+        self._trailer_checked = True
+        size = _gzip_trailer_size(self._fileobj)
+        if size is None:
+            raise AttributeError(name)
+        self.size = size
+        return size
+
+    def _new_decompressor(self,window=None):
+        return _GZipMemberDecompressor(window)
+
+    def _restore(self,checkpoint):
+        """Reset decompression to the state saved in the given checkpoint."""
+        (upos,cpos,d,window) = checkpoint
+        if d is None:
+            d = self._new_decompressor(window)
+        else:
+            d = d.copy()
+        self._fileobj.seek(cpos)
+        self._d = d
+        self._upos = upos
+        self._cpos = cpos
+        self._ubuf = ""
+        self._cbuf = ""
+        self._eof = False
+        self._trial = None
+        self._boundary = None
+        if window:
+            self._recent = [window]
+        else:
+            self._recent = []
+        self._recentlen = len(window or "")
+
+    def _add_checkpoint(self,checkpoint):
+        idx = bisect_right(self._index,checkpoint[0])
+        self._checkpoints.insert(idx,checkpoint)
+        self._index.insert(idx,checkpoint[0])
+
+    def _searching(self):
+        """Check whether to look for a new portable checkpoint."""
+        return self._trial is None and \
+               self._upos >= self._portable + self.interval
+
+    def _next_input(self):
+        """Get the next piece of compressed data to decompress.
+
+        The data is cut short at anything that looks like a place to resume,
+        so that the output can be matched up with it.  Since the data may
+        compress very well, this has to be done before it is known whether
+        a checkpoint will be wanted there.
+        """
+        if not self._cbuf:
+            self._cbuf = self._fileobj.read(self._bufsize)
+        data = self._cbuf
+        boundary = _find_gzip_resume_point(data)
+        if boundary is not None:
+            (end,self._boundary) = boundary
+            data = data[:end]
+        self._cbuf = self._cbuf[len(data):]
+        return data
+
+    def _remember(self,out):
+        """Keep the last 32K of output, as the window for checkpoints."""
+        if out:
+            self._recent.append(out)
+            self._recentlen += len(out)
+            while self._recentlen - len(self._recent[0]) >= 32*1024:
+                self._recentlen -= len(self._recent.pop(0))
+
+    def _check_trial(self,out,eof=False):
+        """Pass new output to the candidate checkpoint, and act on it."""
+        trial = self._trial
+        trial.expect(out)
+        result = trial.result(eof)
+        if result is not None:
+            self._trial = None
+            if result:
+                self._add_checkpoint((trial.upos,trial.cpos,None,
+                                      trial.window))
+                self._portable = trial.upos
+
+    def _decompress_chunk(self,max_length=0):
+        """Decompress the next chunk of input.
+
+        Returns the decompressed data, which may be empty, or None at EOF.
+        At most 'max_length' bytes are returned, defaulting to the buffer
+        size.  A checkpoint is added if we have moved far enough past the
+        last one.
+        """
+        if self._eof:
+            return None
+        if max_length <= 0:
+            max_length = self._bufsize
+        if self._d.has_tail():
+            out = self._d.decompress("",max_length)
+        else:
+            if self._boundary is not None and self._searching():
+                #  All input up to a possible resume point has been used
+                window = None
+                if self._boundary == "sync":
+                    window = "".join(self._recent)[-32*1024:]
+                self._trial = _GZipResumeTrial(self._upos,self._cpos,window)
+            self._boundary = None
+            data = self._next_input()
+            if data == "":
+                self._eof = True
+                out = self._d.flush()
+                self._upos += len(out)
+                self.size = self._upos
+                if self._trial is not None:
+                    self._check_trial(out,True)
+                return out or None
+            out = self._d.decompress(data,max_length)
+            self._cpos += len(data)
+            if self._trial is not None:
+                self._trial.feed(data)
+        self._upos += len(out)
+        self._remember(out)
+        if self._trial is not None:
+            self._check_trial(out)
+        if self._upos >= self._index[-1] + self.interval:
+            self._add_checkpoint((self._upos,self._cpos,self._d.copy(),None))
+        return out
+
+    def _read(self,sizehint=-1):
+        if self._ubuf:
+            data = self._ubuf
+            self._ubuf = ""
+            return data
+        out = self._decompress_chunk(sizehint)
+        while out == "":
+            out = self._decompress_chunk(sizehint)
+        return out
+
+    def _seek(self,offset,whence):
+        if whence == 2:
+            return self._seek_end(offset)
+        if whence != 0:
+            raise NotImplementedError
+        cur = self._tell()
+        checkpoint = self._checkpoints[bisect_right(self._index,offset)-1]
+        if not checkpoint[0] <= cur <= offset:
+            self._restore(checkpoint)
+            cur = checkpoint[0]
+        #  Decompress forward to the requested position
+        skip = offset - cur
+        if skip <= len(self._ubuf):
+            self._ubuf = self._ubuf[skip:]
+            return
+        skip -= len(self._ubuf)
+        self._ubuf = ""
+        while skip > 0:
+            out = self._decompress_chunk()
+            if out is None:
+                break
+            if len(out) > skip:
+                self._ubuf = out[skip:]
+            skip -= len(out)
+
+    def _seek_end(self,offset):
+        """Seek relative to the end of the data.
+
+        The size from the trailer may be wrong if the file has trailing
+        garbage.  If the end of the data is reached before the position
+        given by that size, the seek is redone from the real end.
+        """
+        if not hasattr(self,"size"):
+            raise NotImplementedError
+        size = self.size
+        self._seek(size + offset,0)
+        if self.size != size:
+            self._seek(self.size + offset,0)
+
+    def _tell(self):
+        return self._upos - len(self._ubuf)
+
+    def _compressed_size(self):
+        try:
+            pos = self._fileobj.tell()
+            self._fileobj.seek(0,2)
+            try:
+                return self._fileobj.tell()
+            finally:
+                self._fileobj.seek(pos)
+        except (AttributeError,IOError):
+            return None
+
+    def _save_index(self,fileobj):
+        checkpoints = [(upos,cpos,window)
+                       for (upos,cpos,d,window) in self._checkpoints
+                       if d is None]
+        _write_gzip_index(fileobj,checkpoints,self._compressed_size(),
+                          getattr(self,"size",None))
+
+    def _load_index(self,fileobj):
+        (checkpoints,csize,usize) = _read_gzip_index(fileobj)
+        if csize is not None and csize != self._compressed_size():
+            raise IOError("Index doesn't match the gzip file")
+        for (upos,cpos,window) in checkpoints:
+            if upos > 0:
+                self._add_checkpoint((upos,cpos,None,window))
+                self._portable = max(self._portable,upos)
+        if usize is not None:
+            self.size = usize
+
+
+class _GZipResumeTrial(object):
+    """Check of a candidate checkpoint for resuming gzip decompression.
+
+    A fresh decompressor is started at the candidate, given the same input
+    as the real one, and its output compared with the real output.  The
+    candidate is accepted once 'size' bytes of output match, or all the
+    output matches at the end of the file.
+    """
+
+    def __init__(self,upos,cpos,window,size=4096):
+        self.upos = upos
+        self.cpos = cpos
+        self.window = window
+        self.size = size
+        self._d = _GZipMemberDecompressor(window)
+        self._expected = ""
+        self._actual = ""
+        self._failed = False
+
+    def feed(self,data):
+        """Decompress more of the input following the candidate."""
+        if self._failed or len(self._actual) >= self.size:
+            return
+        try:
+            self._actual += self._d.decompress(data,
+                                               self.size - len(self._actual))
+        except zlib.error:
+            self._failed = True
+
+    def expect(self,out):
+        """Add to the real output following the candidate."""
+        self._expected += out[:self.size - len(self._expected)]
+
+    def result(self,eof=False):
+        """Get whether the candidate is good, or None if not yet known."""
+        if self._failed:
+            return False
+        if len(self._expected) < self.size and not eof:
+            return None
+        try:
+            while len(self._actual) < len(self._expected) and \
+                  self._d.has_tail():
+                self._actual += self._d.decompress("",self.size)
+            if len(self._actual) < len(self._expected):
+                self._actual += self._d.flush()
+        except zlib.error:
+            return False
+        return self._actual[:len(self._expected)] == self._expected
+
+
+def _find_gzip_resume_point(data):
+    """Find the first place in gzip data where decompression might resume.
+
+    Returns a tuple (offset,kind), where 'kind' is "member" for what looks
+    like the header of a gzip member at 'offset', or "sync" for what looks
+    like the empty stored block written by a sync flush ending just before
+    'offset'.  Returns None if there's neither, other than at the start.
+    """
+    found = None
+    idx = data.find("\x1f\x8b\x08",1)
+    if idx > 0:
+        found = (idx,"member")
+    idx = data.find("\x00\x00\xff\xff")
+    if idx >= 0 and (found is None or idx + 4 < found[0]):
+        found = (idx + 4,"sync")
+    return found
+
+
+_GZIP_INDEX_MAGIC = "FLGZIDX1"
+
+def _write_gzip_index(fileobj,checkpoints,csize=None,usize=None):
+    """Write an index of (uncompressed,compressed,window) checkpoints.
+
+    The index starts with a magic string and the compressed and
+    uncompressed sizes of the file, with 2**64-1 for those not known, then
+    the count of checkpoints.  Each checkpoint gives the two offsets and
+    its window, compressed with zlib, or an empty string for the start
+    of a member.  All integers are unsigned little-endian.
+    """
+    unknown = 2**64 - 1
+    if csize is None:
+        csize = unknown
+    if usize is None:
+        usize = unknown
+    fileobj.write(_GZIP_INDEX_MAGIC)
+    fileobj.write(struct.pack("<QQQ",csize,usize,len(checkpoints)))
+    for (upos,cpos,window) in checkpoints:
+        if window is None:
+            (kind,window) = (0,"")
+        else:
+            (kind,window) = (1,zlib.compress(window))
+        fileobj.write(struct.pack("<QQBI",upos,cpos,kind,len(window)))
+        fileobj.write(window)
+
+
+def _read_gzip_index(fileobj):
+    """Read an index written by _write_gzip_index().
+
+    Returns a tuple (checkpoints,csize,usize) with None for unknown sizes.
+    """
+    def read(size):
+        data = fileobj.read(size)
+        if len(data) != size:
+            raise IOError("Invalid gzip index")
+        return data
+    if read(len(_GZIP_INDEX_MAGIC)) != _GZIP_INDEX_MAGIC:
+        raise IOError("Invalid gzip index")
+    (csize,usize,count) = struct.unpack("<QQQ",read(24))
+    checkpoints = []
+    for _ in xrange(count):
+        (upos,cpos,kind,size) = struct.unpack("<QQBI",read(21))
+        window = read(size)
+        if kind == 0:
+            window = None
+        else:
+            try:
+                window = zlib.decompress(window)
+            except zlib.error:
+                raise IOError("Invalid gzip index")
+        checkpoints.append((upos,cpos,window))
+    unknown = 2**64 - 1
+    if csize == unknown:
+        csize = None
+    if usize == unknown:
+        usize = None
+    return (checkpoints,csize,usize)
+
+
+#  Deflate can't expand data by more than a factor of 1032
+_DEFLATE_MAX_RATIO = 1032
+
+def _gzip_trailer_size(fileobj):
+    """Find the size of the data in a gzip file from its trailer.
+
+    The ISIZE field at the end of a gzip member gives the size of its data
+    modulo 2**32.  It is only trusted if the file is too small to inflate
+    to 4G or more, and holds a single member, checked by scanning it for
+    other member headers.  Returns None if the size can't be found this
+    way, including when a member header appears by chance in the deflate
+    data.  Trailing garbage after the member can't be detected, so the
+    result may still be wrong.  The file position is left unchanged.
+    """
+    try:
+        pos = fileobj.tell()
+        fileobj.seek(0,2)
+        csize = fileobj.tell()
+    except (AttributeError,IOError):
+        return None
+    try:
+        if csize < 18:
+            return None
+        fileobj.seek(csize - 8)
+        trailer = fileobj.read(8)
+        if len(trailer) != 8:
+            return None
+        #  A file padded with zeros shows a zero trailer
+        if trailer == "\x00" * 8 and csize > 20:
+            return None
+        isize = struct.unpack("<I",trailer[4:])[0]
+        if isize + 2**32 <= csize * _DEFLATE_MAX_RATIO:
+            return None
+        fileobj.seek(0)
+        data = fileobj.read(64*1024)
+        if not data.startswith("\x1f\x8b\x08"):
+            return None
+        data = data[1:]
+        while data:
+            if "\x1f\x8b\x08" in data:
+                return None
+            more = fileobj.read(64*1024)
+            if more == "":
+                break
+            data = data[-2:] + more
+        return isize
+    finally:
+        fileobj.seek(pos)
+
+
+def _inflate_gzip_member(data,max_length):
+    """Decompress a segment of gzip data expected to hold a whole member.
+
+    Returns a tuple (output,complete).  If the member doesn't end within
+    the segment, the segment doesn't start with a valid member, or it
+    would produce more than 'max_length' bytes, then 'complete' is False
+    and the output should be discarded.
+    """
+    d = zlib.decompressobj(16+zlib.MAX_WBITS)
+    try:
+        #  The extra byte ends up in unused_data iff the member ended
+        out = d.decompress(data + "\x00",max_length)
+    except zlib.error:
+        return (None,False)
+    return (out,d.unused_data != "")
+
+
+class _ParallelGZipReader(FileWrapper):
+    """Reader for multi-member gzip data, decoding members in parallel.
+
+    The compressed data is scanned for gzip member headers, and the data
+    between consecutive headers is handed to a pool of 'threads' threads
+    for decompression (zlib releases the GIL while it works).  Output is
+    returned in order, with at most two segments per thread read ahead.
+
+    A header found by the scan may just be a chance match inside a member,
+    or a member may be too big to decode in one piece.  Such segments are
+    instead decompressed in-line on the calling thread, streaming in data
+    until the member ends, so memory use stays bounded by 'max_segment'
+    bytes per queued segment.  A plain single-member file thus decodes
+    much as it would without the pool.  Segments that inflate to more than
+    four times 'max_segment' are likewise decoded in-line, one buffer of
+    output at a time.
+    """
+
+    _MAGIC = "\x1f\x8b\x08"
+
+    def __init__(self,fileobj,mode="r",threads=2,max_segment=4*1024*1024):
+        super(_ParallelGZipReader,self).__init__(fileobj,mode=mode)
+        self.threads = threads
+        self.max_segment = max_segment
+        self._pool = None
+        self._reset()
+
+    def _reset(self):
+        #  Compressed data read but not yet handed out, the offsets within
+        #  it of possible member headers, and how much has been searched.
+        self._cbuf = ""
+        self._cands = []
+        self._scanned = 0
+        self._ceof = False
+        #  A piece of data taken from the scanner but not yet used.
+        self._piece = None
+        #  Queued segments as [data,result], result None if not submitted.
+        self._pending = []
+        #  Decompressor for a member being decoded in-line, and any input
+        #  it has not yet used as (data,queued segment it came from).
+        self._stream = None
+        self._stail = None
+        self._upos = 0
+        self._done = False
+
+    def _next_piece(self):
+        """Get the next piece of compressed data from the scanner.
+
+        Pieces are split at every possible member header, and are no larger
+        than one buffer.  Returns a tuple (data,is_start) with 'is_start'
+        true if the piece begins with a member header, or None at EOF.
+        """
+        if self._piece is not None:
+            piece = self._piece
+            self._piece = None
+            return piece
+        while True:
+            is_start = bool(self._cands) and self._cands[0] == 0
+            if is_start and len(self._cands) > 1:
+                end = self._cands[1]
+            elif not is_start and self._cands:
+                end = self._cands[0]
+            elif self._ceof:
+                end = len(self._cbuf)
+            elif len(self._cbuf) - 2 >= self._bufsize:
+                #  The last bytes could be the start of a header
+                end = len(self._cbuf) - 2
+            else:
+                data = self._fileobj.read(self._bufsize)
+                if data == "":
+                    self._ceof = True
+                else:
+                    self._cbuf += data
+                    self._scan()
+                continue
+            if end == 0:
+                return None
+            data = self._cbuf[:end]
+            self._cbuf = self._cbuf[end:]
+            self._cands = [c - end for c in self._cands if c >= end]
+            self._scanned = max(0,self._scanned - end)
+            return (data,is_start)
+
+    def _fill(self):
+        """Queue segments for decompression, up to two per thread."""
+        while len(self._pending) < self.threads * 2:
+            if self._pending and self._pending[-1][1] is None:
+                #  A member too big for the pool; nothing to do until
+                #  it has been decoded in-line.
+                break
+            piece = self._next_piece()
+            if piece is None:
+                break
+            chunks = [piece[0]]
+            size = len(piece[0])
+            piece = self._next_piece()
+            while piece is not None and not piece[1]:
+                chunks.append(piece[0])
+                size += len(piece[0])
+                if size > self.max_segment:
+                    break
+                piece = self._next_piece()
+            data = "".join(chunks)
+            if piece is not None and not piece[1]:
+                self._pending.append([data,None])
+                continue
+            self._piece = piece
+            if self._pool is None:
+                from multiprocessing.pool import ThreadPool
+                self._pool = ThreadPool(self.threads)
+            args = (data,self.max_segment * 4)
+            job = self._pool.apply_async(_inflate_gzip_member,args)
+            self._pending.append([data,job])
+
+    def _next_data(self):
+        """Decompress the next segment or piece of data.
+
+        Returns the decompressed data, which may be empty, or None at EOF.
+        """
+        if self._done:
+            return None
+        if self._stream is None:
+            self._fill()
+            if not self._pending:
+                self._done = True
+                return None
+            (data,job) = self._pending.pop(0)
+            if not data.startswith(self._MAGIC[:2]):
+                #  Trailing garbage after the last member
+                self._done = True
+                return None
+            if job is not None:
+                (out,complete) = job.get()
+                if complete:
+                    return out
+            self._stream = zlib.decompressobj(16+zlib.MAX_WBITS)
+            return self._feed(data,[data,job])
+        #  Continue the in-line member, first with data already queued
+        if self._stail is not None:
+            (data,entry) = self._stail
+            self._stail = None
+            return self._feed(data,entry)
+        if self._pending:
+            entry = self._pending.pop(0)
+            return self._feed(entry[0],entry)
+        piece = self._next_piece()
+        if piece is None:
+            out = self._stream.flush()
+            self._stream = None
+            return out
+        return self._feed(piece[0],None)
+
+    def _feed(self,data,entry):
+        """Feed data to the in-line decompressor."""
+        try:
+            out = self._stream.decompress(data,self._bufsize)
+        except zlib.error, e:
+            raise IOError(str(e))
+        rest = self._stream.unused_data
+        if not rest and self._stream.unconsumed_tail:
+            self._stail = (self._stream.unconsumed_tail,entry)
+        elif rest:
+            #  The member has ended; put back the data following it.  Any
+            #  following member starts at a segment boundary, so data left
+            #  within a queued segment is trailing garbage.
+            self._stream = None
+            if entry is None:
+                self._unread(rest)
+            elif len(rest) == len(entry[0]):
+                self._pending.insert(0,entry)
+            else:
+                self._done = True
+        return out
+
+    def _unread(self,data):
+        """Push data back onto the front of the scanner's buffer."""
+        self._cbuf = data + self._cbuf
+        self._cands = []
+        self._scanned = 0
+        self._scan()
+
+    def _scan(self):
+        """Search newly-read data for possible member headers."""
+        i = self._cbuf.find(self._MAGIC,self._scanned)
+        while i >= 0:
+            self._cands.append(i)
+            i = self._cbuf.find(self._MAGIC,i+1)
+        self._scanned = max(0,len(self._cbuf) - 2)
+
+    def _read(self,sizehint=-1):
+        data = self._next_data()
+        while data == "":
+            data = self._next_data()
+        if data is not None:
+            self._upos += len(data)
+        return data
+
+    def _seek(self,offset,whence):
+        if whence != 0 or offset != 0:
+            raise NotImplementedError
+        self._fileobj.seek(0)
+        self._reset()
+
+    def _tell(self):
+        return self._upos
+
+    def close(self):
+        super(_ParallelGZipReader,self).close()
+        if getattr(self,"_pool",None) is not None:
+            self._pool.terminate()
+            self._pool = None
+
 
 class GZip(GZipMixin,Compress):
     """Class for reading and writing a zipped file.
@@ -230,22 +1721,766 @@ class GZip(GZipMixin,Compress):
     This class is the dual of UnGZip - it compresses read data, and
     decompresses written data.  Thus GZip(f) is the compressed version
     of f.
+
+    If 'threads' is greater than one, data read from the file is
+    compressed in blocks using a pool of that many threads.  If 'adaptive'
+    is true, incompressible blocks are stored as for UnGZip.
     """
     
-    def __init__(self,fileobj,mode=None,compresslevel=9):
+    def __init__(self,fileobj,mode=None,compresslevel=9,threads=None,
+                      adaptive=False):
         self.compresslevel = compresslevel
+        self.threads = threads
+        self.adaptive = adaptive
         super(GZip,self).__init__(fileobj,mode=mode)
 
 
-##  Add handling of .gz files to filelike.open()
-def _GZip_decoder(fileobj):
-    """Decoder function for handling .gz files with filelike.open"""
-    if not fileobj.name.endswith(".gz"):
-        return None
-    f = UnGZip(fileobj)
-    f.name = fileobj.name[:-3]
-    return f
-filelike.open.decoders.append(_GZip_decoder)
+class _DeflateCompressor(object):
+    """Compression function producing raw deflate or zlib format data.
+
+    If 'zdict' is given it is used as a preset dictionary.  In zlib format
+    its checksum is recorded in the header as described in RFC 1950, so
+    the data can be read by any zlib implementation given the dictionary.
+    Like _ParallelGZipCompressor, instances are called with data to
+    compress and flush() ends the stream.
+    """
+
+    def __init__(self,level=6,zdict=None,raw=True):
+        self.level = level
+        self.zdict = zdict
+        self.raw = raw
+        #  Priming is relatively costly, so each stream copies a template
+        self._template = _deflate_compressobj(level,zdict)
+        self.reset()
+
+    def reset(self):
+        self._c = self._template.copy()
+        self._adler = 1
+        self._started = False
+
+    def _header(self):
+        if self._started or self.raw:
+            return ""
+        self._started = True
+        cmf = 0x78
+        #  The compression level is recorded in the top two bits
+        if 0 <= self.level < 2:
+            flg = 0x00
+        elif 2 <= self.level < 6:
+            flg = 0x40
+        elif self.level > 6:
+            flg = 0xc0
+        else:
+            flg = 0x80
+        if self.zdict:
+            flg |= 0x20
+        flg += (31 - (cmf * 256 + flg) % 31) % 31
+        header = chr(cmf) + chr(flg)
+        if self.zdict:
+            header += struct.pack(">I",zlib.adler32(self.zdict) & 0xffffffff)
+        return header
+
+    def __call__(self,data):
+        if data == "":
+            return ""
+        if not self.raw:
+            self._adler = zlib.adler32(data,self._adler)
+        return self._header() + self._c.compress(data)
+
+    def flush(self):
+        out = self._header() + self._c.flush()
+        if not self.raw:
+            out += struct.pack(">I",self._adler & 0xffffffff)
+        self.reset()
+        return out
+
+
+class _DeflateDecompressor(object):
+    """Decompression function for raw deflate or zlib format data.
+
+    If 'zdict' is given it is used as the preset dictionary; in zlib format
+    it is used only if the header asks for one, and must match the
+    checksum given there.  Several streams written one after the other,
+    e.g. by appending to a file, are decompressed in turn.  Output can be
+    limited using 'max_length' as for the gzip decompressor.
+    """
+
+    def __init__(self,zdict=None,raw=True):
+        self.zdict = zdict
+        self.raw = raw
+        self._template = None
+        self.reset()
+
+    def reset(self):
+        self._d = None
+        #  Header or trailer bytes collected so far, if in one
+        self._hbuf = ""
+        self._trailer = None
+        self._adler = 1
+        self._tail = ""
+
+    def has_tail(self):
+        return bool(self._tail)
+
+    def _inflater(self,primed):
+        if not primed or not self.zdict:
+            return zlib.decompressobj(-zlib.MAX_WBITS)
+        if self._template is None:
+            self._template = _inflate_decompressobj(self.zdict)
+        return self._template.copy()
+
+    def _start_stream(self,data):
+        """Process the header of a new stream, returning the rest of data."""
+        if self.raw:
+            self._d = self._inflater(True)
+            return data
+        data = self._hbuf + data
+        self._hbuf = ""
+        if len(data) < 2:
+            self._hbuf = data
+            return ""
+        (cmf,flg) = (ord(data[0]),ord(data[1]))
+        if cmf & 0x0f != 8 or (cmf * 256 + flg) % 31:
+            raise IOError("invalid zlib header")
+        if not flg & 0x20:
+            self._d = self._inflater(False)
+            self._adler = 1
+            return data[2:]
+        if len(data) < 6:
+            self._hbuf = data
+            return ""
+        if not self.zdict:
+            raise IOError("data requires a preset dictionary")
+        dictid = struct.unpack(">I",data[2:6])[0]
+        if dictid != zlib.adler32(self.zdict) & 0xffffffff:
+            raise IOError("preset dictionary doesn't match the data")
+        self._d = self._inflater(True)
+        self._adler = 1
+        return data[6:]
+
+    def __call__(self,data,max_length=0):
+        if self._tail:
+            data = self._tail + data
+            self._tail = ""
+        out = []
+        size = 0
+        while data:
+            if max_length and size >= max_length:
+                self._tail = data
+                break
+            if self._d is None:
+                data = self._start_stream(data)
+                continue
+            if self._trailer is not None:
+                self._trailer += data
+                if len(self._trailer) < 4:
+                    break
+                check = struct.unpack(">I",self._trailer[:4])[0]
+                if check != self._adler & 0xffffffff:
+                    raise IOError("incorrect data check")
+                data = self._trailer[4:]
+                self._trailer = None
+                self._d = None
+                continue
+            if max_length:
+                chunk = self._d.decompress(data,max_length - size)
+            else:
+                chunk = self._d.decompress(data)
+            if not self.raw:
+                self._adler = zlib.adler32(chunk,self._adler)
+            out.append(chunk)
+            size += len(chunk)
+            #  See _GZipMemberDecompressor about checking unused_data first
+            data = self._d.unused_data
+            if data:
+                if self.raw:
+                    self._d = None
+                else:
+                    self._trailer = ""
+            elif max_length:
+                data = self._d.unconsumed_tail
+        return "".join(out)
+
+    def flush(self):
+        if self._d is None or self._trailer is not None:
+            return ""
+        return self._d.flush()
+
+
+def train_zdict(samples,size=32*1024):
+    """Build a preset dictionary for compressing data like the given samples.
+
+    Substrings that occur in several of the samples are collected, those
+    saving the most bytes first, until the dictionary reaches 'size' bytes.
+    The most valuable are placed at the end of the dictionary, where
+    deflate can refer to them most cheaply.  A few hundred samples of the
+    records to be compressed are usually plenty.
+    """
+    counts = {}
+    for sample in samples:
+        seen = set()
+        for length in (32,16,8):
+            for i in xrange(len(sample) - length + 1):
+                seen.add(sample[i:i+length])
+        for substr in seen:
+            counts[substr] = counts.get(substr,0) + 1
+    scored = [((n - 1) * len(substr),substr)
+              for (substr,n) in counts.iteritems() if n > 1]
+    scored.sort(reverse=True)
+    chosen = []
+    zdict = ""
+    total = 0
+    for (score,substr) in scored:
+        if total >= size:
+            break
+        if substr in zdict:
+            continue
+        chosen.append(substr)
+        total += len(substr)
+        zdict = "".join(reversed(chosen))
+    return zdict[-size:]
+
+
+class DeflateMixin(object):
+    """Mixin for Compress/Decompress subclasses using raw deflate."""
+
+    _raw = True
+
+    def __init__(self,*args,**kwds):
+        if not hasattr(self,"compresslevel"):
+            self.compresslevel = 6
+        zdict = getattr(self,"zdict",None)
+        self.compress = _DeflateCompressor(self.compresslevel,zdict,self._raw)
+        self.decompress = _DeflateDecompressor(zdict,self._raw)
+        # These can now be used by superclass constructors
+        super(DeflateMixin,self).__init__(*args,**kwds)
+
+
+class UnDeflate(DeflateMixin,Decompress):
+    """Class for reading and writing a file of raw deflate data.
+
+    This is like UnGZip but without any header or checksum, as used inside
+    many other formats.  If 'zdict' is given it is used as a preset
+    dictionary, which can greatly improve compression of small files
+    that share a lot of content with it; see train_zdict().  The same
+    dictionary must be given to read the data back.
+    """
+
+    def __init__(self,fileobj,mode=None,compresslevel=9,zdict=None):
+        self.compresslevel = compresslevel
+        self.zdict = zdict
+        super(UnDeflate,self).__init__(fileobj,mode=mode)
+
+
+class Deflate(DeflateMixin,Compress):
+    """Class for reading and writing a raw deflate compressed file.
+
+    This class is the dual of UnDeflate - it compresses read data, and
+    decompresses written data.
+    """
+
+    def __init__(self,fileobj,mode=None,compresslevel=9,zdict=None):
+        self.compresslevel = compresslevel
+        self.zdict = zdict
+        super(Deflate,self).__init__(fileobj,mode=mode)
+
+
+class ZlibMixin(DeflateMixin):
+    """Mixin for Compress/Decompress subclasses using zlib format."""
+
+    _raw = False
+
+
+class UnZlib(ZlibMixin,Decompress):
+    """Class for reading and writing a file of zlib format data.
+
+    If 'zdict' is given it is used as a preset dictionary, as for
+    UnDeflate.  Its checksum is stored in the zlib header so that other
+    zlib implementations can also read the data given the dictionary.
+    """
+
+    def __init__(self,fileobj,mode=None,compresslevel=9,zdict=None):
+        self.compresslevel = compresslevel
+        self.zdict = zdict
+        super(UnZlib,self).__init__(fileobj,mode=mode)
+
+
+class Zlib(ZlibMixin,Compress):
+    """Class for reading and writing a zlib compressed file.
+
+    This class is the dual of UnZlib - it compresses read data, and
+    decompresses written data.
+    """
+
+    def __init__(self,fileobj,mode=None,compresslevel=9,zdict=None):
+        self.compresslevel = compresslevel
+        self.zdict = zdict
+        super(Zlib,self).__init__(fileobj,mode=mode)
+
+
+#  BGZF blocks are gzip members with the size of the whole block stored in
+#  a "BC" extra subfield, holding at most 64K of data each.  A file ends
+#  with an empty block, which plain gzip readers see as an empty member.
+_BGZF_HEADER = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+_BGZF_EOF = _BGZF_HEADER + "\x1b\x00\x03\x00" + "\x00" * 8
+_BGZF_BLOCK_SIZE = 0xff00
+
+def _bgzf_block(data,level):
+    """Compress data into a single BGZF block."""
+    c = zlib.compressobj(level,zlib.DEFLATED,-zlib.MAX_WBITS)
+    cdata = c.compress(data) + c.flush()
+    #  Header, BSIZE subfield and trailer take 26 bytes; BSIZE is one less
+    #  than the total size of the block.
+    return "".join((_BGZF_HEADER,struct.pack("<H",len(cdata) + 25),cdata,
+                    struct.pack("<II",zlib.crc32(data) & 0xffffffff,
+                                      len(data))))
+
+
+def _bgzf_block_size(header):
+    """Get the total size of a BGZF block from its header.
+
+    The header must include the extra field, i.e. the first 12 + XLEN
+    bytes of the block.  IOError is raised if it isn't a BGZF header.
+    """
+    if header[:3] != "\x1f\x8b\x08" or not ord(header[3]) & 0x04:
+        raise IOError("Not a BGZF block")
+    xlen = struct.unpack("<H",header[10:12])[0]
+    extra = header[12:12+xlen]
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack("<H",extra[i+2:i+4])[0]
+        if extra[i:i+2] == "BC" and slen == 2:
+            return struct.unpack("<H",extra[i+4:i+6])[0] + 1
+        i += 4 + slen
+    raise IOError("Not a BGZF block")
+
+
+def _inflate_bgzf_block(block):
+    """Decompress a single BGZF block, checking its CRC and size."""
+    xlen = struct.unpack("<H",block[10:12])[0]
+    try:
+        data = zlib.decompress(block[12+xlen:-8],-zlib.MAX_WBITS)
+    except zlib.error, e:
+        raise IOError(str(e))
+    (crc,size) = struct.unpack("<II",block[-8:])
+    if size != len(data) or crc != zlib.crc32(data) & 0xffffffff:
+        raise IOError("BGZF block failed integrity check")
+    return data
+
+
+def _read_gzi(fileobj):
+    """Read a .gzi index, as a list of (compressed,uncompressed) offsets.
+
+    The index lists the start of each block except the first, as written
+    by "bgzip -i": a count followed by pairs of offsets, all unsigned
+    64-bit little-endian integers.
+    """
+    data = fileobj.read(8)
+    if len(data) != 8:
+        raise IOError("Invalid BGZF index")
+    count = struct.unpack("<Q",data)[0]
+    data = fileobj.read(16 * count)
+    if len(data) != 16 * count:
+        raise IOError("Invalid BGZF index")
+    offsets = struct.unpack("<%dQ" % (2 * count,),data)
+    return zip(offsets[0::2],offsets[1::2])
+
+
+def _write_gzi(fileobj,entries):
+    """Write a .gzi index from a list of (compressed,uncompressed) offsets."""
+    fileobj.write(struct.pack("<Q",len(entries)))
+    for (coffset,uoffset) in entries:
+        fileobj.write(struct.pack("<QQ",coffset,uoffset))
+
+
+class _BGZFCompressor(object):
+    """Compression function producing BGZF data.
+
+    Input is cut into blocks of at most 0xff00 bytes, each compressed into
+    a separate gzip member.  The blocks are independent, so if 'threads' is
+    greater than one they are compressed by a pool of that many threads,
+    with at most two blocks per thread in progress.  flush() writes out
+    any partial block, then the empty block marking the end of the file
+    unless 'eof' is false.
+
+    The (compressed,uncompressed) offsets at which each block starts are
+    recorded in the 'blocks' attribute.  Compressed offsets count from
+    'offset', the position of the output in the file.
+    """
+
+    def __init__(self,level=6,threads=None,offset=0):
+        self.level = level
+        self.threads = threads
+        self.offset = offset
+        self._pool = None
+        self.reset()
+
+    def reset(self):
+        self._buf = []
+        self._buflen = 0
+        #  Blocks being compressed, as (size of input,job)
+        self._jobs = []
+        self.csize = self.offset
+        self.usize = 0
+        self.blocks = []
+
+    def __call__(self,data):
+        if data:
+            self._buf.append(data)
+            self._buflen += len(data)
+        if self._buflen >= _BGZF_BLOCK_SIZE:
+            data = "".join(self._buf)
+            end = len(data) - len(data) % _BGZF_BLOCK_SIZE
+            for i in xrange(0,end,_BGZF_BLOCK_SIZE):
+                self._submit(data[i:i+_BGZF_BLOCK_SIZE])
+            self._buf = [data[end:]]
+            self._buflen = len(self._buf[0])
+        return self.collect(False)
+
+    def buffered(self):
+        """Get the amount of data waiting to fill the current block."""
+        return self._buflen
+
+    def _submit(self,data):
+        if self.threads > 1:
+            if self._pool is None:
+                from multiprocessing.pool import ThreadPool
+                self._pool = ThreadPool(self.threads)
+            job = self._pool.apply_async(_bgzf_block,(data,self.level))
+        else:
+            job = _bgzf_block(data,self.level)
+        self._jobs.append((len(data),job))
+
+    def collect(self,wait=True):
+        """Get the blocks that have been compressed so far.
+
+        If 'wait' is true this waits for all blocks in progress, otherwise
+        only for the oldest while too many are in progress.
+        """
+        out = []
+        while self._jobs:
+            (size,job) = self._jobs[0]
+            if not isinstance(job,str):
+                if not (wait or job.ready() or
+                        len(self._jobs) > self.threads * 2):
+                    break
+                job = job.get()
+            del self._jobs[0]
+            self.blocks.append((self.csize,self.usize))
+            self.csize += len(job)
+            self.usize += size
+            out.append(job)
+        return "".join(out)
+
+    def flush(self,eof=True):
+        if self._buflen:
+            self._submit("".join(self._buf))
+            self._buf = []
+            self._buflen = 0
+        out = self.collect()
+        if eof:
+            self.blocks.append((self.csize,self.usize))
+            self.csize += len(_BGZF_EOF)
+            out += _BGZF_EOF
+            self.close()
+        return out
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+
+class BGZFMixin(object):
+    """Mixin for Compress/Decompress subclasses using BGZF."""
+
+    def __init__(self,*args,**kwds):
+        if not hasattr(self,"compresslevel"):
+            self.compresslevel = 6
+        threads = getattr(self,"threads",None)
+        self.compress = _BGZFCompressor(self.compresslevel,threads)
+        self.decompress = _gzip_decompress_function()
+        # These can now be used by superclass constructors
+        super(BGZFMixin,self).__init__(*args,**kwds)
+
+
+class UnBGZF(BGZFMixin,Decompress):
+    """Class for reading and writing to a BGZF file.
+
+    BGZF ("blocked gzip") files, as used by samtools and tabix, are gzip
+    files made of independent members of at most 64K of data, each giving
+    its own size in a header field.  Any gzip reader, UnGZip included, can
+    read them as a whole, while this class can also seek straight to the
+    block holding a given offset and decompress only that.
+
+    Positions in BGZF files are often given as "virtual offsets", the
+    offset of the start of a block in the compressed file shifted left by
+    16 bits plus the offset within that block's data.  Use tell_virtual()
+    and seek_virtual() to work with them in read-only and write-only
+    modes.
+
+    Files opened for writing only are written as a stream (mode "w-"),
+    each block going to the file as soon as it is full.  If 'index_file'
+    is given, a .gzi index of the block offsets is written to it when the
+    file is closed.  When reading, an index given in 'index_file' saves
+    scanning the block headers to find where to seek to.
+
+    If 'threads' is greater than one, blocks are compressed and read-ahead
+    blocks decompressed by a pool of that many threads.
+    """
+
+    def __init__(self,fileobj,mode=None,compresslevel=6,threads=None,
+                      index_file=None):
+        self.compresslevel = compresslevel
+        self.threads = threads
+        self.index_file = index_file
+        if mode is None:
+            try:
+                mode = fileobj.mode
+            except AttributeError:
+                mode = "r+"
+        if "w" in mode and "+" not in mode and "-" not in mode:
+            mode += "-"
+        super(UnBGZF,self).__init__(fileobj,mode=mode)
+
+    def _make_reader(self,fileobj,mode):
+        return _BGZFReader(fileobj,mode,self.threads,self.index_file)
+
+    def _make_writer(self,fileobj,mode):
+        return _BGZFWriter(fileobj,mode,self.compresslevel,self.threads,
+                           self.index_file)
+
+    def tell_virtual(self):
+        """Get the current position in the file as a virtual offset."""
+        if not isinstance(self._fileobj,(_BGZFReader,_BGZFWriter)):
+            raise IOError("Virtual offsets need read-only or write-only mode")
+        return self._fileobj._virtual_offset(self.tell())
+
+    def seek_virtual(self,voffset):
+        """Seek to the position given by a virtual offset."""
+        if not isinstance(self._fileobj,_BGZFReader):
+            raise IOError("Virtual offsets can only be sought when reading")
+        self.seek(self._fileobj._real_offset(voffset))
+
+
+class _BGZFWriter(FileWrapper):
+    """Writer for BGZF data, sending out each block as soon as it's full.
+
+    flush() writes out the current partial block, so that everything
+    written so far can be read back.  If 'index_file' is given, the block
+    offsets are written to it in .gzi format when the file is closed.  An
+    index can't be written when appending, as the amount of data already
+    in the file isn't known.
+    """
+
+    def __init__(self,fileobj,mode="w-",compresslevel=6,threads=None,
+                      index_file=None):
+        if "a" in mode and index_file is not None:
+            raise ValueError("Can't write a BGZF index when appending")
+        super(_BGZFWriter,self).__init__(fileobj,mode=mode)
+        offset = 0
+        if "a" in mode:
+            try:
+                offset = fileobj.tell()
+            except (AttributeError,IOError):
+                pass
+        self.index_file = index_file
+        self._c = _BGZFCompressor(compresslevel,threads,offset)
+
+    def _write(self,data,flushing=False):
+        self._fileobj.write(self._c(data))
+        if flushing:
+            self._fileobj.write(self._c.flush(eof=False))
+
+    def _tell(self):
+        #  Blocks still being compressed aren't yet counted in usize
+        pending = sum([n for (n,_) in self._c._jobs])
+        return self._c.usize + pending + self._c.buffered()
+
+    def _virtual_offset(self,offset):
+        self._fileobj.write(self._c.collect())
+        return (self._c.csize << 16) | self._c.buffered()
+
+    def close(self):
+        if not getattr(self,"closed",True):
+            self.flush()
+            self._fileobj.write(self._c.flush())
+            if self.index_file is not None:
+                _write_gzi(self.index_file,self._c.blocks[1:])
+        super(_BGZFWriter,self).close()
+
+
+class _BGZFReader(FileWrapper):
+    """Seekable reader for BGZF data.
+
+    The offsets at which blocks start are recorded as they are read, or
+    loaded from a .gzi index.  Seeking beyond the known blocks reads only
+    the headers and sizes of the blocks in between, then decompresses just
+    the block holding the target position.
+
+    If 'threads' is greater than one, up to two blocks per thread are read
+    ahead and decompressed by a pool of that many threads.
+    """
+
+    def __init__(self,fileobj,mode="r",threads=None,index_file=None):
+        super(_BGZFReader,self).__init__(fileobj,mode=mode)
+        self.threads = threads
+        self._pool = None
+        #  Known block starts as compressed and uncompressed offsets; once
+        #  '_complete' is set, the last entry is the end of the file.
+        self._coffsets = [0]
+        self._uoffsets = [0]
+        self._complete = False
+        if index_file is not None:
+            for (coffset,uoffset) in _read_gzi(index_file):
+                self._coffsets.append(coffset)
+                self._uoffsets.append(uoffset)
+        self._start(0)
+
+    def _start(self,idx):
+        """Start reading from the given known block."""
+        #  Position of the next block to read, and of the data to return.
+        self._rpos = self._coffsets[idx]
+        self._rupos = self._uoffsets[idx]
+        self._upos = self._rupos
+        self._ubuf = ""
+        self._pending = []
+
+    def _read_header(self):
+        """Read the header of the block at the current position.
+
+        Returns the header, or None at EOF.
+        """
+        header = self._fileobj.read(12)
+        if header == "":
+            return None
+        if len(header) < 12:
+            raise IOError("Truncated BGZF block")
+        xlen = struct.unpack("<H",header[10:12])[0]
+        return header + self._fileobj.read(xlen)
+
+    def _next_block(self):
+        """Read the next block of compressed data, or None at EOF."""
+        header = self._read_header()
+        if header is None:
+            self._complete = True
+            return None
+        size = _bgzf_block_size(header)
+        block = header + self._fileobj.read(size - len(header))
+        if len(block) != size:
+            raise IOError("Truncated BGZF block")
+        self._rpos += size
+        self._rupos += struct.unpack("<I",block[-4:])[0]
+        if self._rpos > self._coffsets[-1]:
+            self._coffsets.append(self._rpos)
+            self._uoffsets.append(self._rupos)
+        return block
+
+    def _scan_blocks(self,uoffset=None,coffset=None):
+        """Find block starts up to the given offset, reading only headers."""
+        moved = False
+        while not self._complete:
+            if uoffset is not None and self._uoffsets[-1] > uoffset:
+                break
+            if coffset is not None and self._coffsets[-1] >= coffset:
+                break
+            pos = self._coffsets[-1]
+            self._fileobj.seek(pos)
+            moved = True
+            header = self._read_header()
+            if header is None:
+                self._complete = True
+                break
+            size = _bgzf_block_size(header)
+            self._fileobj.seek(pos + size - 4)
+            data = self._fileobj.read(4)
+            if len(data) != 4:
+                raise IOError("Truncated BGZF block")
+            self._coffsets.append(pos + size)
+            self._uoffsets.append(self._uoffsets[-1] +
+                                  struct.unpack("<I",data)[0])
+        if moved:
+            self._fileobj.seek(self._rpos)
+
+    def _virtual_offset(self,offset):
+        self._scan_blocks(uoffset=offset)
+        idx = bisect_right(self._uoffsets,offset) - 1
+        return (self._coffsets[idx] << 16) | (offset - self._uoffsets[idx])
+
+    def _real_offset(self,voffset):
+        coffset = voffset >> 16
+        self._scan_blocks(coffset=coffset)
+        idx = bisect_right(self._coffsets,coffset) - 1
+        if self._coffsets[idx] != coffset:
+            raise IOError("No BGZF block starts at offset %d" % (coffset,))
+        return self._uoffsets[idx] + (voffset & 0xffff)
+
+    def _read(self,sizehint=-1):
+        if self._ubuf:
+            data = self._ubuf
+            self._ubuf = ""
+        elif self.threads > 1:
+            while len(self._pending) < self.threads * 2:
+                block = self._next_block()
+                if block is None:
+                    break
+                if self._pool is None:
+                    from multiprocessing.pool import ThreadPool
+                    self._pool = ThreadPool(self.threads)
+                job = self._pool.apply_async(_inflate_bgzf_block,(block,))
+                self._pending.append(job)
+            if not self._pending:
+                return None
+            data = self._pending.pop(0).get()
+        else:
+            block = self._next_block()
+            if block is None:
+                return None
+            data = _inflate_bgzf_block(block)
+        self._upos += len(data)
+        return data
+
+    def _seek(self,offset,whence):
+        if whence == 1:
+            raise NotImplementedError
+        if whence == 2:
+            self._scan_blocks()
+            offset = self._uoffsets[-1] + offset
+        self._scan_blocks(uoffset=offset)
+        idx = bisect_right(self._uoffsets,offset) - 1
+        self._fileobj.seek(self._coffsets[idx])
+        self._start(idx)
+        skip = offset - self._upos
+        while skip > 0:
+            data = self._read()
+            if data is None:
+                break
+            if len(data) > skip:
+                self._ubuf = data[skip:]
+                self._upos -= len(self._ubuf)
+            skip -= len(data)
+
+    def _tell(self):
+        return self._upos
+
+    def close(self):
+        super(_BGZFReader,self).close()
+        if getattr(self,"_pool",None) is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+class BGZF(BGZFMixin,Compress):
+    """Class for reading and writing a BGZF file.
+
+    This class is the dual of UnBGZF - it compresses read data into BGZF
+    blocks, and decompresses written data.
+    """
+
+    def __init__(self,fileobj,mode=None,compresslevel=6,threads=None):
+        self.compresslevel = compresslevel
+        self.threads = threads
+        super(BGZF,self).__init__(fileobj,mode=mode)
 
 
 class NullZipMixin(object):
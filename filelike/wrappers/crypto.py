@@ -72,7 +72,8 @@ class Decrypt(FileWrapper):
             myFileObj = FixedBlockSize(myFileObj,cipher.block_size,mode=mode)
             if self._check_mode("w",mode) and "-" not in mode:
                 if not self._check_mode("r",mode):
-                    myFileObj = FlushableBuffer(myFileObj,mode=mode)
+                    myFileObj = FlushableBuffer(myFileObj,mode=mode,
+                                                compressed=True)
         else:
             # Other modes are stateful translations.
             # To reset them, we simply reset the initialisation vector
@@ -90,9 +91,11 @@ class Decrypt(FileWrapper):
             #  To allow writes with seeks, we need to buffer.
             #  TODO: find a way around this.
             if self._check_mode("rw",mode):
-                myFileObj = FlushableBuffer(myFileObj,mode=mode)
+                myFileObj = FlushableBuffer(myFileObj,mode=mode,
+                                            compressed=True)
             elif self._check_mode("w",mode) and "-" not in mode:
-                myFileObj = FlushableBuffer(myFileObj,mode=mode)
+                myFileObj = FlushableBuffer(myFileObj,mode=mode,
+                                            compressed=True)
         super(Decrypt,self).__init__(myFileObj,mode=mode)
 
 
@@ -50,6 +50,13 @@ class Slice(FileWrapper):
     If 'stop' is negative then it is taken as on offset from the end of the
     file, just like standard list/tuple slicing.
 
+    If opened in streamed read mode ("r-"), the slice never calls seek() or
+    tell() on the underlying file.  The 'start' bytes are skipped by reading
+    and discarding them, and 'stop' is enforced by counting the bytes read.
+    Offsets are then taken relative to the current position of the stream.
+    A negative 'stop' is handled by holding back that many bytes from the
+    end of the stream, so the size of the stream need not be known.
+
     """
     
     def __init__(self,fileobj,start=0,stop=None,mode=None,resizable=False):
@@ -61,7 +68,15 @@ class Slice(FileWrapper):
         """
         if start < 0:
             raise ValueError("start index cannot be negative.")
-        if stop is not None and stop < 0:
+        if mode is None:
+            mode = getattr(fileobj,"mode","r+")
+        self._streamed = self._is_streamed_read(mode)
+        self._srcpos = 0
+        self._holdback = None
+        if self._streamed:
+            if stop is not None and stop < 0:
+                self._holdback = ""
+        elif stop is not None and stop < 0:
             try:
                 stop = fileobj.size + stop
             except AttributeError:
@@ -73,12 +88,33 @@ class Slice(FileWrapper):
         self.stop = stop
         self._resizable = resizable
         super(Slice,self).__init__(fileobj,mode)
-        if "a" not in self.mode:
+        if "a" not in self.mode and not self._streamed:
             if self._fileobj.tell() < start:
                 self._fileobj.seek(start)
+
+    def _is_streamed_read(self,mode):
+        """Check whether the given mode string is for streamed reading."""
+        if "-" not in mode or "+" in mode:
+            return False
+        return "r" in mode and "w" not in mode and "a" not in mode
+
+    def _skip(self,size):
+        """Read and discard <size> bytes from the underlying stream.
+
+        Returns False if EOF was reached before skipping all the bytes.
+        """
+        while size > 0:
+            data = self._fileobj.read(min(size,self._bufsize))
+            if data == "":
+                return False
+            self._srcpos += len(data)
+            size -= len(data)
+        return True
     
     def _read(self,size=-1):
         """Read approximately <size> bytes from the file."""
+        if self._streamed:
+            return self._read_streamed(size)
         pos = self._fileobj.tell()
         if self.stop is not None:
             if size < 0:
@@ -92,6 +128,56 @@ class Slice(FileWrapper):
             return None
         return data
 
+    def _read_streamed(self,size=-1):
+        """Read from the underlying stream without using seek() or tell()."""
+        if self._srcpos < self.start:
+            if not self._skip(self.start - self._srcpos):
+                return None
+        if self._holdback is None and self.stop is not None:
+            if size < 0 or self._srcpos + size > self.stop:
+                size = self.stop - self._srcpos
+            if size <= 0:
+                return None
+        data = self._fileobj.read(size)
+        self._srcpos += len(data)
+        if self._holdback is None:
+            if data == "":
+                return None
+            return data
+        #  Negative stop index; keep the final -stop bytes of the stream
+        #  in reserve until we know that they aren't the last ones.
+        if data == "":
+            self._holdback = ""
+            return None
+        data = self._holdback + data
+        split = max(len(data) + self.stop,0)
+        self._holdback = data[split:]
+        return data[:split]
+
+    def read_ranges(self,ranges,gap=None):
+        """Read several (offset,length) ranges from the slice in one batch.
+
+        The ranges are clipped to the bounds of the slice and passed down
+        to the underlying file.
+        """
+        if self._streamed:
+            return super(Slice,self).read_ranges(ranges,gap)
+        if self.closed:
+            raise IOError("File has been closed")
+        self._assert_mode("r")
+        if gap is None:
+            gap = self._bufsize
+        if self._wbuffer:
+            self.flush()
+        translated = []
+        for (offset,length) in ranges:
+            if offset < 0 or length < 0:
+                raise ValueError("Invalid range: %r" % ((offset,length),))
+            if self.stop is not None:
+                length = max(min(length,self.stop - self.start - offset),0)
+            translated.append((self.start + offset,length))
+        return filelike._read_ranges(self._fileobj,translated,gap)
+
     def _write(self,data,flushing=False):
         """Write the given string to the file."""
         if self.stop is None:
@@ -148,6 +234,11 @@ class Slice(FileWrapper):
 
     def _tell(self):
         """Get position of file pointer."""
+        if self._streamed:
+            pos = max(self._srcpos - self.start,0)
+            if self._holdback:
+                pos -= len(self._holdback)
+            return pos
         return self._fileobj.tell() - self.start
 
     def _truncate(self,size):
@@ -1,5 +1,6 @@
 
 from filelike.wrappers import Buffer, FlushableBuffer
+from filelike.wrappers.buffer import BufferPool, _PageSpool
 from filelike import tests
 
 import unittest
@@ -177,6 +178,36 @@ class Test_FlushableBuffer(tests.Test_ReadWriteSeek):
         f.close()
         self.assertEquals(s.getvalue(),"hellotesting")
 
+    def test_flush_changed_pages(self):
+        data = "".join([chr(i % 256) for i in xrange(200000)])
+        f = self.makeFile(data,"r+")
+        s = f._fileobj
+        def noop():
+            pass
+        s.close = noop
+        writes = []
+        def write(chunk):
+            writes.append((s.tell(),len(chunk)))
+            StringIO.write(s,chunk)
+        s.write = write
+        f.seek(100000)
+        f.write("hello")
+        f.flush()
+        pagesize = f._buffer.pagesize
+        start = 100000 - 100000 % pagesize
+        end = 100005 + (-100005 % pagesize)
+        self.assertEquals(writes[0][0],start)
+        self.assertEquals(sum([n for (_,n) in writes]),end - start)
+        self.assertEquals(s.getvalue(),data[:100000]+"hello"+data[100005:])
+        #  Nothing has changed since the last flush
+        del writes[:]
+        f.flush()
+        self.assertEquals(writes,[])
+        f.truncate(150000)
+        f.close()
+        self.assertEquals(writes,[])
+        self.assertEquals(s.getvalue(),data[:100000]+"hello"+data[100005:150000])
+
 
 class Test_FlushableBuffer_rollover(Test_FlushableBuffer):
     """Testcases for the FlushableBuffer class with rollover to tempfile."""
@@ -191,3 +222,235 @@ class Test_FlushableBuffer_rollover(Test_FlushableBuffer):
         f.getvalue = getvalue
         return f
 
+
+class TinyPagesMixin(object):
+    """Mixin using tiny pages for buffers, so that several are needed."""
+
+    def setUp(self):
+        self._pagesize = _PageSpool.pagesize
+        self._hot_pages = _PageSpool.hot_pages
+        _PageSpool.pagesize = 4
+        _PageSpool.hot_pages = 2
+        super(TinyPagesMixin,self).setUp()
+
+    def tearDown(self):
+        super(TinyPagesMixin,self).tearDown()
+        _PageSpool.pagesize = self._pagesize
+        _PageSpool.hot_pages = self._hot_pages
+
+
+class Test_Buffer_compressed(TinyPagesMixin,Test_Buffer):
+    """Testcases for the Buffer class with compressed pages in memory."""
+    
+    def makeFile(self,contents,mode):
+        s = StringIO(contents)
+        if "a" in mode:
+            s.seek(0,2)
+        f = Buffer(s,mode,compressed=True)
+        def getvalue():
+            return get_buffered_value(f)
+        f.getvalue = getvalue
+        return f
+
+
+class Test_FlushableBuffer_compressed(TinyPagesMixin,Test_FlushableBuffer):
+    """Testcases for the FlushableBuffer class with compressed pages."""
+    
+    def makeFile(self,contents,mode):
+        s = StringIO(contents)
+        if "a" in mode:
+            s.seek(0,2)
+        f = FlushableBuffer(s,mode,compressed=True)
+        def getvalue():
+            return s.getvalue()
+        f.getvalue = getvalue
+        return f
+
+
+class Test_Buffer_pooled(Test_Buffer):
+    """Testcases for the Buffer class sharing a pool spilling to mmap."""
+    
+    def makeFile(self,contents,mode):
+        s = StringIO(contents)
+        if "a" in mode:
+            s.seek(0,2)
+        self.pool = BufferPool(max_size=4,use_mmap=True)
+        f = Buffer(s,mode,pool=self.pool)
+        def getvalue():
+            return get_buffered_value(f)
+        f.getvalue = getvalue
+        return f
+
+
+class Test_PageSpool(unittest.TestCase):
+    """Testcases for the paged in-memory buffer file."""
+
+    def test_operations(self):
+        import random
+        rnd = random.Random(11)
+        for (max_size,compressed) in [(1024*1024,True),(2000,True),
+                                      (1024*1024,False),(2000,False)]:
+            spool = _PageSpool(max_size,compressed)
+            spool.pagesize = 100
+            spool.hot_pages = 3
+            s = StringIO()
+            for _ in xrange(500):
+                op = rnd.randint(0,3)
+                if op == 0:
+                    pos = rnd.randint(0,s.len + 150)
+                    spool.seek(pos)
+                    s.seek(pos)
+                elif op == 1:
+                    data = ("%d," % (rnd.randint(0,99),)) * rnd.randint(1,100)
+                    spool.write(data)
+                    s.write(data)
+                elif op == 2:
+                    #  StringIO moves back to the end if read beyond it
+                    if s.tell() > s.len:
+                        continue
+                    size = rnd.randint(-1,300)
+                    self.assertEquals(spool.read(size),s.read(size))
+                else:
+                    size = rnd.randint(0,s.len + 100)
+                    spool.truncate(size)
+                    data = s.getvalue()[:size]
+                    s = StringIO(data + "\x00" * (size - len(data)))
+                    spool.seek(size)
+                    s.seek(size)
+                self.assertEquals(spool.tell(),s.tell())
+                self.assertEquals(spool.getsize(),s.len)
+            spool.seek(0)
+            self.assertEquals(spool.read(),s.getvalue())
+            self.assert_(spool.memory_size() <= max_size)
+            spool.close()
+
+    def test_compressed(self):
+        f = Buffer(StringIO(),"r+",compressed=True)
+        data = "a line of highly compressible text\n" * 30000
+        f.write(data)
+        spool = f._buffer
+        self.assertEquals(spool._disk,None)
+        self.assert_(spool.memory_size() < len(data) // 3)
+        f.seek(500000)
+        self.assertEquals(f.read(36),data[500000:500036])
+        import os
+        f.write(os.urandom(2*1024*1024))
+        self.assertNotEquals(spool._disk,None)
+        f.seek(500000)
+        self.assertEquals(f.read(36),data[500000:500036])
+
+    def test_spilled_read_after_write(self):
+        import random
+        rnd = random.Random(5)
+        data = "".join([chr(i % 251) for i in xrange(100000)])
+        for compressed in (True,False):
+            spool = _PageSpool(100,compressed)
+            spool.write(data)
+            self.assertNotEquals(spool._disk,None)
+            s = StringIO(data)
+            for _ in xrange(100):
+                pos = rnd.randint(0,len(data))
+                spool.seek(pos)
+                s.seek(pos)
+                chunk = chr(rnd.randint(0,255)) * rnd.randint(1,5000)
+                spool.write(chunk)
+                s.write(chunk)
+                size = rnd.randint(1,5000)
+                self.assertEquals(spool.read(size),s.read(size))
+                self.assertEquals(spool.tell(),s.tell())
+            spool.close()
+
+    def test_dirty_ranges(self):
+        spool = _PageSpool(compressed=False)
+        spool.pagesize = 10
+        spool.fill("x" * 100)
+        self.assertEquals(spool.dirty_ranges(),[])
+        spool.seek(15)
+        spool.write("yy")
+        spool.seek(38)
+        spool.write("y" * 15)
+        self.assertEquals(spool.dirty_ranges(),[(10,10),(30,30)])
+        spool.truncate(45)
+        self.assertEquals(spool.dirty_ranges(),[(10,10),(30,15)])
+        self.assertEquals(spool.getsize(),45)
+        spool.clean()
+        self.assertEquals(spool.dirty_ranges(),[])
+
+
+class Test_BufferPool(unittest.TestCase):
+    """Testcases for sharing memory between buffers."""
+
+    def test_spill_coldest(self):
+        pool = BufferPool(max_size=1000)
+        bufs = [Buffer(StringIO(),"r+",pool=pool) for _ in xrange(3)]
+        bufs[0].write("a" * 400)
+        bufs[1].write("b" * 400)
+        bufs[0].seek(0)
+        self.assertEquals(bufs[0].read(10),"a" * 10)
+        self.assertEquals(pool.memory_size(),800)
+        self.assertEquals(pool.spills,0)
+        #  The second buffer is now the least recently used
+        bufs[2].write("c" * 400)
+        self.assertEquals(pool.spills,1)
+        self.assertEquals(pool.memory_size(),800)
+        self.assertEquals(len(pool),2)
+        self.assertNotEquals(bufs[1]._buffer._disk,None)
+        self.assertEquals(bufs[0]._buffer._disk,None)
+        bufs[1].seek(0)
+        self.assertEquals(bufs[1].read(),"b" * 400)
+        #  A buffer outgrowing the whole pool spills itself
+        bufs[2].write("c" * 1000)
+        self.assertEquals(pool.spills,2)
+        self.assertEquals(pool.memory_size(),400)
+        for f in bufs:
+            f.close()
+        self.assertEquals(pool.memory_size(),0)
+        self.assertEquals(len(pool),0)
+
+    def test_read_after_write_spilled(self):
+        pool = BufferPool(max_size=100000)
+        data = "".join([chr(i % 251) for i in xrange(80000)])
+        f1 = Buffer(StringIO(),"r+",pool=pool)
+        f2 = Buffer(StringIO(),"r+",pool=pool)
+        f1.write(data)
+        f2.write(data)
+        #  The first buffer was pushed out to a plain temporary file
+        self.assertEquals(pool.spills,1)
+        self.assertNotEquals(f1._buffer._disk,None)
+        self.assertFalse(hasattr(f1._buffer._disk,"_map"))
+        s = StringIO(data)
+        for pos in (1000,30000,5000,70000):
+            f1.seek(pos)
+            s.seek(pos)
+            f1.write("x" * 6000)
+            s.write("x" * 6000)
+            self.assertEquals(f1.read(6000),s.read(6000))
+        f1.seek(0)
+        self.assertEquals(f1.read(),s.getvalue())
+        f1.close()
+        f2.close()
+
+    def test_default_pool(self):
+        import tempfile, shutil
+        dir = tempfile.mkdtemp()
+        try:
+            pool = BufferPool(max_size=100,dir=dir,use_mmap=True)
+            Buffer.default_pool = pool
+            try:
+                s = StringIO()
+                f = FlushableBuffer(s,"w")
+            finally:
+                Buffer.default_pool = None
+            f.write("x" * 50)
+            self.assertEquals(pool.memory_size(),50)
+            f.write("y" * 5000)
+            self.assertEquals(pool.spills,1)
+            self.assertEquals(pool.memory_size(),0)
+            f.seek(25)
+            f.write("z" * 50)
+            f.truncate(6000)
+            f.flush()
+            self.assertEquals(s.getvalue(),"x" * 25 + "z" * 50 + "y" * 4975
+                                           + "\x00" * 950)
+        finally:
+            shutil.rmtree(dir)
@@ -1,5 +1,6 @@
 
-from filelike.wrappers import BZip2, UnBZip2, GZip, UnGZip
+from filelike.wrappers import BZip2, UnBZip2, GZip, UnGZip, UnZlib, UnDeflate
+from filelike.wrappers import UnBGZF
 from filelike import tests
 from filelike.wrappers.tests.test_buffer import get_buffered_value, def_getvalue_maybe_buffered
 
@@ -8,6 +9,8 @@ from StringIO import StringIO
 
 import bz2
 import gzip
+import zlib
+import struct
 
 
 class Test_BZip2(tests.Test_ReadWriteSeek):
@@ -65,6 +68,16 @@ class Test_BZip2(tests.Test_ReadWriteSeek):
             os.unlink(fn)
 
 
+def bz2_decompress(data):
+    #  Unlike bz2.decompress, this handles several concatenated streams
+    output = []
+    while data:
+        d = bz2.BZ2Decompressor()
+        output.append(d.decompress(data))
+        data = d.unused_data
+    return "".join(output)
+
+
 class Test_UnBZip2(tests.Test_ReadWrite):
     """Tetcases for UnBZip2 wrapper class."""
 
@@ -73,7 +86,7 @@ class Test_UnBZip2(tests.Test_ReadWrite):
     def makeFile(self,contents,mode):
         s = StringIO(bz2.compress(contents))
         f = UnBZip2(s,mode)
-        f.getvalue = def_getvalue_maybe_buffered(f,s,bz2.decompress)
+        f.getvalue = def_getvalue_maybe_buffered(f,s,bz2_decompress)
         return f
 
     def test_resulting_file(self):
@@ -198,3 +211,695 @@ class Test_UnGZip(tests.Test_ReadWrite):
         finally:
           os.unlink(fn)
 
+
+
+class Test_UnGZip_Indexed(unittest.TestCase):
+    """Testcases for seeking in UnGZip using a checkpoint index."""
+
+    words = ["alpha","beta","gamma","delta","epsilon","zeta","eta"]
+    data = " ".join([words[(i*i + i//7) % 7] for i in xrange(50000)])
+    compressed = gz_compress(data)
+
+    def setUp(self):
+        self.raw = tests.CountingStringIO(self.compressed)
+        self.file = UnGZip(self.raw,"r",index_interval=32*1024)
+        self.file._bufsize = 4096
+        self.reader = self.file._fileobj
+        self.reader._bufsize = 4096
+
+    def test_read(self):
+        self.assertEquals(self.file.read(),self.data)
+        ncheckpoints = len(self.reader._checkpoints)
+        self.assert_(1 < ncheckpoints <= 1 + len(self.data) // (32*1024))
+
+    def test_seek(self):
+        import random
+        rnd = random.Random(7)
+        for _ in xrange(50):
+            pos = rnd.randint(0,len(self.data))
+            self.file.seek(pos)
+            self.assertEquals(self.file.tell(),pos)
+            self.assertEquals(self.file.read(100),self.data[pos:pos+100])
+
+    def test_seek_uses_index(self):
+        self.file.read()
+        nreads = self.raw.nreads
+        self.file.seek(len(self.data) - 1000)
+        self.assertEquals(self.file.read(),self.data[-1000:])
+        #  Only data after the last checkpoint should be decompressed again
+        self.assert_(self.raw.nreads - nreads < 10)
+        self.file.seek(70000)
+        self.assertEquals(self.file.read(10),self.data[70000:70010])
+        self.file.seek(-10,2)
+        self.assertEquals(self.file.read(),self.data[-10:])
+
+    def test_size(self):
+        #  The trailer is only checked once the size is wanted
+        self.assertEquals(self.raw.nreads,0)
+        self.assertEquals(self.file.size,len(self.data))
+        self.assertEquals(self.raw.tell(),0)
+        self.file.seek(-10,2)
+        self.assertEquals(self.file.tell(),len(self.data) - 10)
+        self.assertEquals(self.file.read(),self.data[-10:])
+        #  Ambiguous trailers aren't trusted
+        for compressed in (self.compressed + "\x00" * 10,
+                           self.compressed + gz_compress("more")):
+            f = UnGZip(StringIO(compressed),"r")
+            self.assertFalse(hasattr(f,"size"))
+            f.seek(-10,2)
+            self.assertEquals(f.tell(),len(gz_decompress(compressed)) - 10)
+        f = UnGZip(StringIO(self.compressed),"r-")
+        self.assertFalse(hasattr(f,"size"))
+
+    def test_size_trailing_garbage(self):
+        """A trailer size spoiled by trailing garbage is corrected."""
+        compressed = self.compressed + "junk\x01\x02\x03\x04"
+        f = UnGZip(StringIO(compressed),"r")
+        self.assertEquals(f.size,0x04030201)
+        f.seek(-5,2)
+        self.assertEquals(f.tell(),len(self.data) - 5)
+        self.assertEquals(f.read(),self.data[-5:])
+        self.assertEquals(f.size,len(self.data))
+        f = UnGZip(StringIO(compressed),"r")
+        self.assertEquals(f.read(),self.data)
+        self.assertEquals(f.size,len(self.data))
+
+    def test_no_index(self):
+        f = UnGZip(StringIO(gz_compress(self.data)),"r",index_interval=0)
+        f.seek(5000)
+        self.assertEquals(f.read(10),self.data[5000:5010])
+
+    def _saved_index(self,compressed,interval=32*1024):
+        f = UnGZip(StringIO(compressed),"r",index_interval=interval)
+        f.read(100)
+        idx = StringIO()
+        f.save_index(idx)
+        self.assertEquals(f.tell(),100)
+        self.assertEquals(f.read(10),self.data[100:110])
+        return (f._fileobj,idx.getvalue())
+
+    def _check_index(self,compressed,index):
+        raw = tests.CountingStringIO(compressed)
+        f = UnGZip(raw,"r",index_interval=32*1024,index_file=StringIO(index))
+        f._fileobj._bufsize = 4096
+        self.assertEquals(f.size,len(self.data))
+        f.seek(len(self.data) - 1000)
+        self.assertEquals(f.read(),self.data[-1000:])
+        #  Only the data after the last checkpoint is decompressed
+        self.assert_(raw.nreads < 20)
+        import random
+        rnd = random.Random(3)
+        for _ in xrange(30):
+            pos = rnd.randint(0,len(self.data))
+            f.seek(pos)
+            self.assertEquals(f.read(50),self.data[pos:pos+50])
+
+    def test_index_file_sync_flush(self):
+        from filelike.wrappers.compress import _ParallelGZipCompressor
+        c = _ParallelGZipCompressor(6,1,blocksize=8*1024)
+        compressed = c(self.data) + c.flush()
+        (reader,index) = self._saved_index(compressed)
+        portable = [cp for cp in reader._checkpoints if cp[2] is None]
+        self.assert_(len(portable) > len(self.data) // (40*1024))
+        self.assertEquals(len(portable[1][3]),32*1024)
+        self._check_index(compressed,index)
+
+    def test_index_file_members(self):
+        compressed = "".join([gz_compress(self.data[i:i+20000])
+                              for i in xrange(0,len(self.data),20000)])
+        (reader,index) = self._saved_index(compressed)
+        portable = [cp for cp in reader._checkpoints if cp[2] is None]
+        self.assert_(len(portable) > len(self.data) // (60*1024))
+        self.assertEquals([cp[3] for cp in portable],[None] * len(portable))
+        self._check_index(compressed,index)
+
+    def test_index_file_plain(self):
+        (reader,index) = self._saved_index(self.compressed)
+        f = UnGZip(StringIO(self.compressed),"r",index_file=StringIO(index))
+        self.assertEquals(f.size,len(self.data))
+        f.seek(-10,2)
+        self.assertEquals(f.read(),self.data[-10:])
+        self.assertRaises(IOError,UnGZip,StringIO(self.compressed + "\x00"),
+                          "r",index_file=StringIO(index))
+        self.assertRaises(IOError,UnGZip,StringIO(self.compressed),"r",
+                          index_file=StringIO(index[:-1]))
+
+
+class Test_UnBZip2_Indexed(unittest.TestCase):
+    """Testcases for block-wise decoding of UnBZip2 using a block index."""
+
+    data = "".join(["line %d of the test data\n" % (i,) for i in xrange(30000)])
+    compressed = bz2.compress(data,1)
+
+    def makeFile(self,compressed=None,**kwds):
+        if compressed is None:
+            compressed = self.compressed
+        self.raw = tests.CountingStringIO(compressed)
+        f = UnBZip2(self.raw,"r",**kwds)
+        f._bufsize = 4096
+        return f
+
+    def test_find_magic(self):
+        from filelike.wrappers.compress import _find_bz2_magic
+        magics = _find_bz2_magic(self.compressed)
+        self.assertEquals(magics[0],(32,"block"))
+        self.assertEquals(magics[-1][1],"eos")
+        self.assert_(len(magics) > 4)
+
+    def test_read(self):
+        f = self.makeFile()
+        self.assertEquals(f.read(),self.data)
+        self.assert_(len(f._fileobj._blocks) > 4)
+
+    def test_seek(self):
+        import random
+        rnd = random.Random(7)
+        f = self.makeFile()
+        for _ in xrange(30):
+            pos = rnd.randint(0,len(self.data))
+            f.seek(pos)
+            self.assertEquals(f.tell(),pos)
+            self.assertEquals(f.read(100),self.data[pos:pos+100])
+
+    def test_seek_uses_index(self):
+        f = self.makeFile()
+        f.read()
+        nreads = self.raw.nreads
+        f.seek(len(self.data) // 2)
+        self.assertEquals(f.read(10),self.data[len(self.data)//2:][:10])
+        self.assertEquals(self.raw.nreads - nreads,1)
+
+    def test_multiple_streams(self):
+        f = self.makeFile(self.compressed + bz2.compress("and more\n"))
+        self.assertEquals(f.read(),self.data + "and more\n")
+        f.seek(len(self.data) - 2)
+        self.assertEquals(f.read(),"a\nand more\n")
+
+    def test_spurious_magic(self):
+        """Magic numbers occurring by chance inside a block are skipped."""
+        from filelike.wrappers import compress
+        find_magic = compress._find_bz2_magic
+        def fake_find_magic(data,start=0,end=None):
+            magics = find_magic(data,start,end)
+            if start == 0:
+                magics = sorted(magics + [(5000,"block"),(9003,"eos")])
+            return magics
+        compress._find_bz2_magic = fake_find_magic
+        try:
+            f = self.makeFile()
+            self.assertEquals(f.read(),self.data)
+        finally:
+            compress._find_bz2_magic = find_magic
+        self.assertEquals(f._fileobj._blocks[1][0],
+                          find_magic(self.compressed)[1][0])
+
+    def test_invalid_data(self):
+        """Data that isn't a bzip2 stream is an error, as when streaming."""
+        import random
+        rnd = random.Random(7)
+        noise = "".join([chr(rnd.randint(0,255)) for _ in xrange(5000)])
+        for data in ("BZh9 is a bzip2 header...",noise,
+                     self.compressed[:-20],self.compressed + "BZh9junk"):
+            f = self.makeFile(data)
+            self.assertRaises(IOError,f.read)
+        self.assertEquals(self.makeFile("").read(),"")
+
+    def test_trailing_data(self):
+        """Data after the last stream that isn't a bzip2 header is ignored."""
+        f = self.makeFile(self.compressed + "\0"*10 + bz2.compress("more"))
+        self.assertEquals(f.read(),self.data)
+        f = self.makeFile(self.compressed + "junk\x01\x02\x03\x04")
+        self.assertEquals(f.read(),self.data)
+        f.seek(5)
+        self.assertEquals(f.read(5),self.data[5:10])
+
+    def test_processes(self):
+        f = self.makeFile(processes=2)
+        try:
+            self.assertEquals(f.read(),self.data)
+            f.seek(1000)
+            self.assertEquals(f.read(10),self.data[1000:1010])
+        finally:
+            f.close()
+
+
+class Test_GZip_Threaded(unittest.TestCase):
+    """Testcases for compressing gzip data in several threads."""
+
+    data = "".join(["line %d of the test data\n" % (i,) for i in xrange(30000)])
+
+    def _compress(self,chunksize,**kwds):
+        s = StringIO()
+        s.close = lambda: None
+        f = UnGZip(s,"w-",threads=3,**kwds)
+        f.compress.blocksize = 16*1024
+        for i in xrange(0,len(self.data),chunksize):
+            f.write(self.data[i:i+chunksize])
+        f.close()
+        return s.getvalue()
+
+    def test_write(self):
+        for chunksize in (1000,100000,len(self.data)):
+            compressed = self._compress(chunksize)
+            self.assertEquals(gz_decompress(compressed),self.data)
+            f = UnGZip(StringIO(compressed),"r")
+            self.assertEquals(f.read(),self.data)
+
+    def test_bounded(self):
+        s = StringIO()
+        f = UnGZip(s,"w-",threads=2)
+        f.compress.blocksize = 1024
+        f.write(self.data)
+        self.assert_(len(f.compress._jobs) <= 4)
+
+    def test_empty(self):
+        s = StringIO()
+        s.close = lambda: None
+        UnGZip(s,"w-",threads=2).close()
+        self.assertEquals(gz_decompress(s.getvalue()),"")
+
+    def test_read(self):
+        compressed = GZip(StringIO(self.data),"r",threads=2).read()
+        self.assertEquals(gz_decompress(compressed),self.data)
+
+
+class Test_GZip_Adaptive(unittest.TestCase):
+    """Testcases for storing incompressible data uncompressed."""
+
+    text = "".join(["line %d of the test data\n" % (i,) for i in xrange(20000)])
+
+    def _compress(self,data,**kwds):
+        s = StringIO()
+        s.close = lambda: None
+        f = UnGZip(s,"w-",adaptive=True,**kwds)
+        f.write(data)
+        f.close()
+        return (s.getvalue(),f.compress.stored)
+
+    def test_write(self):
+        import os
+        noise = os.urandom(400*1024)
+        data = self.text + noise + self.text
+        for threads in (None,3):
+            (compressed,stored) = self._compress(data,threads=threads)
+            self.assertEquals(gz_decompress(compressed),data)
+            self.assert_(256*1024 <= stored <= len(noise) + 256*1024)
+            self.assert_(len(compressed) < len(noise) + len(self.text))
+            (compressed,stored) = self._compress(self.text,threads=threads)
+            self.assertEquals(gz_decompress(compressed),self.text)
+            self.assertEquals(stored,0)
+
+    def test_read(self):
+        import os
+        data = os.urandom(300*1024)
+        f = GZip(StringIO(data),"r",adaptive=True)
+        self.assertEquals(gz_decompress(f.read()),data)
+        self.assert_(f.compress.stored > 0)
+
+
+class Test_UnGZip_MultiMember(unittest.TestCase):
+    """Testcases for reading gzip files made of several members."""
+
+    parts = ["part %d of the test data\n" % (i,) * (i * 500) for i in xrange(8)]
+    data = "".join(parts)
+    compressed = "".join([gz_compress(part) for part in parts])
+
+    def test_read(self):
+        for mode in ("r","r-"):
+            for index_interval in (0,4096):
+                s = StringIO(self.compressed)
+                f = UnGZip(s,mode,index_interval=index_interval)
+                f._bufsize = 100
+                self.assertEquals(f.read(),self.data)
+
+    def test_seek(self):
+        f = UnGZip(StringIO(self.compressed),"r",index_interval=4096)
+        f.read()
+        f.seek(len(self.data) - 50)
+        self.assertEquals(f.read(),self.data[-50:])
+        f.seek(20000)
+        self.assertEquals(f.read(10),self.data[20000:20010])
+
+    def test_trailing_garbage(self):
+        f = UnGZip(StringIO(self.compressed + "\x00" * 10),"r")
+        self.assertEquals(f.read(),self.data)
+        f = UnGZip(StringIO(self.compressed + "\x00" * 10),"r",threads=2)
+        self.assertEquals(f.read(),self.data)
+
+    def test_threaded(self):
+        for max_segment in (4*1024*1024,1000):
+            for mode in ("r","r-"):
+                f = UnGZip(StringIO(self.compressed),mode,threads=3)
+                f._fileobj.max_segment = max_segment
+                f._fileobj._bufsize = 512
+                self.assertEquals(f.read(),self.data)
+                f.close()
+
+    def test_threaded_false_header(self):
+        """Member headers appearing inside compressed data are skipped."""
+        part = "ab\x1f\x8b\x08cd" * 1000
+        s = StringIO()
+        g = gzip.GzipFile(fileobj=s,mode="w",compresslevel=0)
+        g.write(part)
+        g.close()
+        f = UnGZip(StringIO(self.compressed + s.getvalue()),"r",threads=2)
+        self.assertEquals(f.read(),self.data + part)
+        f.seek(0)
+        self.assertEquals(f.read(100),self.data[:100])
+
+    def test_threaded_bounded(self):
+        f = UnGZip(StringIO(self.compressed),"r",threads=2)
+        f._bufsize = 10
+        f.read(10)
+        self.assert_(len(f._fileobj._pending) <= 4)
+
+
+class Test_Append(unittest.TestCase):
+    """Testcases for appending to compressed files without rewriting them."""
+
+    def _append(self,cls,compressed,chunks):
+        s = tests.CountingStringIO(compressed)
+        s.close = lambda: None
+        f = cls(s,"a")
+        for chunk in chunks:
+            f.write(chunk)
+            f.flush()
+        self.assertEquals(f.tell(),len("".join(chunks)))
+        f.close()
+        self.assertEquals(s.nreads,0)
+        self.assertEquals(s.getvalue()[:len(compressed)],compressed)
+        return s.getvalue()
+
+    def test_gzip(self):
+        data = self._append(UnGZip,gz_compress("hello\n"),["one\n","two\n"])
+        self.assertEquals(gz_decompress(data),"hello\none\ntwo\n")
+        for mode in ("r","r-"):
+            f = UnGZip(StringIO(data),mode)
+            self.assertEquals(f.read(),"hello\none\ntwo\n")
+
+    def test_bzip2(self):
+        data = self._append(UnBZip2,bz2.compress("hello\n"),["one\n","two\n"])
+        self.assertEquals(bz2_decompress(data),"hello\none\ntwo\n")
+        for mode in ("r","r-"):
+            f = UnBZip2(StringIO(data),mode)
+            self.assertEquals(f.read(),"hello\none\ntwo\n")
+
+    def test_real_file(self):
+        import tempfile
+        import os
+        (fd,fn) = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            f = UnGZip(open(fn,"wb"),"w")
+            f.write("hello\n")
+            f.close()
+            for i in xrange(3):
+                f = UnGZip(open(fn,"ab"))
+                f.write("line %d\n" % (i,))
+                f.close()
+            f = UnGZip(open(fn,"rb"))
+            self.assertEquals(f.read(),"hello\nline 0\nline 1\nline 2\n")
+            f.close()
+        finally:
+            os.unlink(fn)
+
+
+class Test_BoundedOutput(unittest.TestCase):
+    """Testcases for limiting the output of each read to the size hint."""
+
+    data = "\x00" * (8*1024*1024)
+    gz_data = gz_compress(data)
+    bz2_lines = "".join(["line %d\n" % (i,) for i in xrange(300000)])
+    bz2_data = bz2.compress(bz2_lines)
+
+    def _check_reads(self,f,data,limit):
+        output = []
+        chunk = f.read(1000)
+        while chunk:
+            output.append(chunk)
+            self.assert_(len(f._rbuffer or "") <= limit)
+            self.assert_(len(f._fileobj._rbuffer or "") <= limit)
+            chunk = f.read(1000)
+        self.assertEquals(len("".join(output)),len(data))
+        self.assertEquals("".join(output),data)
+
+    def test_gzip(self):
+        for mode in ("r","r-"):
+            f = UnGZip(StringIO(self.gz_data),mode)
+            self._check_reads(f,self.data,1000)
+
+    def test_gzip_threaded(self):
+        #  The member inflates to too much data to decode in the pool
+        f = UnGZip(StringIO(self.gz_data),"r",threads=2)
+        f._fileobj.max_segment = 64*1024
+        f._fileobj._bufsize = 1000
+        self._check_reads(f,self.data,1000)
+
+    def test_gzip_tail(self):
+        from filelike.wrappers import compress
+        d = compress._GZipMemberDecompressor()
+        self.assertEquals(d.decompress(self.gz_data,1000),"\x00" * 1000)
+        self.assert_(d.has_tail())
+        self.assertEquals(len(d.decompress("")),len(self.data) - 1000)
+        self.assertFalse(d.has_tail())
+
+    def test_bzip2(self):
+        #  bz2 can't limit its output, so reads are bounded by block size
+        f = UnBZip2(StringIO(self.bz2_data),"r-")
+        self._check_reads(f,self.bz2_lines,1000*1000)
+
+
+def zlib_decompress(data):
+    #  Like bz2_decompress, handle several concatenated streams
+    output = []
+    while data:
+        d = zlib.decompressobj()
+        output.append(d.decompress(data))
+        data = d.unused_data
+    return "".join(output)
+
+
+class Test_UnZlib(tests.Test_ReadWrite):
+    """Testcases for UnZlib wrapper class."""
+
+    contents = "This is my uncompressed\n test data"
+
+    def makeFile(self,contents,mode):
+        s = StringIO(zlib.compress(contents))
+        f = UnZlib(s,mode)
+        f.getvalue = def_getvalue_maybe_buffered(f,s,zlib_decompress)
+        return f
+
+
+class Test_PresetDictionary(unittest.TestCase):
+    """Testcases for compressing with a preset dictionary."""
+
+    records = ['{"id": %d, "name": "user%d", "email": "user%d@example.com", '
+               '"active": %s, "created": "2024-01-%02dT12:00:00Z"}'
+               % (i,i*7919 % 10007,i,["true","false"][i % 3 == 0],i % 28 + 1)
+               for i in xrange(400)]
+
+    def _compress(self,cls,data,**kwds):
+        s = StringIO()
+        s.close = lambda: None
+        f = cls(s,"w",**kwds)
+        f.write(data)
+        f.close()
+        return s.getvalue()
+
+    def test_roundtrip(self):
+        zdict = "".join(self.records[:20])
+        for cls in (UnZlib,UnDeflate):
+            for record in self.records[20:30]:
+                data = self._compress(cls,record,zdict=zdict)
+                for mode in ("r","r-"):
+                    f = cls(StringIO(data),mode,zdict=zdict)
+                    self.assertEquals(f.read(),record)
+
+    def test_zlib_format(self):
+        """The zlib format output can be read by the zlib module."""
+        data = self._compress(UnZlib,self.records[0])
+        self.assertEquals(zlib.decompress(data),self.records[0])
+        data = self._compress(UnZlib,self.records[0],zdict="some dictionary")
+        self.assertEquals(ord(data[1]) & 0x20,0x20)
+        self.assertEquals(data[2:6],struct.pack(">I",
+                                     zlib.adler32("some dictionary")))
+        self.assertRaises(IOError,UnZlib(StringIO(data),"r").read)
+        f = UnZlib(StringIO(data),"r",zdict="wrong dictionary")
+        self.assertRaises(IOError,f.read)
+
+    def test_train(self):
+        from filelike.wrappers.compress import train_zdict
+        zdict = train_zdict(self.records[:200],size=4096)
+        self.assert_(0 < len(zdict) <= 4096)
+        plain = 0
+        primed = 0
+        for record in self.records[200:]:
+            plain += len(self._compress(UnDeflate,record))
+            data = self._compress(UnDeflate,record,zdict=zdict)
+            primed += len(data)
+            f = UnDeflate(StringIO(data),"r",zdict=zdict)
+            self.assertEquals(f.read(),record)
+        self.assert_(primed * 2 < plain)
+
+    def test_append(self):
+        zdict = "".join(self.records[:20])
+        for cls in (UnZlib,UnDeflate):
+            s = StringIO(self._compress(cls,"hello ",zdict=zdict))
+            s.close = lambda: None
+            f = cls(s,"a",zdict=zdict)
+            f.write("world")
+            f.close()
+            f = cls(StringIO(s.getvalue()),"r",zdict=zdict)
+            self.assertEquals(f.read(),"hello world")
+
+
+def bgzf_compress(data):
+    s = StringIO()
+    s.close = lambda: None
+    f = UnBGZF(s,"w")
+    f.write(data)
+    f.close()
+    return s.getvalue()
+
+
+class Test_UnBGZF(tests.Test_ReadWrite):
+    """Testcases for UnBGZF wrapper class."""
+
+    contents = "This is my uncompressed\n test data"
+
+    def makeFile(self,contents,mode):
+        s = StringIO(bgzf_compress(contents))
+        f = UnBGZF(s,mode)
+        f.getvalue = def_getvalue_maybe_buffered(f,s,gz_decompress)
+        return f
+
+
+class Test_BGZF_Blocks(unittest.TestCase):
+    """Testcases for random access to BGZF files."""
+
+    data = "".join(["record %d: %s\n" % (i,"xyz"[i % 3] * (i % 41))
+                    for i in xrange(40000)])
+
+    def _write(self,**kwds):
+        s = StringIO()
+        s.close = lambda: None
+        f = UnBGZF(s,"w",**kwds)
+        voffsets = []
+        for i in xrange(0,len(self.data),10000):
+            self.assertEquals(f.tell(),i)
+            voffsets.append((i,f.tell_virtual()))
+            self.assertEquals(f.tell(),i)
+            f.write(self.data[i:i+10000])
+        f.close()
+        return (s.getvalue(),voffsets)
+
+    def test_format(self):
+        (compressed,_) = self._write()
+        self.assertEquals(gz_decompress(compressed),self.data)
+        self.assertEquals(UnGZip(StringIO(compressed),"r").read(),self.data)
+        self.assertEquals(UnGZip(StringIO(compressed),"r",threads=2).read(),
+                          self.data)
+        #  Walk the blocks using their BSIZE fields
+        pos = 0
+        nblocks = 0
+        while pos < len(compressed):
+            self.assertEquals(compressed[pos+12:pos+16],"BC\x02\x00")
+            size = struct.unpack("<H",compressed[pos+16:pos+18])[0] + 1
+            isize = struct.unpack("<I",compressed[pos+size-4:pos+size])[0]
+            self.assert_(isize <= 0xff00)
+            pos += size
+            nblocks += 1
+        self.assertEquals(pos,len(compressed))
+        self.assertEquals(nblocks,len(self.data) // 0xff00 + 2)
+        self.assertEquals(compressed[-28:],
+            "1f8b08040000000000ff0600424302001b0003000000000000000000"
+            .decode("hex"))
+
+    def test_seek(self):
+        (compressed,_) = self._write()
+        s = tests.CountingStringIO(compressed)
+        f = UnBGZF(s,"r")
+        f.seek(len(self.data) - 100)
+        self.assertEquals(f.read(),self.data[-100:])
+        import random
+        rnd = random.Random(3)
+        for _ in xrange(50):
+            pos = rnd.randint(0,len(self.data))
+            f.seek(pos)
+            self.assertEquals(f.tell(),pos)
+            nreads = s.nreads
+            self.assertEquals(f.read(100),self.data[pos:pos+100])
+            #  Only the blocks holding the data are read
+            self.assert_(s.nreads - nreads <= 6)
+        f.seek(-10,2)
+        self.assertEquals(f.read(),self.data[-10:])
+
+    def test_virtual_offsets(self):
+        (compressed,voffsets) = self._write()
+        f = UnBGZF(StringIO(compressed),"r")
+        for (pos,voffset) in reversed(voffsets):
+            f.seek_virtual(voffset)
+            self.assertEquals(f.tell(),pos)
+            self.assertEquals(f.read(20),self.data[pos:pos+20])
+            f.seek(pos)
+            self.assertEquals(f.tell_virtual(),voffset)
+        self.assertRaises(IOError,f.seek_virtual,(5 << 16))
+
+    def test_index(self):
+        from filelike.wrappers import compress
+        idx = StringIO()
+        idx.close = lambda: None
+        (compressed,voffsets) = self._write(index_file=idx)
+        entries = compress._read_gzi(StringIO(idx.getvalue()))
+        self.assertEquals(len(entries),len(self.data) // 0xff00 + 1)
+        for (coffset,uoffset) in entries:
+            self.assertEquals(compressed[coffset:coffset+4],
+                              "\x1f\x8b\x08\x04")
+        #  The last entry is the empty block at the end of the file
+        self.assertEquals([u % 0xff00 for (c,u) in entries[:-1]],
+                          [0] * (len(entries) - 1))
+        self.assertEquals(entries[-1],(len(compressed) - 28,len(self.data)))
+        #  With the index, seeking needs no scan of the block headers
+        s = tests.CountingStringIO(compressed)
+        f = UnBGZF(s,"r",index_file=StringIO(idx.getvalue()))
+        f.seek(len(self.data) - 100)
+        self.assert_(s.nreads <= 4)
+        self.assertEquals(f.read(),self.data[-100:])
+
+    def test_threaded(self):
+        (compressed,voffsets) = self._write(threads=3)
+        self.assertEquals((compressed,voffsets),self._write())
+        f = UnBGZF(StringIO(compressed),"r",threads=3)
+        self.assertEquals(f.read(),self.data)
+        f.seek_virtual(voffsets[5][1])
+        self.assertEquals(f.read(10),self.data[50000:50010])
+        self.assert_(len(f._fileobj._pending) <= 6)
+        f.close()
+
+    def test_threaded_tell(self):
+        s = StringIO()
+        s.close = lambda: None
+        f = UnBGZF(s,"w",threads=4)
+        positions = []
+        for i in xrange(0,len(self.data),50000):
+            f.write(self.data[i:i+50000])
+            self.assertEquals(f.tell(),min(len(self.data),i + 50000))
+            positions.append((f.tell(),f.tell_virtual()))
+        f.close()
+        f = UnBGZF(StringIO(s.getvalue()),"r")
+        for (pos,voffset) in positions:
+            f.seek_virtual(voffset)
+            self.assertEquals(f.tell(),pos)
+            self.assertEquals(f.read(20),self.data[pos:pos+20])
+        self.assertEquals(positions[-1][0],len(self.data))
+
+    def test_append(self):
+        s = StringIO(bgzf_compress("hello "))
+        s.close = lambda: None
+        f = UnBGZF(s,"a")
+        f.write("world")
+        f.close()
+        self.assertEquals(UnBGZF(StringIO(s.getvalue()),"r").read(),
+                          "hello world")
+        self.assertRaises(ValueError,UnBGZF,s,"a",index_file=StringIO())
@@ -85,3 +85,50 @@ class Test_Slice_StartStopResize(Test_Slice_Whole):
         self.assertEquals(f._fileobj.getvalue(),"myTESTDAta")
         self.assertEquals(f.stop,8)
         
+
+class UnseekableStream(object):
+    """Stream that fails loudly if seek() or tell() are used."""
+
+    def __init__(self,contents):
+        self._s = StringIO(contents)
+        self.mode = "r-"
+    def read(self,size=-1):
+        return self._s.read(size)
+    def seek(self,offset,whence=0):
+        raise AssertionError("seek() called on a stream")
+    def tell(self):
+        raise AssertionError("tell() called on a stream")
+
+
+class Test_Slice_Streamed(unittest.TestCase):
+    """Testcases for the Slice wrapper in streamed-read mode."""
+
+    contents = "0123456789" * 10000
+
+    def test_start(self):
+        f = Slice(UnseekableStream(self.contents),7,mode="r-")
+        self.assertEquals(f.read(5),self.contents[7:12])
+        self.assertEquals(f.read(),self.contents[12:])
+        self.assertEquals(f.read(),"")
+
+    def test_start_stop(self):
+        f = Slice(UnseekableStream(self.contents),70000,70010,mode="r-")
+        self.assertEquals(f.read(),self.contents[70000:70010])
+        self.assertEquals(f.read(),"")
+        f = Slice(UnseekableStream(self.contents),10,30000,mode="r-")
+        self.assertEquals("".join(f),self.contents[10:30000])
+
+    def test_negative_stop(self):
+        f = Slice(UnseekableStream(self.contents),5,-70000,mode="r-")
+        self.assertEquals(f.read(3),self.contents[5:8])
+        self.assertEquals(f.read(),self.contents[8:-70000])
+        f = Slice(UnseekableStream("short"),2,-10,mode="r-")
+        self.assertEquals(f.read(),"")
+
+    def test_start_past_eof(self):
+        f = Slice(UnseekableStream("short"),10,20,mode="r-")
+        self.assertEquals(f.read(),"")
+
+    def test_not_seekable(self):
+        f = Slice(UnseekableStream(self.contents),7,mode="r-")
+        self.assertRaises(IOError,f.seek,0)
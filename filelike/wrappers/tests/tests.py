@@ -1,4 +1,5 @@
 
+import filelike
 from filelike.wrappers import *
 from filelike import tests
 
@@ -41,6 +42,97 @@ class Test_OpenerDecoders(unittest.TestCase):
         self.assertEquals(f.read(),"contents")
         f.close()
     
+    def test_SniffGZipFile(self):
+        """Test decoding a gzipped file that has no .gz suffix."""
+        import gzip
+        f = gzip.GzipFile(self.tfilename,"wb")
+        f.write("compressed contents")
+        f.close()
+        f = filelike.open(self.tfilename,"r")
+        self.assertEquals(f.name,self.tfilename)
+        self.assertEquals(f.read(),"compressed contents")
+        f.close()
+
+    def test_SniffBZip2Text(self):
+        """Test that text starting like a bzip2 header isn't decoded."""
+        import bz2
+        for data in ("BZh9 is a bzip2 header","BZh1AY&SX and so on"):
+            f = open(self.tfilename,"w")
+            f.write(data)
+            f.close()
+            f = filelike.open(self.tfilename,"r")
+            self.assertEquals(f.read(),data)
+            f.close()
+        #  An empty bzip2 stream has only the end-of-stream magic
+        f = open(self.tfilename,"w")
+        f.write(bz2.compress(""))
+        f.close()
+        f = filelike.open(self.tfilename,"r")
+        self.assertEquals(f.read(),"")
+        f.close()
+
+    def test_GZipInsideGZip(self):
+        """Test that the output of a decoder is not sniffed again."""
+        import gzip
+        inner = StringIO()
+        f = gzip.GzipFile(fileobj=inner,mode="wb")
+        f.write("inner")
+        f.close()
+        f = gzip.GzipFile(self.tfilename,"wb")
+        f.write(inner.getvalue())
+        f.close()
+        #  Sniffed by contents, and matched by suffix
+        f = filelike.open(self.tfilename,"r")
+        self.assertEquals(f.read(),inner.getvalue())
+        f.close()
+        os.rename(self.tfilename,self.tfilename+".gz")
+        try:
+            f = filelike.open(self.tfilename+".gz","r")
+            self.assertEquals(f.name,self.tfilename)
+            self.assertEquals(f.read(),inner.getvalue())
+            f.close()
+        finally:
+            os.rename(self.tfilename+".gz",self.tfilename)
+
+    def test_SniffBZip2Stream(self):
+        """Test decoding a non-seekable bzipped stream by its contents."""
+        import bz2
+        class Stream(object):
+            name = "stream"
+            mode = "r-"
+            def __init__(self,data):
+                self._s = StringIO(data)
+            def read(self,size=-1):
+                return self._s.read(size)
+        data = bz2.compress("compressed contents")
+        opener = filelike.Opener(openers=[lambda fn,mode: Stream(data)])
+        opener.register_decoder(UnBZip2,suffixes=(".bz2",),magic=("BZh9",))
+        f = opener("stream","r-")
+        self.assertEquals(f.name,"stream")
+        self.assertEquals(f.read(),"compressed contents")
+        #  Non-matching contents are passed through unconsumed
+        data = "BZh is not enough"
+        f = opener("stream","r-")
+        self.assertEquals(f.read(),data)
+
+    def test_SuffixDecoderTable(self):
+        """Test that decoders are selected by suffix without sniffing."""
+        calls = []
+        def decoder(f):
+            calls.append(f.name)
+            return FileWrapper(f)
+        opener = filelike.Opener(openers=[lambda fn,mode: StringIO("x")])
+        opener.register_decoder(decoder,suffixes=(".one",".two"))
+        def opener_named(fn,mode):
+            s = StringIO("data")
+            s.name = fn
+            return s
+        opener.openers = [opener_named]
+        f = opener("test.two.one","r")
+        self.assertEquals(calls,["test.two.one","test.two"])
+        self.assertEquals(f.name,"test")
+        self.assertEquals(f.read(),"data")
+
     def test_RemoteBzFile(self):
         """Test opening a remote BZ2 file."""
         f = filelike.open("http://www.rfk.id.au/static/test.txt.bz2","r-")
@@ -54,6 +54,13 @@ class Translate(FileWrapper):
     remaining to be read/written.  If it needs to be reset after flushing,
     it should provide a reset() method.
 
+    A read function whose output can be much larger than its input (e.g.
+    decompression) may also provide a has_tail() method.  It is then called
+    with the size hint as a second argument, giving the maximum amount of
+    output to produce, and keeps any input it hasn't yet used; has_tail()
+    reports whether it is holding such input, which is used up before
+    more is read from the file.
+
     If the translation function operates on a byte-by-byte basis and
     does not buffer any data, consider using the 'BytewiseTranslate'
     class instead; the efficiency of several operations can be improved
@@ -124,6 +131,8 @@ class Translate(FileWrapper):
     def _read(self,sizehint=-1):
         if self._read_eof:
             return None
+        if hasattr(self._rfunc,"has_tail"):
+            return self._read_bounded(sizehint)
         data = self._fileobj.read(sizehint)
         if data == "":
             self._read_eof = True
@@ -135,6 +144,24 @@ class Translate(FileWrapper):
         self._pos += len(tData)
         return tData
     
+    def _read_bounded(self,sizehint):
+        """Read using a function that limits the size of its output."""
+        if sizehint <= 0:
+            sizehint = self._bufsize
+        if self._rfunc.has_tail():
+            tData = self._rfunc("",sizehint)
+        else:
+            data = self._fileobj.read(sizehint)
+            if data == "":
+                self._read_eof = True
+                tData = self._rfunc.flush()
+                if tData is None:
+                    return tData
+            else:
+                tData = self._rfunc(data,sizehint)
+        self._pos += len(tData)
+        return tData
+
     def _write(self,data,flushing=False):
         """Write the given data to the file."""
         self._pos += len(data)